@@ -12,13 +12,24 @@ Defender runtime:
 - per ogni comando nuovo:
     1) aggiorna la history
     2) usa il tuo RAG + Gemini per predire i prossimi 5 comandi
-       (VectorContextRetriever + make_rag_prompt + query_gemini)
+       (VectorContextRetriever + make_rag_prompt + backend Gemini di llm_backends.py, con cache su disco)
     3) per ciascuna delle 5 predizioni:
         - se esiste già una difesa (in defenses_index.json) → riusa
-        - altrimenti chiama un LLM per farsi dire quali file creare
+        - altrimenti chiama un LLM per farsi dire quali file creare (le richieste mancanti partono in parallelo)
     4) quando arriva il comando successivo:
         - se appartiene alle 5 predizioni → tiene solo quella branch
           ed elimina gli artefatti (file) creati per le altre 4
+    5) indicizzazione online: ogni coppia completata (finestra di contesto, comando successivo)
+       viene normalizzata e aggiunta al DB vettoriale in background, a batch, così le campagne
+       di attacco viste oggi aiutano già le predizioni di domani
+
+La retrieve consulta prima l'indice esatto delle finestre (rag_index.py, copiato nella VM accanto a
+questo script): se la finestra corrente è già nota, i comandi successivi più frequenti vengono
+restituiti senza embedding né ricerca vettoriale.
+
+Il DB vettoriale può essere la collection Chroma oppure lo store quantizzato autonomo di quantized_index.py
+(QUANTIZED, oppure automaticamente se nella VM è stata copiata solo la cartella quantized_<mode>): in quel caso
+chromadb non viene caricato e le coppie dell'indicizzazione online vengono aggiunte in coda allo store.
 """
 
 # -------------------------
@@ -27,6 +38,10 @@ Defender runtime:
 
 import json
 import time
+import hashlib
+import queue
+import threading
+from collections import Counter
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Any, Optional
@@ -34,11 +49,17 @@ import sys, os
 import shutil
 import subprocess
 import shlex
-from google.genai.types import HarmCategory, HarmBlockThreshold
-from google.genai import Client
-import chromadb
-from chromadb.utils import embedding_functions
+import numpy as np
 from dotenv import load_dotenv
+from rag_index import COLLAPSED_OVERFETCH, ExactWindowIndex, LexicalIndex, append_hashes, context_hash, rank_collapsed, vector_hash
+from embeddings import make_embedding_function
+from knn_predictor import use_llm
+# Stessa normalizzazione applicata al dataset Zenodo (inspectDataset/analyze_and_clean.py), così i vettori live sono confrontabili con quelli offline
+from utils import normalize_command
+from quantized_index import QuantizedIndex, find_store
+import llm_backends
+import llm_cache
+import token_usage
 
 # -------------------------
 # CONFIGURATIONS
@@ -48,12 +69,12 @@ from dotenv import load_dotenv
 env_path = Path(__file__).parent / ".env"
 load_dotenv(dotenv_path=env_path)
 
+LLM_BACKEND = "gemini"   # gemini | mock (risposte fisse senza rete, per provare il defender senza chiave API)
+
 api_key = os.getenv("api_key")
-if not api_key:
+if LLM_BACKEND == "gemini" and not api_key:
     sys.exit("ERRORE CRITICO: La variabile d'ambiente api_key non è impostata nel file .env")
 
-client_gemini = Client(api_key=api_key)
-
 #Creazione delle cartelle di output all'interno della cartella corrente
 REAL_FS_BASE = "/home/user"
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -72,48 +93,40 @@ os.makedirs(os.path.join(OUT_DIR, "debug"), exist_ok=True)
 # QUERY SECTION
 # -------------------------
 
-RAG_PERSIST_DIR = "/home/vagrant/chroma_storage_ctx5"   # <--- MODIFICA QUI
-CONTEXT_LEN = 5          # deve combaciare con --context-len usato per indicizzare il DB
+RAG_PERSIST_DIR = "/home/vagrant/chroma_storage"   # <--- MODIFICA QUI
+CONTEXT_LEN = 5          # scelto al momento della query: il DB multi-lunghezza contiene le finestre fino a max_context_len
 RAG_K = 3                
 PRED_K = 5              
 GEMINI_MODEL = "gemini-flash-latest"
-
-
-def query_gemini(prompt: str, model_name: str, temp: float = 0.0) -> str:
-
-    try:
-        #Visto che stiamo simulando degli attacchi, è necessario disattivare i blocchi di sicurezza
-        safety_config = [
-            {"category": HarmCategory.HARM_CATEGORY_HATE_SPEECH, "threshold": HarmBlockThreshold.BLOCK_NONE},
-            {"category": HarmCategory.HARM_CATEGORY_HARASSMENT, "threshold": HarmBlockThreshold.BLOCK_NONE},
-            {"category": HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, "threshold": HarmBlockThreshold.BLOCK_NONE},
-            {"category": HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT, "threshold": HarmBlockThreshold.BLOCK_NONE},
-        ]
-
-        response = client_gemini.models.generate_content(
-            model=model_name,
-            contents=prompt,
-            config={
-                "temperature": temp,
-                "top_p": 0.1,
-                "max_output_tokens": 1024,
-                "safety_settings": safety_config # APPLICHIAMO I FILTRI PERMISSIVI
-            }
-        )
-
-        # Controllo difensivo: se il modello restituisce None o non ha testo
-        if not response or not response.text: return ""
-        else: return response.text
-
-    except Exception as exc:
-        err_str = str(exc)
-        # Gestione dell'errore in caso di error 404
-        if "404" in err_str:
-            print(f"\n[ERRORE FATALE] Modello '{model_name}' non trovato.")
-            sys.exit(1)
-        # Restituzione di una stringa vuota per non rompere il loop
-        return ""
-
+PREDICTOR = "hybrid"     # llm | knn | hybrid (voto kNN sui vicini, LLM solo per i turni a bassa confidenza)
+KNN_NEIGHBORS = 20       # vicini recuperati dal DB per il voto kNN
+KNN_MIN_CONFIDENCE = 0.5 # quota di voto del primo candidato kNN sotto la quale si interroga Gemini
+RETRIEVAL_MODE = "vector"  # vector | lexical (BM25 sui token dei comandi, senza embedding) | hybrid (candidati BM25 + re-rank vettoriale)
+HYBRID_CANDIDATES = 10   # candidati lessicali per ogni esempio restituito in modalità hybrid
+QUANTIZED = None         # None | int8 | binary: store quantizzato autonomo (quantized_index.py, role db_vettoriale con vector_store) al posto della collection Chroma
+RERANK_FACTOR = 10       # candidati del passaggio quantizzato per ogni esempio restituito (re-rank sui vettori float16)
+EMBEDDING_BACKEND = "onnx"             # sentence-transformers | onnx | onnx-int8 (la VM non ha GPU -> modello ONNX su CPU)
+EMBEDDING_MODEL_DIR = "/home/vagrant/onnx_minilm"   # modello esportato con prompting/embeddings.py --export
+EMBEDDING_THREADS = 2    # thread CPU del modello di embedding (0 = default della libreria)
+LIVE_INDEX = True        # indicizzazione online delle sessioni dell'honeypot nel DB vettoriale
+LIVE_INDEX_BATCH = 32    # numero di coppie (contesto, next_command) per ogni scrittura nel DB
+LIVE_INDEX_FLUSH_S = 30  # scrittura forzata del batch dopo questo numero di secondi
+
+
+LLM_CACHE_PATH = os.path.join(OUT_DIR, "runtime", "llm_cache.sqlite3")   # cache su disco delle prediction (llm_cache.py)
+DEFENSE_CONCURRENCY = 5  # richieste di generazione delle difese in volo contemporaneamente
+TOKEN_USAGE_FILE = os.path.join(OUT_DIR, "runtime", "token_usage.jsonl")   # token e costo stimato di ogni chiamata (report: token_usage.py)
+
+# Backend condiviso con gli script di valutazione (llm_backends.py, copiato nella VM): client creato al primo utilizzo,
+# timeout, retry e risposte strutturate. Le prediction passano dalla cache su disco; le difese no, perché una risposta
+# non in formato JSON (difesa di fallback, non registrata) deve poter essere richiesta di nuovo al comando successivo
+_backend_options = {"api_key": api_key} if LLM_BACKEND == "gemini" else {}
+llm_prediction = llm_backends.make_backend(LLM_BACKEND, GEMINI_MODEL, cache=llm_cache.LLMCache(LLM_CACHE_PATH), **_backend_options)
+llm_defense = llm_backends.make_backend(LLM_BACKEND, GEMINI_MODEL, **_backend_options)
+# Predictor kNN sullo stesso backend: le risposte kNN sono registrate nella contabilità come quelle di Gemini (senza token né costo)
+knn_prediction = llm_backends.make_backend("knn", "knn")
+# Contabilità dei token per sessione e per tipo di chiamata (prediction / defense)
+token_ledger = token_usage.TokenLedger(TOKEN_USAGE_FILE)
 
 def make_rag_prompt(context_list: List[str], rag_text: str, k: int) -> str:
     current_history = "\n".join(context_list[-10:])
@@ -142,66 +155,278 @@ class VectorContextRetriever:
     def __init__(self, persist_dir: str, collection_name="honeypot_attacks"):
         print(f"--- Apertura RAG DB già esistente ({persist_dir}) ---")
 
-        # Apre un client che punta a un database ChromaDB già indicizzato
-        self.client = chromadb.PersistentClient(path=persist_dir)
-
         # Modello di embedding (necessario per effettuare query sul DB esistente)
-        self.emb_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name="all-MiniLM-L6-v2"
-        )
-
-        # Verifica che la collection esista già
-        existing = [c.name for c in self.client.list_collections()]
-        if collection_name not in existing:
-            raise ValueError(
-                f"La collection '{collection_name}' non esiste nel DB! "
-                f"Collection trovate: {existing}"
+        self.emb_fn = make_embedding_function(EMBEDDING_BACKEND, EMBEDDING_MODEL_DIR, EMBEDDING_THREADS)
+
+        # Store quantizzato autonomo (richiesto con QUANTIZED, oppure l'unico presente se nella cartella non c'è la collection Chroma):
+        # documenti, metadati e vettori sono nello store, che espone la stessa get/count/add della collection
+        store_dir = None
+        if QUANTIZED or not os.path.exists(os.path.join(persist_dir, "chroma.sqlite3")):
+            store_dir = find_store(persist_dir, QUANTIZED)
+            if store_dir is None:
+                raise ValueError(f"Nessuna collection Chroma né store quantizzato {QUANTIZED or ''} in {persist_dir}")
+        self.quantized = store_dir is not None
+        if self.quantized:
+            self.collection = QuantizedIndex(store_dir, self.emb_fn)
+            print(f"--- Store quantizzato {self.collection.mode} caricato correttamente ({self.collection.count()} vettori) ---")
+        else:
+            # Apre un client che punta a un database ChromaDB già indicizzato (chromadb importato solo se serve la collection)
+            import chromadb
+            self.client = chromadb.PersistentClient(path=persist_dir)
+
+            # Verifica che la collection esista già
+            existing = [c.name for c in self.client.list_collections()]
+            if collection_name not in existing:
+                raise ValueError(
+                    f"La collection '{collection_name}' non esiste nel DB! "
+                    f"Collection trovate: {existing}"
+                )
+
+            # Apertura della collection esistente (NO creazione!)
+            self.collection = self.client.get_collection(
+                name=collection_name,
+                embedding_function=self.emb_fn
             )
 
-        # Apertura della collection esistente (NO creazione!)
-        self.collection = self.client.get_collection(
-            name=collection_name,
-            embedding_function=self.emb_fn
-        )
+            print(f"--- Collection '{collection_name}' caricata correttamente ---")
 
-        print(f"--- Collection '{collection_name}' caricata correttamente ---")
+        # DB multi-lunghezza (core_rag.index_file) -> filtro window_len in retrieve; DB legacy -> una sola lunghezza, nessun filtro
+        metadata = self.collection.metadata or {}
+        self.multi_len = metadata.get("layout") == "multi_len"
+        self.max_context_len = metadata.get("max_context_len", CONTEXT_LEN)
+        self.collapsed = bool(metadata.get("collapsed", False))
 
-    def retrieve(self, current_context_list: List[str], k: int) -> str:
+        # Indice esatto delle finestre (costruito da core_rag.index_file accanto al DB Chroma)
+        self.exact_index = ExactWindowIndex(persist_dir)
+        self.exact_lookups = 0
+        self.exact_hits = 0
 
-        if not current_context_list:
-            return ""
+        # Indice lessicale BM25 (costruito da core_rag.index_file, oppure qui dalla collection se assente)
+        self.lexical_index = LexicalIndex(persist_dir)
+        if RETRIEVAL_MODE != "vector" and self.lexical_index.count() == 0:
+            print("--- Indice lessicale assente: costruzione dalla collection ---")
+            self.lexical_index.build_from_collection(self.collection)
 
-        query_text = " || ".join(current_context_list)
+    def retrieve_examples(self, current_context_list: List[str], k: int) -> List[Dict[str, Any]]:
 
-        # Query ai vettori già presenti nel DB
-        results = self.collection.query(
-            query_texts=[query_text],
-            n_results=k
-        )
+        if not current_context_list:
+            return []
+
+        if self.multi_len:
+            current_context_list = current_context_list[-self.max_context_len:]
+        # Query normalizzata come i documenti del DB (offline e live), usata da indice esatto, retrieve lessicale e ricerca vettoriale
+        query_text = " || ".join(normalize_command(c) for c in current_context_list)
+
+        # Percorso veloce -> la finestra è già presente nell'indice esatto
+        self.exact_lookups += 1
+        continuations = self.exact_index.lookup(query_text, k)
+        if continuations:
+            self.exact_hits += 1
+            return [{"context": query_text, "next_command": cmd, "distance": 0.0, "count": count} for cmd, count in continuations]
+        else:
+            # Retrieve lessicale / ibrida -> se nessun token è in comune con il DB si passa alla ricerca vettoriale
+            if RETRIEVAL_MODE != "vector":
+                examples = self.retrieve_lexical(query_text, len(current_context_list) if self.multi_len else 0, k)
+                if examples:
+                    return examples
+
+            # DB collapsed -> si recuperano k * COLLAPSED_OVERFETCH cluster vicini, riordinati per similarità pesata con le occorrenze
+            n_results = k * COLLAPSED_OVERFETCH if self.collapsed else k
+
+            # Query allo store quantizzato (passaggio sui codici + re-rank sui vettori float16)
+            if self.quantized:
+                found = self.collection.search(self.emb_fn([query_text]), n_results, rerank_factor=RERANK_FACTOR,
+                                               window_len=len(current_context_list) if self.multi_len else None)[0]
+                return self.rank([make_example(ex["context"], ex["metadata"], ex["distance"]) for ex in found], [ex["metadata"] for ex in found], k)
+
+            # Query ai vettori già presenti nel DB
+            results = self.collection.query(
+                query_texts=[query_text],
+                n_results=n_results,
+                where={"window_len": len(current_context_list)} if self.multi_len else None
+            )
 
-        if not results['ids']:
-            return ""
+            if not results['ids']:
+                return []
+
+            # Estrazione dati
+            docs = results['documents'][0]
+            metas = results['metadatas'][0]
+            dists = results['distances'][0]
+            return self.rank([make_example(docs[i], metas[i], dists[i]) for i in range(len(docs))], metas, k)
+
+    def retrieve_lexical(self, query_text: str, window_len: int, k: int) -> List[Dict[str, Any]]:
+        # lexical -> i k migliori candidati BM25 (distance = 1 / (1 + punteggio)); hybrid -> candidati BM25 riordinati con la distanza L2 al quadrato
+        hybrid = RETRIEVAL_MODE == "hybrid"
+        hits = self.lexical_index.search(query_text, window_len, k * HYBRID_CANDIDATES if hybrid else k)
+        if not hits:
+            return []
+        got = self.collection.get(ids=[vector_id for vector_id, _ in hits], include=["documents", "metadatas"] + (["embeddings"] if hybrid else []))
+        by_id = {vector_id: i for i, vector_id in enumerate(got["ids"])}
+        hits = [(vector_id, score) for vector_id, score in hits if vector_id in by_id]
+
+        if hybrid and hits:
+            query_emb = np.asarray(self.emb_fn([query_text])[0], dtype=np.float32)
+            dists = [float(((np.asarray(got["embeddings"][by_id[vector_id]], dtype=np.float32) - query_emb) ** 2).sum()) for vector_id, _ in hits]
+            scored = sorted(zip((vector_id for vector_id, _ in hits), dists), key=lambda item: item[1])
+        else:
+            scored = [(vector_id, 1 / (1 + score)) for vector_id, score in hits[:k]]
+        metas = [got["metadatas"][by_id[vector_id]] for vector_id, _ in scored]
+        return self.rank([make_example(got["documents"][by_id[vector_id]], meta, distance) for (vector_id, distance), meta in zip(scored, metas)], metas, k)
 
-        # Estrazione dati
-        ids = results['ids'][0]
-        docs = results['documents'][0]
-        metas = results['metadatas'][0]
+    def rank(self, examples: List[Dict[str, Any]], metas: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+        # Stesso ranking dei cluster di core_rag.retrieve_many (rag_index.rank_collapsed); DB non collapsed -> ordine per distanza
+        return rank_collapsed(examples, metas, k) if self.collapsed else examples[:k]
 
-        formatted_examples = ""
+    def retrieve(self, current_context_list: List[str], k: int) -> str:
+        return format_examples(self.retrieve_examples(current_context_list, k))
+
+def make_example(doc: str, meta: Dict[str, Any], distance: float) -> Dict[str, Any]:
+    ex = {"context": doc, "next_command": meta['next_command'], "distance": distance}
+    # DB collapsed -> ogni esempio è un cluster di quasi-duplicati con occorrenze e istogramma dei comandi successivi
+    if "next_hist" in meta:
+        ex["count"] = meta.get("count", 1)
+        ex["next_hist"] = json.loads(meta["next_hist"])
+    return ex
+
+def format_examples(examples: List[Dict[str, Any]]) -> str:
+    formatted_examples = ""
+
+    for i, ex in enumerate(examples):
+        hist_ctx = ex["context"].replace(" || ", "\n")
+
+        formatted_examples += (
+            f"--- SIMILAR PAST ATTACK (Example {i+1}) ---\n"
+            f"Context:\n{hist_ctx}\n"
+            f"Attacker Next Move:\n{ex['next_command']}\n"
+            + (f"Observed: {ex['count']} times\n" if "next_hist" in ex else "")
+            + "\n"
+        )
 
-        for i in range(len(ids)):
-            hist_ctx = docs[i].replace(" || ", "\n")
-            hist_next = metas[i]['next_command']
+    return formatted_examples
 
-            formatted_examples += (
-                f"--- SIMILAR PAST ATTACK (Example {i+1}) ---\n"
-                f"Context:\n{hist_ctx}\n"
-                f"Attacker Next Move:\n{hist_next}\n\n"
-            )
+rag = VectorContextRetriever(persist_dir=RAG_PERSIST_DIR)
 
-        return formatted_examples
+# -------------------------
+# LIVE INDEXING SECTION -> indicizzazione online delle sessioni osservate dall'honeypot
+# -------------------------
 
-rag = VectorContextRetriever(persist_dir=RAG_PERSIST_DIR)
+class LiveIndexer:
+    """
+    Buffer delle coppie (finestra di contesto, comando successivo) completate nelle sessioni live.
+    Un thread in background (a priorità ridotta) le scrive nel DB a batch: l'embedding avviene fuori dal
+    percorso di predizione, quindi la latenza della retrieve non cambia. Gli id dei vettori usano lo stesso
+    schema SHA1 di core_rag.index_file, perciò le coppie già presenti nel DB (offline o live) vengono scartate.
+    Con un DB multi-lunghezza ogni coppia genera le finestre di tutte le lunghezze (come index_file).
+    """
+
+    def __init__(self, collection, exact_index: ExactWindowIndex, lexical_index: LexicalIndex, persist_dir: str, batch_size: int, flush_s: float,
+                 window_lens: List[int] = None):
+        self.collection = collection
+        self.exact_index = exact_index
+        self.lexical_index = lexical_index
+        # Lunghezze delle finestre da indicizzare (None -> DB legacy, una sola finestra senza metadato window_len)
+        self.window_lens = window_lens
+        self.seen_path = os.path.join(persist_dir, "DB_seen_ids.bin")
+        self.batch_size = batch_size
+        self.flush_s = flush_s
+        self.pending = queue.Queue()
+        self.seen_ids = set()
+        self.thread = threading.Thread(target=self._run, name="live-indexer", daemon=True)
+        self.thread.start()
+
+    def add_pair(self, session_key: str, window: List[str], next_cmd: str):
+        context = [normalize_command(c) for c in window]
+        target = normalize_command(next_cmd)
+        if not context or not target:
+            return
+        if self.window_lens is None:
+            self.pending.put((session_key, " || ".join(context), target, None))
+            return
+        for window_len in self.window_lens:
+            if window_len <= len(context):
+                self.pending.put((session_key, " || ".join(context[-window_len:]), target, window_len))
+
+    def stop(self):
+        self.pending.put(None)
+        self.thread.join()
+
+    def _run(self):
+        # Priorità ridotta per il thread di scrittura (su Linux ogni thread ha il suo valore di nice)
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+
+        batch = []
+        last_flush = time.time()
+        while True:
+            try:
+                item = self.pending.get(timeout=1)
+            except queue.Empty:
+                item = ""
+            if item is None:
+                break
+            if item:
+                batch.append(item)
+            if len(batch) >= self.batch_size or (batch and time.time() - last_flush >= self.flush_s):
+                self._flush(batch)
+                batch = []
+                last_flush = time.time()
+        if batch:
+            self._flush(batch)
+
+    def _flush(self, batch: List[tuple]):
+        # Le frequenze dell'indice esatto contano tutte le occorrenze, anche delle coppie già presenti nel DB
+        self.exact_index.add_counts(Counter((context_hash(context_str), target_cmd) for _, context_str, target_cmd, _ in batch))
+
+        documents, metadatas, ids = [], [], []
+        for session_key, context_str, target_cmd, window_len in batch:
+            vector_id = hashlib.sha1(f"{context_str}@@{target_cmd}".encode()).hexdigest()
+            if vector_id in self.seen_ids or vector_id in ids:
+                continue
+            documents.append(context_str)
+            metadata = {
+                "next_command": target_cmd,
+                "session_id": session_key,
+                "original_line": -1,
+                "source": "live"
+            }
+            if window_len is not None:
+                metadata["window_len"] = window_len
+            metadatas.append(metadata)
+            ids.append(vector_id)
+        if not ids:
+            return
+
+        try:
+            # Scarto le coppie già presenti nel DB
+            existing = set(self.collection.get(ids=ids, include=[])["ids"])
+            self.seen_ids.update(existing)
+            keep = [i for i, vector_id in enumerate(ids) if vector_id not in existing]
+            if not keep:
+                return
+            new_ids = [ids[i] for i in keep]
+            self.collection.add(
+                documents=[documents[i] for i in keep],
+                metadatas=[metadatas[i] for i in keep],
+                ids=new_ids
+            )
+            self.lexical_index.add([(ids[i], documents[i], metadatas[i].get("window_len", 0)) for i in keep])
+            self.seen_ids.update(new_ids)
+            # Allineamento del set compatto usato da index_file per la ripresa dell'indicizzazione offline
+            append_hashes(self.seen_path, (vector_hash(vector_id) for vector_id in new_ids))
+            print(f"[LIVE-INDEX] Aggiunti {len(new_ids)} nuovi vettori al DB")
+        except Exception as e:
+            print(f"[LIVE-INDEX] Errore durante la scrittura nel DB: {e}")
+
+# Un DB collapsed contiene solo rappresentanti di cluster (ricostruiti offline) -> nessuna indicizzazione online
+if LIVE_INDEX and rag.collapsed:
+    print("[LIVE-INDEX] DB collapsed: indicizzazione online disattivata")
+live_indexer = LiveIndexer(
+    rag.collection, rag.exact_index, rag.lexical_index, RAG_PERSIST_DIR, LIVE_INDEX_BATCH, LIVE_INDEX_FLUSH_S,
+    window_lens=list(range(1, rag.max_context_len + 1)) if rag.multi_len else None
+) if LIVE_INDEX and not rag.collapsed else None
 
 # -------------------------
 # UTILS SECTION
@@ -261,6 +486,11 @@ def update_history(session_key: str, cmd: str):
     cmds.append(cmd)
     save_commands_state()
 
+    # Il nuovo comando completa la coppia (finestra dei comandi precedenti, comando successivo) -> indicizzazione online
+    if live_indexer and len(cmds) > 1:
+        window_len = rag.max_context_len if rag.multi_len else CONTEXT_LEN
+        live_indexer.add_pair(session_key, cmds[-(window_len + 1):-1], cmd)
+
 
 # -------------------------
 # GESTIONE DB ARTEFATTI GIA' GENERATI
@@ -312,6 +542,9 @@ def handle_new_command(entry: Dict[str, Any]):
     # 4) Crea/applica difese per le 5 direzioni
     plan_and_apply_defenses(session_key, predictions)
     print(f"[DONE] Difese generate per '{cmd}' (session: {session_key})")
+    usage = token_ledger.session_totals(session_key)
+    print(f"[TOKEN] Sessione {session_key}: {usage['calls']} chiamate ({usage['knn']} risposte kNN) | prompt {usage['prompt_tokens']} generati {usage['completion_tokens']} "
+          f"| costo stimato ${usage['cost_usd']:.4f}")
 
 
 def cleanup_other_branches(session_key: str, actual_cmd: str):
@@ -369,14 +602,29 @@ def predict_next_commands(session_key: str) -> List[str]:
 
     context_list = history[-CONTEXT_LEN:]
 
-    #  Recupero esempi di attacchi simili dal DB vettoriale
-    rag_text = rag.retrieve(current_context_list=context_list, k=RAG_K)
+    #  Recupero esempi di attacchi simili dal DB vettoriale (KNN_NEIGHBORS vicini per il voto kNN, i primi RAG_K per il prompt)
+    n_neighbors = RAG_K if PREDICTOR == "llm" else max(RAG_K, KNN_NEIGHBORS)
+    examples = rag.retrieve_examples(current_context_list=context_list, k=n_neighbors)
+    print(f"[RAG] Percorso veloce (finestra esatta): {rag.exact_hits}/{rag.exact_lookups}")
+
+    # Predictor kNN -> voto pesato sulla distanza dei next_command dei vicini, in pochi millisecondi e senza chiamare Gemini
+    if PREDICTOR != "llm":
+        response = knn_prediction.generate("", examples=examples, k=PRED_K)
+        token_ledger.record("prediction", response, session_key)
+        candidates, confidence = response.text.splitlines(), response.meta["confidence"]
+        if candidates and not use_llm(PREDICTOR, confidence, KNN_MIN_CONFIDENCE):
+            print(f"[PREDICTION] Risposta kNN (confidenza {confidence:.2f})\n")
+            return candidates
+        print(f"[PREDICTION] Confidenza kNN {confidence:.2f} sotto soglia -> interrogo Gemini")
 
     # Costruzione prompt
+    rag_text = format_examples(examples[:RAG_K])
     prompt = make_rag_prompt(context_list=context_list, rag_text=rag_text, k=PRED_K)
 
     # Chiamata Gemini
-    raw = query_gemini(prompt, model_name=GEMINI_MODEL)
+    response = llm_prediction.generate(prompt)
+    token_ledger.record("prediction", response, session_key)
+    raw = response.text
     
     candidates = []
     if raw:
@@ -401,6 +649,15 @@ def plan_and_apply_defenses(session_key: str, predictions: List[str]):
         # Se NON esiste -> viene inviata una query Gemini per far generare gli artefatti da LLM
     # In entrambi i casi, la difesa viene prodotta e inserita nella cartella /defense_artifacts (logica), ma i file reali nel filesystem sono creati in intended_path
 
+    # Le difese mancanti vengono richieste al LLM tutte insieme, in parallelo (al più DEFENSE_CONCURRENCY richieste in volo)
+    missing = list(dict.fromkeys(cmd for cmd in predictions if not find_existing_defense(cmd)))
+    for cmd_pred in missing:
+        print(f"[DEFENSE] Pensando agli artefatti da creare per il comando {cmd_pred.replace('%', '%%')}")
+    responses = llm_backends.generate_many(llm_defense, [make_defense_prompt(cmd) for cmd in missing], DEFENSE_CONCURRENCY)
+    for response in responses:
+        token_ledger.record("defense", response, session_key)
+    raw_by_cmd = {cmd: response.text for cmd, response in zip(missing, responses)}
+
     for cmd_pred in predictions:
         existing = find_existing_defense(cmd_pred)
 
@@ -409,7 +666,7 @@ def plan_and_apply_defenses(session_key: str, predictions: List[str]):
             defense_meta = existing
         else:
             new_defenses.append(cmd_pred)
-            defense_meta, fallback = create_defense_for_predicted_command(cmd_pred, session_key)
+            defense_meta, fallback = create_defense_for_predicted_command(cmd_pred, raw_by_cmd.get(cmd_pred, ""))
             # Salviamo solo se NON è fallback
             if not fallback:
                 register_defense(cmd_pred, defense_meta)
@@ -434,11 +691,9 @@ def plan_and_apply_defenses(session_key: str, predictions: List[str]):
 # ARTFICATS SECTION -> functions used by plan_and_apply_defenses for the to think and create defense artifacts                              
 # -------------------------
 
-def create_defense_for_predicted_command(command: str, session_key: str) -> Dict[str, Any]:
+def make_defense_prompt(command: str) -> str:
     cmd_safe = command.replace("%", "%%")
-    print(f"[DEFENSE] Pensando agli artefatti da creare per il comando {cmd_safe}")
-
-    prompt = f"""
+    return f"""
 You must output ONLY a JSON object.
 
 FORMAT (STRICT):
@@ -460,8 +715,7 @@ RULES:
 Generate JSON for predicted command: "{cmd_safe}".
 """.strip()
 
-    raw = query_gemini(prompt, model_name=GEMINI_MODEL)
-
+def create_defense_for_predicted_command(command: str, raw: str) -> Dict[str, Any]:
     fallback = False
     try:
         defense = json.loads(raw)
@@ -575,6 +829,12 @@ def main():
                 print("[ERROR] durante handle_new_command:", e)
     except KeyboardInterrupt:
         print("\n[STOP] Interrotto da tastiera.")
+    finally:
+        # Scrittura nel DB delle coppie ancora nel buffer
+        if live_indexer:
+            live_indexer.stop()
+        print(token_ledger.summary())
+        token_ledger.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -10,7 +10,8 @@
     Il codice è uno script Python per processare un SINGOLO file del dataset Zenodo record=3687527, contenente sessioni di attacco di un Cowrie SSH honeypot.
     Le funzioni presentate e le loro funzionalità principali sono:
 
-        - normalize_command(cmd: str) -> Pulisce e normalizza un singolo comando shell (rimuove informazioni sensibili, maschera URL, IP, file, password ecc.)
+        - normalize_command(cmd: str) -> Pulisce e normalizza un singolo comando shell (rimuove informazioni sensibili, maschera URL, IP, file, password ecc.),
+          definita in prompting/utils.py e condivisa con il defender
         - filter_short_sessions(file_path: str, min_length: int = 5) -> Filtra le sessioni con meno di min_length comandi
         - analyze_cowrie_dataset(input_file: str, output_prefix: str) -> Analizza un file aggregato di sessioni Cowrie e genera file di output a seconda dell'opzione --want: file RAW (comandi NON normalizzati) e file CLEAN (comandi normalizzati), restituendo le statistiche
 
@@ -37,25 +38,16 @@ from collections import defaultdict, Counter
 import statistics
 import os
 import re
+import sys
+
+# Import locale -> normalize_command è condivisa con il defender (prompting/utils.py, copiato nella VM dal role Ansible defender)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prompting"))
+from utils import normalize_command
 
 # -------------------------
 # FUNCTIONS SECTION -> definition of the functions explained in the introduction
 # -------------------------
 
-def normalize_command(cmd: str) -> str:
-    cmd = cmd.strip()
-    cmd = re.sub(r'^CMD:\s*', '', cmd)
-    cmd = re.sub(r'echo\s+-e\s+"[^"]+"(\|passwd\|bash)?', 'echo <SECRET>|passwd', cmd)
-    cmd = re.sub(r'echo\s+"[^"]+"\|passwd', 'echo <SECRET>|passwd', cmd)
-    cmd = re.sub(r'/var/tmp/[\.\w-]*\d{3,}', '/var/tmp/<FILE>', cmd)
-    cmd = re.sub(r'/tmp/[\.\w-]*\d{3,}', '/tmp/<FILE>', cmd)
-    cmd = re.sub(r'\b[\w\.-]+\.(log|txt|sh|bin|exe|tgz|gz)\b', '<FILE>', cmd)
-    cmd = re.sub(r'(https?|ftp)://\S+', '<URL>', cmd)
-    cmd = re.sub(r'\b\d{1,3}(?:\.\d{1,3}){3}\b', '<IP>', cmd)
-    cmd = re.sub(r'echo\s+"admin\s+[^"]+"', 'echo "admin <SECRET>"', cmd)
-    cmd = re.sub(r'\s+', ' ', cmd).strip()
-    return cmd
-
 def filter_short_sessions(file_path: str, min_length: int):
     filtered_lines = []
 
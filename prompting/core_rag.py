@@ -18,16 +18,48 @@ questa libreria sono presenti i seguenti elementi:
     Questo elemento può essere utile per prevedere il successivo comando inserito da un'attaccante. 
     La classe presenta diverse funzioni:
     
-    - __init__(self, persist_dir: str, collection_name="honeypot_attacks") -> configurazione del rag DB (Chroma), con creazione del client e definizione del modello di embedding
-    - load_seen_vectors(self) -> funzione utilitaria utilizzata all'interno della successiva funzione. Nel caso di blocco durante l'indicizzazione, tale funzione serve per caricare all'interno di un set i vettori già indicizzati nel DB (per evitare di indicizzare vettori uguali provenienti da sessioni differenti)
-    - index_file(self, jsonl_path: str, context_len: int) -> indicizzazione del DB vettoriale con finestre scorrevoli della sessione di attacco (caratterizzate da contesto e next_command). Tale funzione è stata progettata per non indicizzare vettori uguali provenienti da sessioni differenti e presenta un sistema di recovery per continuare indicizzazione da dove si era interrotta.
+    - __init__(self, persist_dir: str, collection_name="honeypot_attacks", ...) -> configurazione del rag DB (Chroma), con creazione del client e definizione del modello di embedding
+    - load_seen_vectors(self, seen_path: str) -> funzione utilitaria utilizzata all'interno della successiva funzione. Nel caso di blocco durante l'indicizzazione, tale funzione serve per caricare all'interno di un set gli hash a 64 bit degli id (SHA1) dei vettori già indicizzati nel DB (per evitare di indicizzare vettori uguali provenienti da sessioni differenti). Gli hash sono letti dal file compatto seen_path (8 byte per vettore, salvato accanto a DB_checkpoint.txt); solo se il file manca (DB creati con versioni precedenti) vengono ricostruiti leggendo gli id dal DB
+    - index_file(self, jsonl_path: str, max_context_len: int, checkpoint_path: str, batch_size: int = 4000, workers: int = 0) -> indicizzazione del DB vettoriale con le finestre della sessione di attacco (caratterizzate da contesto e next_command) di ogni lunghezza da 1 a max_context_len, con la lunghezza salvata nel metadato window_len. Tale funzione è stata progettata per non indicizzare vettori uguali provenienti da sessioni differenti e presenta un sistema di recovery per continuare indicizzazione da dove si era interrotta. L'indicizzazione è una pipeline in streaming: il file viene letto riga per riga, gli embedding sono calcolati da un pool di worker (batch di batch_size documenti) e un writer dedicato aggiunge al DB gli embedding già calcolati, aggiornando il checkpoint
     - retrieve(self, current_context_list: List[str], k: int = 3) -> funzione che, dato un contesto di attacco, restituisce i contesti simili ritrovati all'interno del DB
+    - retrieve_many(self, context_lists: List[List[str]], k: int, batch_size: int = 256) -> versione batch della retrieve: calcola gli embedding a blocchi ed esegue una sola query multipla a Chroma per blocco, restituendo per ogni contesto una lista di esempi strutturati (context, next_command, distance, session_id)
+    
+    Il DB è unico per tutte le context length: viene costruito una sola volta con le finestre di ogni lunghezza fino a max_context_len e la retrieve filtra
+    per window_len = lunghezza del contesto corrente (i contesti più lunghi di max_context_len vengono troncati agli ultimi max_context_len comandi).
+    I DB creati con versioni precedenti (una cartella {persist_dir}_ctx{context_len} per ogni lunghezza, senza window_len) restano interrogabili senza filtro.
+    Durante l'indicizzazione viene costruito anche l'indice esatto delle finestre (rag_index.ExactWindowIndex): la retrieve lo consulta per primo e, se la finestra
+    corrente è già presente, restituisce subito i comandi successivi più frequenti (distance = 0), senza embedding né ricerca vettoriale. Gli attributi
+    exact_lookups ed exact_hits contano quante volte è stato preso il percorso veloce (disattivabile con use_exact_index=False, per misurare la sola ricerca vettoriale).
+    Con il parametro quantized ("int8" o "binary") la ricerca vettoriale usa l'indice quantizzato costruito da quantized_index.py in persist_dir/quantized_<mode>
+    (passaggio veloce sui codici quantizzati + re-rank sui vettori float16 salvati) al posto della query alla collection Chroma.
+    Se in persist_dir non c'è la collection Chroma (es. VM con la sola cartella quantized_<mode> e rag_index.sqlite3) lo store quantizzato
+    sostituisce la collection anche per documenti, metadati e conteggi (attributo standalone, chromadb non viene importato).
+    Il parametro hnsw (metadati "hnsw:space", "hnsw:M", "hnsw:construction_ef", "hnsw:search_ef", vedi hnsw_metadata) imposta l'indice HNSW
+    alla creazione della collection, per bilanciare recall, latenza e memoria (prompting/hnsw_sweep.py suggerisce le configurazioni migliori).
+    Con collapse=True (solo alla creazione del DB) le finestre quasi-duplicate vengono raggruppate: il DB contiene un rappresentante per cluster
+    con occorrenze (count) e istogramma dei comandi successivi (next_hist), e la retrieve ordina i cluster vicini pesando la similarità con la frequenza.
+    Con retrieval_mode = "lexical" la retrieve usa solo l'indice invertito BM25 sui token dei comandi (rag_index.LexicalIndex, nessun embedding);
+    con "hybrid" i candidati lessicali vengono riordinati con la distanza vettoriale. L'indice lessicale viene costruito durante index_file
+    (oppure, per i DB esistenti, dalla collection alla prima apertura in modalità lexical/hybrid).
+    Il modello di embedding è scelto con il parametro embedding_backend (embeddings.py): sentence-transformers (default) oppure
+    lo stesso modello esportato in ONNX / ONNX int8 ed eseguito su CPU con embedding_threads thread, con vettori compatibili con il DB
 
 - Funzioni (utilizzate nei suddetti file):
+    - count_lines(path: str) / read_lines(path: str, start_line: int) = funzioni utilitarie per contare e leggere in streaming le righe del file da indicizzare
     - hit_db(target_cmd: str, retrieved_examples_text: str) = funzione che serve per verificare se il comando obiettivo della prediction è stato indovinato attraverso la retrieve all'interno del DB vettoriale
+    - hit_db_examples(target_cmd: str, examples: List[Dict[str, Any]]) = come hit_db, ma lavora sugli esempi strutturati restituiti da retrieve_many
+    - format_examples(examples: List[Dict[str, Any]]) = trasforma gli esempi strutturati nel testo inserito all'interno del prompt RAG
     - make_rag_prompt(context_list: List[str], rag_text: str, k: int)
+    - make_rag_prompt_packed(context_lists: List[List[str]], rag_texts: List[str], k: int) = più task, ognuno con i propri esempi, in un solo prompt a sezioni numerate (--pack N, vedi packing.py)
     - prediction_evaluation(args) = funzione che viene chiamata dai suddenti file e che invia al LLM 
-        il prompt, a seconda dei parametri specificati da utente
+        il prompt, a seconda dei parametri specificati da utente. Le richieste al LLM sono eseguite in parallelo dal runner
+        concorrente (runner.py, args.concurrency richieste in volo e args.rps richieste al secondo), con scrittura dei risultati nell'ordine dei task.
+        Le risposte del LLM passano dalla cache su disco (llm_cache.py, args.llm_cache / args.cache_mode). I task sono generati
+        da eval_tasks.py (args.seed, lista salvata accanto ai risultati) e con args.resume l'esecuzione riprende dai task non ancora valutati.
+        Con args.pack > 1 più job delegati al LLM condividono lo stesso prompt (packing.py) e con args.pack_parity i primi vengono
+        valutati anche senza packing per confrontarne l'accuracy. Accuracy, empty rate, latenze di retrieve e LLM e token sono
+        aggiornati durante l'esecuzione (live_metrics.py, args.metrics_interval)
+        e token e costo stimato di ogni chiamata al LLM sono registrati in <output>.usage.jsonl (token_usage.py)
 """
 
 # -------------------------
@@ -35,16 +67,27 @@ questa libreria sono presenti i seguenti elementi:
 # -------------------------
 
 import hashlib
+import itertools
 import os
 import sys
 import json
 import time
-import random
+import queue
+import threading
+import eval_tasks
+import live_metrics
+import llm_backends
+import llm_cache
+import packing
+import runner
+import token_usage
 import utils
-from typing import List
-from tqdm import tqdm
-import chromadb
-from chromadb.utils import embedding_functions
+from rag_index import COLLAPSED_OVERFETCH, CollapsedWindowIndex, ExactWindowIndex, LexicalIndex, append_hashes, canonical_window, context_hash, load_hashes, rank_collapsed, vector_hash
+from embeddings import DEFAULT_MODEL_DIR, make_embedding_function
+from knn_predictor import use_llm
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
 
 # -------------------------
 # CLASS SECTION
@@ -53,44 +96,101 @@ from chromadb.utils import embedding_functions
 
 class VectorContextRetriever:
     # Inizializzazione RAG DB
-    def __init__(self, persist_dir: str, collection_name="honeypot_attacks"):
+    def __init__(self, persist_dir: str, collection_name="honeypot_attacks", quantized: str = None, rerank_factor: int = 10, max_context_len: int = 10,
+                 embedding_backend: str = "sentence-transformers", embedding_threads: int = 0, onnx_model_dir: str = DEFAULT_MODEL_DIR,
+                 use_exact_index: bool = True, hnsw: Dict[str, Any] = None, collapse: bool = False, retrieval_mode: str = "vector"):
         print(f"--- Inizializzazione RAG DB ({persist_dir}) ---")
 
-        # Creazione client che gestisce un vector database ChromaDB, database contenente embeddings
-        self.client = chromadb.PersistentClient(path=persist_dir)
         # Modello di embedding utile per eseguire ricerca all'interno di un db in quanto veloce e leggero -> ogni vettore è costituito da 384 elementi
-        self.emb_fn = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
-        # Creazione della tabella honeypot_attacks (parametro passato) all'interno del DB
-        self.collection = self.client.get_or_create_collection(name=collection_name,embedding_function=self.emb_fn)
-
-    def load_seen_vectors(self):
+        # (all-MiniLM-L6-v2, eseguito con sentence-transformers oppure esportato in ONNX -> vedi embeddings.py)
+        self.emb_fn = make_embedding_function(embedding_backend, onnx_model_dir, embedding_threads)
+        # Indice quantizzato opzionale (int8 / binary) per la ricerca vettoriale
+        self.quantized_index = None
+        self.rerank_factor = rerank_factor
+        if quantized:
+            from quantized_index import QuantizedIndex, find_store
+            index_dir = find_store(persist_dir, quantized)
+            if index_dir is None:
+                sys.exit(f"[RAG ERROR] Indice quantizzato {quantized} assente in {persist_dir}: costruirlo con prompting/quantized_index.py")
+            self.quantized_index = QuantizedIndex(index_dir, self.emb_fn)
+            print(f"--- Ricerca vettoriale su indice quantizzato {quantized} ({self.quantized_index.count()} vettori) ---")
+        # Store quantizzato senza collection Chroma accanto (es. VM con la sola cartella quantized_<mode>) -> lo store sostituisce la collection
+        self.standalone = self.quantized_index is not None and not os.path.exists(os.path.join(persist_dir, "chroma.sqlite3"))
+        if self.standalone:
+            self.client = None
+            self.collection = self.quantized_index
+        else:
+            # Creazione client che gestisce un vector database ChromaDB, database contenente embeddings
+            # (chromadb importato solo qui: l'import richiede secondi e non serve per --help né agli script che usano solo le costanti del modulo)
+            import chromadb
+            self.client = chromadb.PersistentClient(path=persist_dir)
+            # Apertura della tabella honeypot_attacks (parametro passato) all'interno del DB o, se assente, creazione con layout multi-lunghezza
+            try:
+                self.collection = self.client.get_collection(name=collection_name, embedding_function=self.emb_fn)
+            except Exception:
+                self.collection = self.client.create_collection(
+                    name=collection_name,
+                    embedding_function=self.emb_fn,
+                    metadata={"layout": "multi_len", "max_context_len": max_context_len, "collapsed": collapse, **(hnsw or {})}
+                )
+        # I parametri HNSW sono fissati alla creazione della collection -> su un DB esistente valgono quelli salvati
+        stored_hnsw = {key: value for key, value in (self.collection.metadata or {}).items() if key.startswith("hnsw:")}
+        if hnsw and any(stored_hnsw.get(key) != value for key, value in hnsw.items()):
+            print(f"[RAG WARNING] Parametri HNSW richiesti {hnsw} diversi da quelli del DB esistente {stored_hnsw or 'default'}: vengono usati quelli del DB")
+        # Layout del DB: multi-lunghezza (filtro window_len in retrieve) oppure DB legacy con una sola context length
+        collection_meta = self.collection.metadata or {}
+        self.multi_len = collection_meta.get("layout") == "multi_len"
+        self.max_context_len = collection_meta.get("max_context_len", max_context_len)
+        # DB "collapsed" -> un rappresentante per cluster di finestre quasi-duplicate, con occorrenze e istogramma dei comandi successivi
+        self.collapsed = bool(collection_meta.get("collapsed", False))
+        if collapse and not self.collapsed:
+            print("[RAG WARNING] Il DB esistente non è in modalità collapsed: --collapse viene ignorato")
+        # Indice esatto delle finestre (hash finestra -> frequenze dei comandi successivi), salvato accanto al DB Chroma
+        self.exact_index = ExactWindowIndex(persist_dir)
+        self.use_exact_index = use_exact_index
+        self.exact_lookups = 0
+        self.exact_hits = 0
+        # Indice lessicale (BM25 sui token dei comandi): alimentato sempre in indicizzazione, usato dalle modalità lexical / hybrid
+        self.lexical_index = LexicalIndex(persist_dir)
+        self.retrieval_mode = retrieval_mode
+        if retrieval_mode != "vector" and self.lexical_index.count() == 0 and self.collection.count() > 0:
+            print("[RAG] Indice lessicale assente: costruzione dalla collection esistente...")
+            self.lexical_index.build_from_collection(self.collection)
+
+    def load_seen_vectors(self, seen_path: str) -> set:
+        # Ripresa veloce -> lettura del file compatto con gli hash salvati ad ogni scrittura di batch
+        if os.path.exists(seen_path):
+            return load_hashes(seen_path)
+
+        # File assente (DB indicizzato con versioni precedenti) -> gli hash vengono ricostruiti dagli id presenti nel DB, leggendo solo gli id a pagine
         seen = set()
-        
-        all_docs = self.collection.get(
-            include=["documents", "metadatas"]  # document = context; metadata["next_command"]
-        )
-        
-        for context, meta in zip(all_docs["documents"], all_docs["metadatas"]):
-            key = (context, meta["next_command"])
-            seen.add(key)
+        total = self.collection.count()
+        for offset in range(0, total, 100000):
+            page = self.collection.get(include=[], limit=100000, offset=offset)
+            seen.update(vector_hash(vector_id) for vector_id in page["ids"])
+        append_hashes(seen_path, seen)
 
         return seen
 
     # Indicizzazione sessioni di attacco
-    def index_file(self, jsonl_path: str, context_len: int, checkpoint_path: str):
+    def index_file(self, jsonl_path: str, max_context_len: int, checkpoint_path: str, batch_size: int = 4000, workers: int = 0):
         if not os.path.exists(jsonl_path):
             print(f"[RAG ERROR] File non trovato: {jsonl_path}")
             return
 
+        if self.standalone:
+            print("[RAG ERROR] Lo store quantizzato autonomo è in sola lettura per l'indicizzazione offline: indicizzare la collection Chroma e ricostruire lo store con prompting/quantized_index.py")
+            return
+
         print(f"[RAG] Indicizzazione vettoriale di {jsonl_path}...")
-        documents, metadatas, ids = [], [], []
         seen_vectors = set()                    # set di vettori unici inseriti nel DB
-
-        with open(jsonl_path, "r", encoding="utf-8") as file_train: 
-            lines = file_train.readlines()
+        total_lines = count_lines(jsonl_path)   # conteggio a blocchi, senza caricare il file in memoria
+        if self.collapsed:
+            return self._index_collapsed(jsonl_path, max_context_len, checkpoint_path, total_lines, batch_size, workers)
+        seen_path = os.path.join(os.path.dirname(checkpoint_path), "DB_seen_ids.bin")
 
         # Lettura file checkpoint per continuare indicizzazione
-        start_line = 0
+        start_line, indice_cmd = 0, 0
         if os.path.exists(checkpoint_path):
             with open(checkpoint_path, "r") as file:
                 line = file.read().strip()
@@ -99,26 +199,79 @@ class VectorContextRetriever:
                     start_line = int(parts[0])
                     indice_cmd = int(parts[1])
 
-            if start_line == len(lines):
+            if start_line == total_lines:
                 print(f"[RAG] Indicizzazione gia' eseguita")
                 return
+            elif not self.multi_len:
+                sys.exit("[RAG ERROR] Il DB è stato creato con una versione precedente (una finestra per context_len): per indicizzarlo è necessario ricrearlo")
             else:
                 print(f"[RAG] Riprendo indicizzazione da riga {start_line}...")
-                seen_vectors = self.load_seen_vectors()
+                seen_vectors = self.load_seen_vectors(seen_path)
                 print(f"[RAG] Caricati {len(seen_vectors)} vettori già indicizzati.")
+        elif not self.multi_len:
+            sys.exit("[RAG ERROR] Il DB è stato creato con una versione precedente (una finestra per context_len): per indicizzarlo è necessario ricrearlo")
+        else:
+            # Nuova indicizzazione -> si riparte da un set vuoto e da un indice esatto vuoto
+            if os.path.exists(seen_path):
+                os.remove(seen_path)
+            self.exact_index.clear()
+            self.lexical_index.clear()
+        """
+        Pipeline di indicizzazione (producer/consumer):
+          - lettore + generatore di finestre (thread principale): legge il file in streaming e produce batch di batch_size documenti
+          - pool di embedding worker: ogni worker calcola gli embedding di un batch (in parallelo sui core disponibili)
+          - writer (thread dedicato): aggiunge al DB i batch con gli embedding già calcolati, rispettando l'ordine di
+            produzione, e aggiorna il checkpoint dopo ogni scrittura
+        La coda tra produttore e writer è limitata, così la memoria occupata resta proporzionale a workers * batch_size.
+        """
+        if max_context_len != self.max_context_len:
+            print(f"[RAG] Il DB è stato creato con max_context_len={self.max_context_len}: utilizzo questo valore")
+            max_context_len = self.max_context_len
+
+        from tqdm import tqdm
+        workers = workers if workers > 0 else min(4, os.cpu_count() or 1)
+        pending = queue.Queue(maxsize=workers * 2)
+        stats = {"docs": 0, "error": None}
+        writer = threading.Thread(target=self._write_batches, args=(pending, checkpoint_path, seen_path, stats), daemon=True)
+        started = time.time()
+
+        with ThreadPoolExecutor(max_workers=workers) as pool, tqdm(desc="Indicizzazione DB", unit="line", initial=start_line, total=total_lines) as pbar:
+            writer.start()
+            batches = self._iter_batches(jsonl_path, max_context_len, start_line, indice_cmd, seen_vectors, batch_size, pbar)
+            for documents, metadatas, ids, exact_counts, checkpoint in batches:
+                if stats["error"]: break
+                future = pool.submit(self.emb_fn, documents) if documents else None
+                pending.put((future, documents, metadatas, ids, exact_counts, checkpoint))
+                pbar.set_postfix(docs_s=f"{stats['docs'] / max(time.time() - started, 1e-9):.0f}")
+            pending.put(None)
+            writer.join()
+
+        if stats["error"]:
+            raise stats["error"]
+
+        # Scrivo ultima riga -> indicizzazione terminata
+        with open(checkpoint_path, "w") as file:
+            file.write(f"{total_lines}:0")
+
+        elapsed = time.time() - started
+        print(f"[RAG] Indicizzati {stats['docs']} nuovi vettori in {elapsed:.1f}s ({stats['docs'] / max(elapsed, 1e-9):.1f} docs/s, {workers} worker)")
+        print(f"[RAG] Indicizzazione completata. Totale vettori: {self.collection.count()}")
 
+    # Generatore di batch -> legge le sessioni in streaming e costruisce le finestre scorrevoli
+    def _iter_batches(self, jsonl_path: str, max_context_len: int, start_line: int, indice_cmd: int, seen_vectors: set, batch_size: int, pbar):
         """
-        Strategia di indicizzazione: oltre tutte le sessioni di attacco, vengono indicizzate anche le "finestre" scorrevoli.
-        Se la sessione contiene i seguenti comandi: A -> B -> C -> D
+        Strategia di indicizzazione: per ogni comando della sessione vengono indicizzate le finestre di ogni lunghezza (fino a max_context_len)
+        che terminano con quel comando. Se la sessione contiene i seguenti comandi: A -> B -> C -> D (max_context_len = 2)
         Indicizziamo:
-          - Vettore("A") -> Target: "B"
-          - Vettore("A B") -> Target: "C"
-          - Vettore("A B C") -> Target: "D"
+          - Vettore("A") -> Target: "B"                                 (window_len = 1)
+          - Vettore("B") -> Target: "C", Vettore("A B") -> Target: "C"  (window_len = 1, 2)
+          - Vettore("C") -> Target: "D", Vettore("B C") -> Target: "D"  (window_len = 1, 2)
         """
-    
-        for rel_idx, line in enumerate(tqdm(lines[start_line:], desc="Indicizzazione DB", unit="line", initial=start_line,
-        total=len(lines))):
-            line_idx = start_line + rel_idx  # line_idx reale
+        documents, metadatas, ids = [], [], []
+        exact_counts = Counter()                # frequenze (hash finestra, next_command) di tutte le occorrenze, duplicati compresi
+
+        for line_idx, line in read_lines(jsonl_path, start_line):
+            pbar.update(1)
             if not line.strip(): continue
             
             # Estrapolazione dei comandi contenuti all'interno della linea
@@ -126,91 +279,321 @@ class VectorContextRetriever:
             cmds = data.get("commands", [])
             session_id = str(data.get("session", "unknown"))
 
-            window = []
-            start_cmd_idx = 0
-            if start_line != 0 and line_idx == start_line: 
-                if indice_cmd in range(len(cmds) - 1):
-                    # Prendo al massimo gli ultimi context_len comandi precedenti al comando corrente
-                    start_window_idx = max(0, indice_cmd - context_len)
-                    window = cmds[start_window_idx:indice_cmd]
-                    start_cmd_idx = indice_cmd
-                else: 
-                    continue
-
-            for i in range(start_cmd_idx, len(cmds) - 1):              
-                # Creazione della finestra scorrevole in modo dinamico
-                # Ogni volta il comando viene aggiunto, quando si supera la context_len si elima il comando più vecchio del contesto
-                window.append(cmds[i])          
-                if len(window) > context_len:
-                    window.pop(0)
-
-                context_str = " || ".join(window)
-                target_cmd = cmds[i + 1]            # Comando obiettivo della prediction -> quello successivo (motivo per cui si itera fino a len(cmds)-1)# Comando obiettivo della prediction -> quello successivo alla finestra scorrevole
-                
-                # Per il vettore appena creato, vedo se la chiave è stata già indicizzata
-                # Calcolo hash della chiave -> nome del vettore indicizzato
-                key = (context_str, target_cmd)
-                if key in seen_vectors:
-                    continue
-                seen_vectors.add(key)
-                vector_id = hashlib.sha1(f"{context_str}@@{target_cmd}".encode()).hexdigest()
-
-                documents.append(context_str)
-                metadatas.append({
-                    "next_command": target_cmd,
-                    "session_id": session_id,
-                    "original_line": line_idx
-                })
-                ids.append(vector_id)
+            # Ripresa dal checkpoint -> nella prima riga si riparte dal comando indice_cmd
+            start_cmd_idx = indice_cmd if (start_line != 0 and line_idx == start_line) else 0
+
+            for i in range(start_cmd_idx, len(cmds) - 1):
+                target_cmd = cmds[i + 1]            # Comando obiettivo della prediction -> quello successivo alle finestre
+
+                for window_len in range(1, min(max_context_len, i + 1) + 1):
+                    context_str = " || ".join(cmds[i + 1 - window_len:i + 1])
+                    exact_counts[(context_hash(context_str), target_cmd)] += 1
+
+                    # Calcolo hash della chiave -> nome del vettore indicizzato
+                    # Per il vettore appena creato, vedo se la chiave è stata già indicizzata (tramite hash a 64 bit dell'id)
+                    vector_id = hashlib.sha1(f"{context_str}@@{target_cmd}".encode()).hexdigest()
+                    key = vector_hash(vector_id)
+                    if key not in seen_vectors:
+                        seen_vectors.add(key)
+                        documents.append(context_str)
+                        metadatas.append({
+                            "next_command": target_cmd,
+                            "session_id": session_id,
+                            "original_line": line_idx,
+                            "window_len": window_len
+                        })
+                        ids.append(vector_id)
                 
-                # Aggiunta delle info nel DB -> per evitare accessi frequenti al DB
-                if len(documents) >= 4000:
-                    self.collection.add(documents=documents, metadatas=metadatas, ids=ids)
+                # Batch completo -> viene passato agli embedding worker insieme al checkpoint da scrivere dopo l'aggiunta nel DB
+                # Il batch viene chiuso solo dopo tutte le finestre del comando i, così il checkpoint resta allineato
+                # (viene chiuso anche quando le sole frequenze dell'indice esatto crescono troppo, ad esempio su file già indicizzati)
+                if len(documents) >= batch_size or len(exact_counts) >= 4 * batch_size:
+                    yield documents, metadatas, ids, exact_counts, f"{line_idx}:{i+1}"
                     documents, metadatas, ids = [], [], []
-                    
-                    with open(checkpoint_path, "w") as file:
-                        file.write(f"{line_idx}:{i+1}")
+                    exact_counts = Counter()
 
-        # Aggiunta delle info rimanenti nel DB -> necessario se non si era arrivato a 4000
-        if documents: 
-            self.collection.add(documents=documents, metadatas=metadatas, ids=ids)
-            # Scrivo ultima riga -> indicizzazione terminata
-            with open(checkpoint_path, "w") as file:
-                file.write(f"{len(lines)}:0")
+        # Batch rimanente -> necessario se non si era arrivato a batch_size
+        if documents or exact_counts:
+            yield documents, metadatas, ids, exact_counts, f"{line_idx + 1}:0"
 
-        print(f"[RAG] Indicizzazione completata. Totale vettori: {self.collection.count()}")
+    # Writer -> aggiunge al DB gli embedding pre-calcolati, nello stesso ordine in cui i batch sono stati prodotti
+    def _write_batches(self, pending: queue.Queue, checkpoint_path: str, seen_path: str, stats: Dict[str, Any]):
+        while True:
+            item = pending.get()
+            if item is None:
+                return
+            future, documents, metadatas, ids, exact_counts, checkpoint = item
+            # Dopo un errore si continua a svuotare la coda, per non bloccare il produttore
+            if stats["error"]:
+                if future: future.cancel()
+                continue
+            try:
+                if future:
+                    embeddings = future.result()
+                    self.collection.add(documents=documents, metadatas=metadatas, ids=ids, embeddings=embeddings)
+                self.exact_index.add_counts(exact_counts)
+                self.lexical_index.add([(vector_id, doc, meta["window_len"]) for vector_id, doc, meta in zip(ids, documents, metadatas)])
+                # Gli hash del batch vengono salvati prima del checkpoint -> alla ripresa il set è sempre allineato al DB
+                append_hashes(seen_path, (vector_hash(vector_id) for vector_id in ids))
+                with open(checkpoint_path, "w") as file:
+                    file.write(checkpoint)
+                stats["docs"] += len(ids)
+            except Exception as exc:
+                stats["error"] = exc
+
+    # Indicizzazione "collapsed" -> aggregazione dei quasi-duplicati (fase 1) e scrittura di un rappresentante per cluster nel DB (fase 2)
+    def _index_collapsed(self, jsonl_path: str, max_context_len: int, checkpoint_path: str, total_lines: int, batch_size: int, workers: int):
+        """
+        Le finestre con la stessa forma canonica (rag_index.canonical_window: nome comando + primo path, senza placeholder,
+        argomenti e spazi) e la stessa lunghezza formano un cluster. Le due fasi salvano il loro avanzamento nel file sqlite
+        accanto al DB (nella stessa transazione delle frequenze), quindi l'indicizzazione può essere ripresa dopo un'interruzione:
+          - fase 1: lettura in streaming del file, con aggregazione di occorrenze e istogramma dei comandi successivi per cluster
+            (e delle frequenze dell'indice esatto, sulle finestre originali)
+          - fase 2: embedding del rappresentante di ogni cluster e scrittura nel DB, con metadati count e next_hist (json)
+        """
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, "r") as file:
+                if file.read().strip() == f"{total_lines}:0":
+                    print(f"[RAG] Indicizzazione gia' eseguita")
+                    return
+        if max_context_len != self.max_context_len:
+            print(f"[RAG] Il DB è stato creato con max_context_len={self.max_context_len}: utilizzo questo valore")
+            max_context_len = self.max_context_len
+
+        clusters = CollapsedWindowIndex(os.path.dirname(checkpoint_path))
+        phase = clusters.get_state("phase")
+        if phase is None:
+            clusters.clear()
+            self.lexical_index.clear()
+            phase = "aggregate"
+        started = time.time()
+
+        from tqdm import tqdm
+        if phase == "aggregate":
+            start_line = int(clusters.get_state("line", "0"))
+            windows, next_counts, exact_counts = {}, Counter(), Counter()
+            with tqdm(desc="Aggregazione finestre", unit="line", initial=start_line, total=total_lines) as pbar:
+                for line_idx, line in read_lines(jsonl_path, start_line):
+                    pbar.update(1)
+                    if not line.strip(): continue
+                    cmds = json.loads(line).get("commands", [])
+                    for i in range(len(cmds) - 1):
+                        target_cmd = cmds[i + 1]
+                        for window_len in range(1, min(max_context_len, i + 1) + 1):
+                            window = cmds[i + 1 - window_len:i + 1]
+                            context_str = " || ".join(window)
+                            canon_hash = context_hash(f"{window_len}@@{canonical_window(window)}")
+                            _, representative, count = windows.get(canon_hash, (window_len, context_str, 0))
+                            windows[canon_hash] = (window_len, representative, count + 1)
+                            next_counts[(canon_hash, target_cmd)] += 1
+                            exact_counts[(context_hash(context_str), target_cmd)] += 1
+                    # Il batch viene chiuso solo a fine riga -> lo stato salvato è sempre una riga completa
+                    if len(next_counts) >= 4 * batch_size:
+                        clusters.add_batch(windows, next_counts, exact_counts, {"line": str(line_idx + 1)})
+                        windows, next_counts, exact_counts = {}, Counter(), Counter()
+            clusters.add_batch(windows, next_counts, exact_counts, {"line": str(total_lines), "phase": "embed"})
+            phase = "embed"
+
+        n_clusters, n_occurrences = clusters.stats()
+        print(f"[RAG] {n_occurrences} finestre raggruppate in {n_clusters} cluster (x{n_occurrences / max(n_clusters, 1):.1f})")
+
+        workers = workers if workers > 0 else min(4, os.cpu_count() or 1)
+        after_hash = clusters.get_state("after_hash")
+        after_hash = int(after_hash) if after_hash is not None else None
+        written = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool, tqdm(desc="Indicizzazione cluster", unit="cluster", total=n_clusters) as pbar:
+            for page in clusters.iter_clusters(after_hash, batch_size * workers):
+                hists = clusters.histograms([row[0] for row in page], NEXT_HIST_TOP)
+                futures = [pool.submit(self.emb_fn, [row[2] for row in page[start:start + batch_size]]) for start in range(0, len(page), batch_size)]
+                for n, future in enumerate(futures):
+                    rows = page[n * batch_size:(n + 1) * batch_size]
+                    ids = [hashlib.sha1(f"collapsed@@{canon_hash}".encode()).hexdigest() for canon_hash, *_ in rows]
+                    self.collection.upsert(
+                        ids=ids,
+                        embeddings=future.result(),
+                        documents=[representative for _, _, representative, _ in rows],
+                        metadatas=[
+                            {
+                                "next_command": hists[canon_hash][0][0] if hists[canon_hash] else "",
+                                "next_hist": json.dumps(dict(hists[canon_hash])),
+                                "count": count,
+                                "session_id": "collapsed",
+                                "original_line": -1,
+                                "window_len": window_len,
+                            }
+                            for canon_hash, window_len, _, count in rows
+                        ],
+                    )
+                    self.lexical_index.add([(vector_id, representative, window_len) for vector_id, (_, window_len, representative, _) in zip(ids, rows)])
+                clusters.set_state("after_hash", str(page[-1][0]))
+                written += len(page)
+                pbar.update(len(page))
+
+        with open(checkpoint_path, "w") as file:
+            file.write(f"{total_lines}:0")
+        elapsed = time.time() - started
+        print(f"[RAG] Indicizzati {written} cluster in {elapsed:.1f}s. Totale vettori: {self.collection.count()}")
 
     # Ritrovamento all'interno del DB di attacchi simili
     def retrieve(self, current_context_list: List[str], k: int) -> str:
         
         # Sulla base del contesto attuale, viene eseguita una query al DB vettoriale, che restituisce i k più simili
         if not current_context_list: return ""
-        query_text = " || ".join(current_context_list)
-        results = self.collection.query(query_texts=[query_text], n_results=k)
-        
-        formatted_examples = ""
-        if not results['ids']: return ""    # Se DB vuoto o contiene pochi vettori indicizzati
+        return format_examples(self.retrieve_many([current_context_list], k)[0])
+
+    # Ritrovamento batch -> un solo forward pass del modello di embedding e una sola query Chroma per blocco di contesti
+    def retrieve_many(self, context_lists: List[List[str]], k: int, batch_size: int = 256) -> List[List[Dict[str, Any]]]:
+        results_all: List[List[Dict[str, Any]]] = [[] for _ in context_lists]
+        if not context_lists or self.collection.count() == 0:    # DB vuoto -> nessun esempio da restituire
+            return results_all
+
+        # Percorso veloce -> le finestre già presenti nell'indice esatto restituiscono subito i comandi successivi più frequenti
+        # I contesti vuoti non vengono inviati al DB (restano con lista di esempi vuota)
+        positions = []
+        for pos, ctx in enumerate(context_lists):
+            if not ctx: continue
+            if self.multi_len:
+                ctx = ctx[-self.max_context_len:]
+            context_str = " || ".join(ctx)
+            if not self.use_exact_index:
+                positions.append(pos)
+                continue
+            self.exact_lookups += 1
+            continuations = self.exact_index.lookup(context_str, k)
+            if continuations:
+                self.exact_hits += 1
+                results_all[pos] = [
+                    {"context": context_str, "next_command": cmd, "distance": 0.0, "session_id": "exact", "count": count}
+                    for cmd, count in continuations
+                ]
+            else:
+                positions.append(pos)
+
+        # Nel DB multi-lunghezza ogni query filtra per window_len -> i contesti vengono raggruppati per lunghezza (un filtro per query Chroma)
+        groups: Dict[int, List[int]] = {}
+        for pos in positions:
+            window_len = min(len(context_lists[pos]), self.max_context_len) if self.multi_len else 0
+            groups.setdefault(window_len, []).append(pos)
+
+        for window_len, group in groups.items():
+            for start in range(0, len(group), batch_size):
+                chunk = group[start:start + batch_size]
+                query_texts = [" || ".join(context_lists[pos][-window_len:] if window_len else context_lists[pos]) for pos in chunk]
+                if self.retrieval_mode == "vector":
+                    self._query_chunk(chunk, query_texts, k, window_len, results_all)
+                else:
+                    self._query_lexical(chunk, query_texts, k, window_len, results_all)
+        return results_all
+
+    # Ricerca lessicale (BM25) e ibrida di un blocco di contesti con la stessa lunghezza
+    def _query_lexical(self, chunk: List[int], query_texts: List[str], k: int, window_len: int, results_all: List[List[Dict[str, Any]]]):
+        """
+        - lexical: i k candidati BM25 migliori sono gli esempi restituiti (nessun embedding). La distance è 1 / (1 + punteggio BM25)
+        - hybrid: l'indice lessicale genera k * HYBRID_CANDIDATES candidati, riordinati con la distanza L2 al quadrato tra l'embedding
+          della query e quelli dei candidati (letti dalla collection, non ricalcolati)
+        I contesti senza alcun token in comune con il DB passano alla ricerca vettoriale.
+        """
+        import numpy as np
+        hybrid = self.retrieval_mode == "hybrid"
+        candidates = [self.lexical_index.search(text, window_len, k * HYBRID_CANDIDATES if hybrid else k) for text in query_texts]
+        fallback = [row for row, hits in enumerate(candidates) if not hits]
+        if fallback:
+            self._query_chunk([chunk[row] for row in fallback], [query_texts[row] for row in fallback], k, window_len, results_all)
+
+        found_rows = [row for row, hits in enumerate(candidates) if hits]
+        if not found_rows: return
+        ids = list(dict.fromkeys(vector_id for row in found_rows for vector_id, _ in candidates[row]))
+        got = self.collection.get(ids=ids, include=["documents", "metadatas"] + (["embeddings"] if hybrid else []))
+        by_id = {vector_id: i for i, vector_id in enumerate(got["ids"])}
+        query_embeddings = np.asarray(self.emb_fn([query_texts[row] for row in found_rows]), dtype=np.float32) if hybrid else None
+
+        for n, row in enumerate(found_rows):
+            hits = [(vector_id, score) for vector_id, score in candidates[row] if vector_id in by_id]
+            if hybrid and hits:
+                cand_emb = np.asarray([got["embeddings"][by_id[vector_id]] for vector_id, _ in hits], dtype=np.float32)
+                dists = ((cand_emb - query_embeddings[n]) ** 2).sum(axis=1)
+                order = np.argsort(dists)
+                scored = [(hits[i][0], float(dists[i])) for i in order]
+            else:
+                scored = [(vector_id, 1 / (1 + score)) for vector_id, score in hits]
+            metas = [got["metadatas"][by_id[vector_id]] for vector_id, _ in scored]
+            examples = [
+                {
+                    "context": got["documents"][by_id[vector_id]],
+                    "next_command": meta["next_command"],
+                    "distance": distance,
+                    "session_id": meta.get("session_id", "unknown"),
+                }
+                for (vector_id, distance), meta in zip(scored, metas)
+            ]
+            results_all[chunk[row]] = rank_collapsed(examples, metas, k) if self.collapsed else examples[:k]
+
+    # Ricerca vettoriale di un blocco di contesti con la stessa lunghezza (window_len = 0 -> DB legacy, nessun filtro)
+    def _query_chunk(self, chunk: List[int], query_texts: List[str], k: int, window_len: int, results_all: List[List[Dict[str, Any]]]):
+        query_embeddings = self.emb_fn(query_texts)
+        if self.quantized_index:
+            n_results = k * COLLAPSED_OVERFETCH if self.collapsed else k
+            found = self.quantized_index.search(query_embeddings, n_results, rerank_factor=self.rerank_factor, window_len=window_len or None)
+            for pos, examples in zip(chunk, found):
+                results_all[pos] = [{key: ex[key] for key in ("context", "next_command", "distance", "session_id")} for ex in examples]
+                if self.collapsed:
+                    results_all[pos] = rank_collapsed(results_all[pos], [ex["metadata"] for ex in examples], k)
+            return
+
+        results = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=k * COLLAPSED_OVERFETCH if self.collapsed else k,
+            where={"window_len": window_len} if window_len else None,
+            include=["documents", "metadatas", "distances"]
+        )
+        if not results['ids']: return
+
+        # La query restituisce una lista di liste (una per ogni contesto del blocco)
+        for row, pos in enumerate(chunk):
+            docs = results['documents'][row]
+            metas = results['metadatas'][row]
+            dists = results['distances'][row]
+            results_all[pos] = [
+                {
+                    "context": docs[i],
+                    "next_command": metas[i]['next_command'],
+                    "distance": float(dists[i]),
+                    "session_id": metas[i].get('session_id', "unknown"),
+                }
+                for i in range(len(docs))
+            ]
+            if self.collapsed:
+                results_all[pos] = rank_collapsed(results_all[pos], metas, k)
 
-        # La query restituisce una lista di liste, perciò è necessario estrarre, per ogni campo, la lista contenuta all'interno
-        ids = results['ids'][0]
-        docs = results['documents'][0]
-        metas = results['metadatas'][0]
-        
-        # Per ogni sessione di attacco simile, restituisce il contesto e il successivo comando inserito
-        for i in range(len(ids)):
-            hist_ctx = docs[i].replace(" || ", "\n")
-            hist_next = metas[i]['next_command']
-            formatted_examples += (
-                f"--- SIMILAR PAST ATTACK (Example {i+1}) ---\n"
-                f"Context:\n{hist_ctx}\n"
-                f"Attacker Next Move:\n{hist_next}\n\n"
-            )
-        return formatted_examples
-    
 # -------------------------
 # FUNCTION SECTION
 # -------------------------
   
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+HYBRID_CANDIDATES = 10      # candidati lessicali per ogni esempio restituito dalla retrieve ibrida (re-rank vettoriale)
+NEXT_HIST_TOP = 10          # comandi successivi salvati nell'istogramma di ogni cluster
+
+# Parametri HNSW della collection Chroma (metadati "hnsw:*"): i valori None restano al default di Chroma
+def hnsw_metadata(space: str = None, m: int = None, construction_ef: int = None, search_ef: int = None) -> Dict[str, Any]:
+    params = {"hnsw:space": space, "hnsw:M": m, "hnsw:construction_ef": construction_ef, "hnsw:search_ef": search_ef}
+    return {key: value for key, value in params.items() if value is not None}
+
+# Conteggio delle righe di un file letto a blocchi (equivalente a len(file.readlines()) senza caricarlo in memoria)
+def count_lines(path: str) -> int:
+    n_lines, last = 0, b"\n"
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            n_lines += block.count(b"\n")
+            last = block[-1:]
+    return n_lines + (0 if last == b"\n" else 1)
+
+# Lettura in streaming delle righe di un file jsonl, a partire dalla riga start_line
+def read_lines(path: str, start_line: int = 0):
+    with open(path, "r", encoding="utf-8") as file:
+        for line_idx, line in enumerate(file):
+            if line_idx >= start_line:
+                yield line_idx, line
+
 def hit_db(target_cmd: str, retrieved_examples_text: str) -> bool:
     target = target_cmd.strip()
     lines = retrieved_examples_text.splitlines()
@@ -222,6 +605,26 @@ def hit_db(target_cmd: str, retrieved_examples_text: str) -> bool:
 
     return False
 
+def hit_db_examples(target_cmd: str, examples: List[Dict[str, Any]]) -> bool:
+    # Solo il next_command mostrato nel prompt: l'istogramma dei cluster di un DB collapsed non entra nel prompt (solo "Observed: N times")
+    target = target_cmd.strip()
+    return any(ex["next_command"].strip() == target for ex in examples)
+
+def format_examples(examples: List[Dict[str, Any]]) -> str:
+    # Per ogni sessione di attacco simile, restituisce il contesto e il successivo comando inserito
+    formatted_examples = ""
+    for i, ex in enumerate(examples):
+        hist_ctx = ex["context"].replace(" || ", "\n")
+        hist_next = ex["next_command"]
+        formatted_examples += (
+            f"--- SIMILAR PAST ATTACK (Example {i+1}) ---\n"
+            f"Context:\n{hist_ctx}\n"
+            f"Attacker Next Move:\n{hist_next}\n"
+            + (f"Observed: {ex['count']} times\n" if "next_hist" in ex else "")
+            + "\n"
+        )
+    return formatted_examples
+
 def make_rag_prompt(context_list: List[str], rag_text: str, k: int) -> str:
     current_history = "\n".join(context_list[-10:])
     return f"""
@@ -244,121 +647,133 @@ CURRENT SESSION HISTORY:
 PREDICT NEXT {k} COMMANDS (Raw text only):
 """.strip()
 
+def make_rag_prompt_packed(context_lists: List[List[str]], rag_texts: List[str], k: int) -> str:
+    # Ogni sezione contiene i propri attacchi simili, seguiti dalla sessione corrente del task
+    sections = [f"SIMILAR PAST ATTACKS:\n{rag_text.strip()}\n\nCURRENT SESSION HISTORY:\n" + "\n".join(context_list[-10:])
+                for context_list, rag_text in zip(context_lists, rag_texts)]
+    instructions = "4. Look at the 'SIMILAR PAST ATTACKS' of each task (Retrieval Augmented Generation) to understand attacker patterns.\n"
+    return packing.make_packed_prompt(sections, k, instructions)
+
 def prediction_evaluation(args, llm_type, query_model):
+    from tqdm import tqdm
     # Configurazione del DB vettoriale
-    rag = VectorContextRetriever(persist_dir=args.persist_dir)
+    rag = VectorContextRetriever(persist_dir=args.persist_dir, quantized=args.quantized, rerank_factor=args.rerank_factor,
+                                 max_context_len=args.max_context_len, embedding_backend=args.embedding_backend,
+                                 embedding_threads=args.embedding_threads, onnx_model_dir=args.onnx_model_dir,
+                                 hnsw=hnsw_metadata(args.hnsw_space, args.hnsw_m, args.hnsw_construction_ef, args.hnsw_search_ef),
+                                 collapse=args.collapse, retrieval_mode=args.retrieval_mode)
     source_for_index = args.index_file if args.index_file else args.sessions
     check_path = os.path.join(args.persist_dir, "DB_checkpoint.txt")
-    rag.index_file(source_for_index, context_len=args.context_len, checkpoint_path=check_path)
-
-    # Preparazione task di cui eseguire la prediction
-    tasks = []
-    print("--- Preparazione task di valutazione ---")
-    try:
-        # Lettura delle righe del file contenente le sessioni
-        with open(args.sessions, "r", encoding="utf-8") as file: lines = [line for line in file if line.strip()]
-        
-        valid_lines = []
-        # Tra le linee lette, seleziono quelle che presentano context_len + 1 -> necessario per la creazione dei task
-        for line in lines:
-            if not line.strip():
-                continue
-            data = json.loads(line)
-            cmds = data.get("commands", [])
-            if len(cmds) > args.context_len:
-                valid_lines.append(line)
-
-        # Se args.n > 0, seleziona randomicamente solo tra le valide
-        if args.n > 0:
-            random_lines = random.sample(valid_lines, min(args.n, len(valid_lines)))
-
-        for line in (random_lines if random_lines else valid_lines):
-            if not line.strip(): 
-                continue
-            try:
-                obj = json.loads(line)
-                cmds = obj.get("commands", [])
-                sid = obj.get("session", "unk")
-
-                # Dalla sessione random, si estra un comando random che funge da expected, i precedenti da contesto -> tramite questo codice è garantito che il contesto è sempre costituito da context_len comandi
-                indice_expected = random.randint(args.context_len, len(cmds) - 1)
-                expected = cmds[indice_expected]
-                context = cmds[indice_expected - args.context_len : indice_expected]
-
-                tasks.append({"session": sid, "context": context, "expected": expected})
-            except: 
-                continue
-    except FileNotFoundError:
-        sys.exit(f"Errore: Il file {args.sessions} non esiste.")
+    rag.index_file(source_for_index, max_context_len=args.max_context_len, checkpoint_path=check_path,
+                   batch_size=args.index_batch_size, workers=args.index_workers)
 
-    print(f"Totale task da valutare: {len(tasks)}")
-    if len(tasks) == 0: sys.exit("Nessun task trovato. Controlla il formato del file JSONL.")
+    # Preparazione task (seed deterministico, lista salvata accanto ai risultati) o ripresa di un'esecuzione interrotta
+    # I task sono generati in streaming mentre il file delle sessioni viene letto: la valutazione parte subito
+    tasks, results, out_mode, total = eval_tasks.prepare_run(args)
 
     # Prompting al LLM e valutazione delle prediction eseguite
+    # Con --resume i contatori partono dai record già presenti, per cui il summary copre record vecchi e nuovi
     os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
-    results = []
-    top1_hits = 0
-    topk_hits = 0
-    empty_responses_count = 0
+    top1_hits = sum(1 for r in results if r["hit"] and r["rank"] == 1)
+    topk_hits = sum(1 for r in results if r["hit"])
+    empty_responses_count = sum(1 for r in results if not r["candidates"])
+    llm_calls = sum(1 for r in results if r.get("predictor", "llm") == "llm")
     
-    print(f"--- Inizio Valutazione con Modello: {args.model} ---")
+    print(f"--- Inizio Valutazione con Modello: {args.model} (predictor: {args.predictor}) ---")
     
-    with open(args.output, "w", encoding="utf-8") as fout:
-        for task in tqdm(tasks, desc="Evaluating"):
+    # Ritrovamento a blocchi degli attacchi simili: i task generati in streaming vengono raggruppati in blocchi di args.rag_batch
+    # contesti e ogni blocco è recuperato con una sola retrieve_many, mentre le richieste al LLM dei blocchi precedenti sono in volo
+    # Con il predictor kNN si recuperano knn_neighbors vicini: il prompt usa comunque solo i primi rag_k
+    n_neighbors = args.rag_k if args.predictor == "llm" else max(args.rag_k, args.knn_neighbors)
+
+    # Metriche live (barra di avanzamento e <output>.metrics.json ogni args.metrics_interval secondi), con la latenza della retrieve
+    metrics = live_metrics.LiveMetrics(live_metrics.metrics_path(args.output), args.k, args.metrics_interval, done=results)
+
+    def iter_retrieved():
+        while True:
+            chunk = list(itertools.islice(tasks, args.rag_batch))
+            if not chunk:
+                return
+            started = time.perf_counter()
+            neighbors = rag.retrieve_many([task["context"] for task in chunk], n_neighbors, batch_size=args.rag_batch)
+            metrics.record_retrieval(time.perf_counter() - started, len(chunk))
+            yield from zip(chunk, neighbors)
+
+    # Predictor kNN tramite il backend condiviso (llm_backends.KNNBackend): le risposte passano da metriche live e contabilità dei token
+    knn_backend = llm_backends.get_backend("knn", "knn") if args.predictor != "llm" else None
+
+    # Preparazione dei job: esempi, db_hit e predictor kNN sono calcolati subito (senza LLM), il prompt solo per i task delegati al LLM
+    def make_jobs():
+        for task, neighbors in iter_retrieved():
+            # Esempi di attacchi simili già recuperati dal DB
+            examples = neighbors[:args.rag_k]
+            
+            # Predictor kNN -> voto pesato sulla distanza dei next_command dei vicini, senza LLM
+            candidates, confidence = [], 0.0
+            if knn_backend is not None:
+                response = knn_backend.generate("", examples=neighbors, k=args.k)
+                candidates, confidence = response.text.splitlines(), response.meta["confidence"]
+            prompt = None
+            if use_llm(args.predictor, confidence, args.knn_min_confidence):
+                prompt = make_rag_prompt(task["context"], format_examples(examples), args.k)
+            yield {"task": task, "examples": examples, "candidates": candidates, "confidence": confidence, "prompt": prompt}
+
+    # Query LLM concorrenti (al massimo args.concurrency in volo, frequenza limitata per provider, solo per i job con prompt):
+    # i risultati arrivano nell'ordine dei task, per cui valutazione e scrittura restano identiche all'esecuzione seriale
+    # Con --pack N i job delegati al LLM vengono inviati a blocchi di N in un solo prompt (packing.py), ognuno con i propri esempi
+    def predict(prompt):
+        if llm_type == "gemini":
+            return query_model(prompt, args.model)
+        else:  # ollama
+            return query_model(prompt, args.model, args.ollama_url)
+
+    def make_packed(pack):
+        return make_rag_prompt_packed([job["task"]["context"] for job in pack], [format_examples(job["examples"]) for job in pack], args.k)
+
+    def parse_candidates(raw_response):
+        if not raw_response:
+            return []
+        return [utils.clean_ollama_candidate(line) for line in raw_response.splitlines() if line.strip()][:args.k]
+
+    # Cache su disco delle risposte: i prompt già valutati (stesso backend, modello e campionamento) non interrogano di nuovo il LLM
+    cache = llm_cache.LLMCache(args.llm_cache, args.cache_mode)
+    query_model = cache.wrap(query_model, llm_type, args.model)
+    limiter = runner.make_rate_limiter(llm_type, args.rps)
+    pack_stats = packing.PackStats(args.k)
+    jobs = packing.run_packed(make_jobs(), args.pack, predict, make_packed, lambda job: job["prompt"], pack_stats, args.concurrency,
+                              limiter, args.pack_parity, needs_call=lambda job: job["prompt"] is not None)
+    metrics.start()
+    # Token e costo stimato di ogni chiamata al LLM (<output>.usage.jsonl, in coda con --resume)
+    ledger = token_usage.TokenLedger(token_usage.usage_path(args.output), out_mode).start("prediction")
+    with open(args.output, out_mode, encoding="utf-8") as fout:
+        bar = tqdm(jobs, total=total, desc="Evaluating")
+        for job, raw_response, raw_unpacked in bar:
+            task = job["task"]
             context = task["context"]
             expected = task["expected"]
             
-            # Ritrovamento all'interno del DB di attacchi simili
-            retrieved_text = rag.retrieve(context, args.rag_k)
-            
-            # Verifico se il comando expected è presente come campo Attacker Next Move all'interno della retrieve del DB vettoriale
-            db_hit = hit_db(expected, retrieved_text)
-            
-            # Query LLM e ottenimento risposta
-            prompt = make_rag_prompt(context, retrieved_text, args.k)
-
-            if llm_type == "gemini":
-                raw_response = query_model(prompt, args.model)
-            else:  # ollama
-                raw_response = query_model(prompt, args.model, args.ollama_url)
-
-            candidates = []
-            if raw_response: 
-                candidates = [utils.clean_ollama_candidate(line) for line in raw_response.splitlines() if line.strip()]
+            # Verifico se il comando expected è presente come next_command tra gli esempi recuperati dal DB vettoriale
+            db_hit = hit_db_examples(expected, job["examples"])
+
+            candidates = job["candidates"]
+            confidence = job["confidence"]
+            answered_by = "knn"
+            if job["prompt"] is not None:
+                answered_by = "llm"
+                llm_calls += 1
+                candidates = parse_candidates(raw_response)
+                if raw_unpacked is not None:
+                    pack_stats.add_parity(expected, candidates, parse_candidates(raw_unpacked))
             candidates = candidates[:args.k]
              
             if not candidates: 
                 empty_responses_count += 1
             
             # Valutazione della prediction
-            # Per ogni candidato prodotto, normalizzo il contenuto e verifico sia uguale al contenuto del comando expected
-            hit = False
-            hit_rank = 0
-            norm_expected = utils.normalize_for_compare(expected)
-            if not norm_expected: 
-                sys.exit(f"Errore: Comando expected non trovato")
-
-            for rnk, cand in enumerate(candidates, 1):
-                norm_cand = utils.normalize_for_compare(cand)
-                if len(norm_cand) == len(norm_expected):
-                    i = 0
-                    while i < len(norm_expected):
-                        exp_name, exp_path = norm_expected[0]
-                        cand_name, cand_path = norm_cand[0]
-                        # Confronto prima il comando e poi l'eventuale path
-                        if (exp_name == cand_name): 
-                            if not exp_path or not cand_path or exp_path in cand_path or cand_path in exp_path:
-                                hit = True
-                                hit_rank = rnk
-                                break
-                        else: 
-                            break
-                        i+=1
-                    # Un candidato corrisponde all'expected, esco dal ciclo
-                    if hit:
-                        topk_hits += 1
-                        if hit_rank == 1: top1_hits += 1 
-                        break 
+            hit, hit_rank = utils.score_candidates(expected, candidates)
+            if hit:
+                topk_hits += 1
+                if hit_rank == 1: top1_hits += 1 
             
             # Scrittura file
             rec = {
@@ -368,12 +783,17 @@ def prediction_evaluation(args, llm_type, query_model):
                 "candidates": candidates,
                 "hit": hit,
                 "rank": hit_rank if hit else None,
-                "db_hit": db_hit
+                "db_hit": db_hit,
+                "predictor": answered_by,
+                "knn_confidence": confidence
             }
             fout.write(json.dumps(rec) + "\n")
             fout.flush()
             results.append(rec)
-            time.sleep(0.5)
+            metrics.record_task(hit, hit_rank, not candidates)
+            metrics.tick(bar)
+    metrics.close()
+    ledger.close()
 
     # Stampa dei risultati
     total = len(results)
@@ -393,5 +813,16 @@ def prediction_evaluation(args, llm_type, query_model):
     clean_hits = len([r for r in results if r['hit'] and not r['db_hit']])
     print(f"Hits influenced by DB: {db_hits}")
     print(f"Hits NOT influenced by DB: {clean_hits}")
+    db_hit_rate = len([r for r in results if r['db_hit']]) / total
+    print(f"DB hit rate ({args.retrieval_mode} retrieval, expected tra i next_command recuperati): {db_hit_rate:.2%}")
+    exact_rate = rag.exact_hits / rag.exact_lookups if rag.exact_lookups else 0.0
+    print(f"Exact-window fast path: {rag.exact_hits}/{rag.exact_lookups} ({exact_rate:.2%})")
+    print(f"Predictor: {args.predictor} | LLM calls: {llm_calls}/{total} | kNN answers: {total - llm_calls}/{total}")
+    print(metrics.summary())
+    print(ledger.summary())
+    if args.pack > 1:
+        print(pack_stats.summary())
+    print(cache.summary())
+    cache.close()
     print(f"Results saved to: {args.output}")
 
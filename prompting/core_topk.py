@@ -21,12 +21,21 @@ questa libreria sono presenti i seguenti elementi:
             comando.
         - make_prompt_topk_whitelist(cmd: str, k: int) = al prompt base vengono passati anche le whitelist per
             facilitare la costruzione del comando.
+        - make_prompt_topk_packed(contexts: List[List[str]], k: int, whitelist: bool) = prompt con più contesti indipendenti
+            in sezioni numerate (--pack N, vedi packing.py), con o senza whitelist.
         
         In entrambi i casi al LLM vengono inviati anche i --context-len comandi precedenti al comando di cui 
         deve predirre il successivo. Genera k comandi che possono essere il successivo
     
     - prediction_evaluation(args) = funzione che viene chiamata dai suddenti file e che invia al LLM 
-        il prompt, a seconda dei parametri specificati da utente, e valuta le prediction effettuate
+        il prompt, a seconda dei parametri specificati da utente, e valuta le prediction effettuate. Le richieste
+        sono eseguite in parallelo dal runner concorrente (runner.py, args.concurrency richieste in volo e args.rps
+        richieste al secondo) e i risultati vengono scritti nell'ordine dei task. I task sono generati da eval_tasks.py
+        (args.seed, lista salvata accanto ai risultati) e con args.resume l'esecuzione riprende dai task non ancora valutati. Le risposte del LLM passano dalla
+        cache su disco (llm_cache.py, args.llm_cache / args.cache_mode). Con args.pack > 1 più task condividono lo stesso
+        prompt (packing.py) e con args.pack_parity i primi task vengono valutati anche senza packing per confrontarne l'accuracy.
+        Accuracy, empty rate, latenze e token del LLM sono aggiornati durante l'esecuzione (live_metrics.py, args.metrics_interval)
+        e token e costo stimato di ogni chiamata al LLM sono registrati in <output>.usage.jsonl (token_usage.py)
 """
 # -------------------------
 # IMPORT SECTION
@@ -34,11 +43,14 @@ questa libreria sono presenti i seguenti elementi:
 
 import json
 import os
-import random
 import sys
-import time
 from typing import List
-from tqdm import tqdm
+import eval_tasks
+import live_metrics
+import llm_cache
+import packing
+import runner
+import token_usage
 import utils
 
 # -------------------------
@@ -339,6 +351,26 @@ def _whitelist_folders() -> str:
     folders = "\n".join(WHITELISTFOLDERS)
     return f"ALLOWED FOLDERS:\n{folders}\n\n"
 
+# Regole e sezioni delle whitelist condivise dal prompt singolo e da quello packed: il confronto --pack-parity misura solo l'effetto del packing
+WHITELIST_RULES = [
+    "Command can ONLY be a combination of commands from the WHITELIST, combining if necessary with files present in WHITELISTFILES or folders present in WHITELISTFOLDERS. The whitelists are below.",
+    "Commands can be constructed using pipelines (linux command '|')",
+    "Commands can present redirections ('>' or '>>') when the target is a whitelisted file or a file inside a whitelisted folder",
+]
+
+def _whitelist_rules(start: int) -> str:
+    return "".join(f"{i}. {rule}\n" for i, rule in enumerate(WHITELIST_RULES, start))
+
+def _whitelist_block() -> str:
+    return f"""WHITELIST (containing commands):
+{_whitelist_commands()}
+
+WHITELISTFILES (containing critics files that can be used with previous commands):
+{_whitelist_files()}
+
+WHITELISTFOLDERS (containing critics folders that can be used with previous commands):
+{_whitelist_folders()}"""
+
 def make_prompt_topk_without_whitelist(context: List[str], k: int) -> str:
     ctx = "\n".join(context[-10:])
     return f"""
@@ -365,137 +397,97 @@ Your task is to predict the EXACT next command the attacker will type.
 INSTRUCTIONS:
 1. Analyze the 'CURRENT SESSION' below.
 2. Output the {k} most likely next commands.
-3. Command can ONLY be a combination of commands from the WHITELIST, combining if necessary with files present in WHITELISTFILES or folders present in WHITELISTFOLDERS. The whitelists are below.
-4. Commands can be constructed using pipelines (linux command '|')
-5. Commands can present redirections ('>' or '>>') when the target is a whitelisted file or a file inside a whitelisted folder
-6. Output ONLY raw commands, one per line. No explanations.
+{_whitelist_rules(3)}6. Output ONLY raw commands, one per line. No explanations.
 
 CURRENT SESSION HISTORY:
 {ctx}
 
-WHITELIST (containing commands):
-{_whitelist_commands}
-
-WHITELISTFILES (containing critics files that can be used with previous commands):
-{_whitelist_files}
-
-WHITELISTFOLDERS (containing critics folders that can be used with previous commands):
-{_whitelist_folders}
+{_whitelist_block()}
 
 PREDICT NEXT {k} COMMANDS (Raw text only):
 """.strip()
 
+def make_prompt_topk_packed(contexts: List[List[str]], k: int, whitelist: bool = False) -> str:
+    sections = ["CURRENT SESSION HISTORY:\n" + "\n".join(context[-10:]) for context in contexts]
+    if not whitelist:
+        return packing.make_packed_prompt(sections, k)
+    # Stesse regole e stesse whitelist del prompt singolo (make_prompt_topk_whitelist), numerate dopo le istruzioni del packing
+    return packing.make_packed_prompt(sections, k, _whitelist_rules(4), "\n" + _whitelist_block() + "\n")
+
 # -------------------------
 # PREDICTION EVALUATION
 # -------------------------
 
 def prediction_evaluation(args, llm_type, query_model):
-    # Preparazione task solo nel caso in cui args.cmd is None
-    print("--- Preparazione task di valutazione ---")
-    try:
-        with open(args.sessions, "r", encoding="utf-8") as file: lines = [line for line in file if line.strip()]
-        
-        valid_lines = []
-        # Tra le linee lette, seleziono quelle che presentano context_len + 1 -> necessario per la creazione dei task
-        for line in lines:
-            if not line.strip():
-                continue
-            data = json.loads(line)
-            cmds = data.get("commands", [])
-            if len(cmds) > args.context_len:
-                valid_lines.append(line)
-        
-        # Se args.n > 0, seleziona randomicamente solo tra le valide
-        if args.n > 0:
-            random_lines = random.sample(valid_lines, min(args.n, len(valid_lines)))
-
-        tasks = []
-        for line in (random_lines if random_lines else valid_lines):
-            if not line.strip(): 
-                continue
-            try:
-                obj = json.loads(line)
-                cmds = obj.get("commands", [])
-                sid = obj.get("session", "unk")
-
-                # Dalla sessione random, si estra un comando random che funge da expected, i precedenti da contesto -> tramite questo codice è garantito che il contesto è sempre costituito da context_len comandi
-                indice_expected = random.randint(args.context_len, len(cmds) - 1)
-                expected = cmds[indice_expected]
-                context = cmds[indice_expected - args.context_len : indice_expected]
-                tasks.append({"session": sid, "context": context, "expected": expected})
-            except: 
-                continue
-    except FileNotFoundError:
-        sys.exit(f"Errore: Il file {args.sessions} non esiste.")
-
-    print(f"Totale task da valutare: {len(tasks)}")
-    if len(tasks) == 0: sys.exit("Nessun task trovato. Controlla il formato del file JSONL.")
+    from tqdm import tqdm
+    # Preparazione task (seed deterministico, lista salvata accanto ai risultati) o ripresa di un'esecuzione interrotta
+    # I task sono generati in streaming mentre il file delle sessioni viene letto: la valutazione parte subito
+    tasks, results, out_mode, total = eval_tasks.prepare_run(args)
     
     # Prompting LLM e valutazione delle prediction
+    # Con --resume i contatori partono dai record già presenti, per cui il summary copre record vecchi e nuovi
     os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
-    results = []
-    topk_hits = 0
-    top1_hits = 0
-    empty_responses_count = 0
+    topk_hits = sum(1 for r in results if r["hit"])
+    top1_hits = sum(1 for r in results if r["hit"] and r["rank"] == 1)
+    empty_responses_count = sum(1 for r in results if not r["candidates"])
 
     if args.whitelist == "yes":
         print(f"--- Inizio Valutazione (opzione whitelist) con Modello: {args.model} ---")
     else:
         print(f"--- Inizio Valutazione (opzione NON whitelist) con Modello: {args.model} ---")
 
-    with open(args.output, "w", encoding="utf-8") as fout:
-        for task in tqdm(tasks, desc="Evaluating"):
+    # Query LLM concorrenti (al massimo args.concurrency in volo, frequenza limitata per provider): i risultati arrivano
+    # nell'ordine dei task, per cui valutazione e scrittura restano identiche all'esecuzione seriale
+    # Con --pack N i task vengono inviati a blocchi di N in un solo prompt (packing.py); con N = 1 un prompt per task
+    def make_prompt(task):
+        if args.whitelist == "no":
+            return make_prompt_topk_without_whitelist(task["context"], args.k)
+        else: 
+            return make_prompt_topk_whitelist(task["context"], args.k)
+
+    def make_packed(pack):
+        return make_prompt_topk_packed([task["context"] for task in pack], args.k, args.whitelist == "yes")
+
+    def predict(prompt):
+        if llm_type == "gemini":
+            return query_model(prompt, args.model)
+        else:  # ollama
+            return query_model(prompt, args.model, args.ollama_url)
+
+    def parse_candidates(raw_response):
+        candidates = []
+        if raw_response: 
+            candidates = [utils.clean_ollama_candidate(line) for line in raw_response.splitlines() if line.strip()]
+        return candidates[:args.k]
+
+    # Cache su disco delle risposte: i prompt già valutati (stesso backend, modello e campionamento) non interrogano di nuovo il LLM
+    cache = llm_cache.LLMCache(args.llm_cache, args.cache_mode)
+    query_model = cache.wrap(query_model, llm_type, args.model)
+    limiter = runner.make_rate_limiter(llm_type, args.rps)
+    pack_stats = packing.PackStats(args.k)
+    stream = packing.run_packed(tasks, args.pack, predict, make_packed, make_prompt, pack_stats, args.concurrency, limiter, args.pack_parity)
+    # Metriche live (barra di avanzamento e <output>.metrics.json ogni args.metrics_interval secondi)
+    metrics = live_metrics.LiveMetrics(live_metrics.metrics_path(args.output), args.k, args.metrics_interval, done=results).start()
+    # Token e costo stimato di ogni chiamata al LLM (<output>.usage.jsonl, in coda con --resume)
+    ledger = token_usage.TokenLedger(token_usage.usage_path(args.output), out_mode).start("prediction")
+    with open(args.output, out_mode, encoding="utf-8") as fout:
+        bar = tqdm(stream, total=total, desc="Evaluating")
+        for task, raw_response, raw_unpacked in bar:
             context = task["context"]
             expected = task["expected"]
-            
-            # Query LLM e ottenimento risposta
-            if args.whitelist == "no":
-                prompt = make_prompt_topk_without_whitelist(context, args.k)
-            else: 
-                prompt = make_prompt_topk_whitelist(context, args.k)
-                
-            if llm_type == "gemini":
-                raw_response = query_model(prompt, args.model)
-            else:  # ollama
-                raw_response = query_model(prompt, args.model, args.ollama_url)
-
-            candidates = []
-            if raw_response: 
-                candidates = [utils.clean_ollama_candidate(line) for line in raw_response.splitlines() if line.strip()]
-            candidates = candidates[:args.k]
+
+            candidates = parse_candidates(raw_response)
+            if raw_unpacked is not None:
+                pack_stats.add_parity(expected, candidates, parse_candidates(raw_unpacked))
         
             if not candidates: 
                 empty_responses_count += 1
             
             # Valutazione della prediction
-            # Per ogni candidato prodotto, normalizzo il contenuto e verifico sia uguale al contenuto del comando expected
-            hit = False
-            hit_rank = 0
-            norm_expected = utils.normalize_for_compare(expected)
-            if not norm_expected: 
-                sys.exit(f"Errore: Comando expected non trovato")
-
-            for rnk, cand in enumerate(candidates, 1):
-                norm_cand = utils.normalize_for_compare(cand)
-                if len(norm_cand) == len(norm_expected):
-                    i = 0
-                    while i < len(norm_expected):
-                        exp_name, exp_path = norm_expected[0]
-                        cand_name, cand_path = norm_cand[0]
-                        # Confronto prima il comando e poi l'eventuale path
-                        if (exp_name == cand_name): 
-                            if not exp_path or not cand_path or exp_path in cand_path or cand_path in exp_path:
-                                hit = True
-                                hit_rank = rnk
-                                break
-                        else: 
-                            break
-                        i+=1
-                    # Un candidato corrisponde all'expected, esco dal ciclo
-                    if hit:
-                        topk_hits += 1
-                        if hit_rank == 1: top1_hits += 1 
-                        break 
+            hit, hit_rank = utils.score_candidates(expected, candidates)
+            if hit:
+                topk_hits += 1
+                if hit_rank == 1: top1_hits += 1 
             
             # Scrittura file
             rec = {
@@ -509,9 +501,13 @@ def prediction_evaluation(args, llm_type, query_model):
             fout.write(json.dumps(rec) + "\n")
             fout.flush()
             results.append(rec)
-            time.sleep(0.5)
+            metrics.record_task(hit, hit_rank, not candidates)
+            metrics.tick(bar)
+    metrics.close()
+    ledger.close()
 
     total_done = len(results)
+    if total_done == 0: sys.exit("Nessun task trovato. Controlla il formato del file JSONL.")
     topk_rate = topk_hits / total_done if total_done else 0.0
     top1_rate = top1_hits / total_done if total_done else 0.0
     empty_rate = empty_responses_count / total_done if total_done else 0.0
@@ -522,5 +518,11 @@ def prediction_evaluation(args, llm_type, query_model):
     print(f"Top-1 hits: {top1_hits}/{total_done} -> {top1_rate*100:.2f}%")
     print(f"Top-{args.k} hits: {topk_hits}/{total_done} -> {topk_rate*100:.2f}%")
     print(f"Empty predictions: {empty_responses_count}/{total_done} ({empty_rate*100:.2f}%)")
+    print(metrics.summary())
+    print(ledger.summary())
+    if args.pack > 1:
+        print(pack_stats.summary())
+    print(cache.summary())
+    cache.close()
     print(f"Results saved to: {args.output}")
 
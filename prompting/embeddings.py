@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+# -------------------------
+# INTRODUCTION -> some utils informations about the Python script
+# -------------------------
+
+"""
+- MODALITÀ:
+    Il file contiene i backend di embedding utilizzabili dal DB vettoriale (core_rag.py, quantized_index.py e defender).
+    La VM del defender non ha GPU e il modello PyTorch di SentenceTransformer domina sia il tempo di avvio sia la latenza
+    di ogni query: per questo è possibile utilizzare lo stesso modello all-MiniLM-L6-v2 esportato in ONNX (eventualmente
+    quantizzato int8) ed eseguito su CPU con onnxruntime, con un numero di thread configurabile. onnxruntime e tokenizers
+    sono già dipendenze di chromadb, quindi il backend ONNX non richiede PyTorch né sentence-transformers a runtime.
+
+    I vettori prodotti sono compatibili con quelli delle collection esistenti: stessa tokenizzazione (troncata a
+    max_seq_length), mean pooling sui token validi e normalizzazione L2, come la pipeline di SentenceTransformer.
+    Il benchmark misura la compatibilità (similarità coseno con i vettori di sentence-transformers) oltre alle prestazioni.
+
+    Backend disponibili:
+
+        - sentence-transformers = backend originale (SentenceTransformerEmbeddingFunction di chromadb, PyTorch)
+        - onnx = modello esportato in ONNX float32
+        - onnx-int8 = modello ONNX con pesi quantizzati int8 (quantizzazione dinamica di onnxruntime)
+
+    Elementi presenti:
+
+        - Classe OnnxEmbeddingFunction:
+            - __init__(self, model_dir: str, quantized: bool = False, threads: int = 0, batch_size: int = 64) -> apertura del modello esportato
+            - __call__(self, input: List[str]) -> embedding di una lista di documenti (interfaccia embedding function di chromadb)
+        - make_embedding_function(backend: str = "sentence-transformers", model_dir: str = DEFAULT_MODEL_DIR, threads: int = 0) -> embedding function del backend scelto
+        - export_model(model_dir: str, model_name: str = MODEL_NAME, quantize: bool = True) -> esportazione ONNX del modello (richiede sentence-transformers e torch, da eseguire una volta sulla macchina di sviluppo)
+        - benchmark(args) -> confronto tra backend: tempo di caricamento, latenza di encode per singola query, throughput a batch, RSS e compatibilità dei vettori
+
+- COMANDO PER ESECUZIONE:
+
+    - Esportazione del modello (cartella da copiare nella VM insieme al DB vettoriale)
+
+        python3 prompting/embeddings.py --export --model-dir ./onnx_minilm
+
+    - Benchmark dei backend
+
+        python3 prompting/embeddings.py --benchmark --sessions output/cowrie_TEST.jsonl --model-dir ./onnx_minilm --threads 2 --n 500
+
+    dove le varie flag sono:
+    - export = esporta il modello in ONNX (e la versione int8) nella cartella model-dir
+    - benchmark = esegue il confronto tra i backend
+    - model-dir = cartella del modello esportato
+    - backends = backend da confrontare
+    - threads = thread di calcolo per ogni backend (0 = default della libreria)
+    - sessions = file jsonl da cui estrarre le finestre usate come documenti di prova
+    - context-len = numero di comandi di ogni finestra
+    - n = numero di finestre di prova
+    - batch-size = dimensione dei batch per la misura del throughput
+    - report = file json dove salvare il report (opzionale)
+"""
+
+# -------------------------
+# IMPORT SECTION -> imports necessary for the Python script
+# -------------------------
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+from utils import peak_rss_mb, percentile
+
+# -------------------------
+# CLASS SECTION
+# -------------------------
+
+BACKENDS = ("sentence-transformers", "onnx", "onnx-int8")
+MODEL_NAME = "all-MiniLM-L6-v2"
+DEFAULT_MODEL_DIR = "./onnx_minilm"
+
+class OnnxEmbeddingFunction:
+    def __init__(self, model_dir: str, quantized: bool = False, threads: int = 0, batch_size: int = 64):
+        # Import locali -> il modulo resta importabile anche senza onnxruntime (backend sentence-transformers)
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, "config.json"), "r", encoding="utf-8") as file:
+            self.config = json.load(file)
+        model_path = os.path.join(model_dir, "model_int8.onnx" if quantized else "model.onnx")
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Modello ONNX non trovato: {model_path} (esegui prompting/embeddings.py --export)")
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.log_severity_level = 3
+        self.session = onnxruntime.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+        self.batch_size = batch_size
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        import numpy as np
+        embeddings = []
+        for start in range(0, len(input), self.batch_size):
+            encodings = self.tokenizer.encode_batch(list(input[start:start + self.batch_size]))
+            feed = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            hidden = self.session.run(None, {name: value for name, value in feed.items() if name in self.input_names})[0]
+
+            # Mean pooling sui soli token validi + normalizzazione L2 (come SentenceTransformer)
+            mask = feed["attention_mask"][:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.config.get("normalize", True):
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            embeddings.append(pooled.astype(np.float32))
+
+        if not embeddings:
+            return []
+        return np.concatenate(embeddings).tolist()
+
+# -------------------------
+# FUNCTION SECTION
+# -------------------------
+
+def make_embedding_function(backend: str = "sentence-transformers", model_dir: str = DEFAULT_MODEL_DIR, threads: int = 0):
+    if backend == "sentence-transformers":
+        from chromadb.utils import embedding_functions
+        if threads > 0:
+            import torch
+            torch.set_num_threads(threads)
+        return embedding_functions.SentenceTransformerEmbeddingFunction(model_name=MODEL_NAME)
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEmbeddingFunction(model_dir, quantized=backend == "onnx-int8", threads=threads)
+    raise ValueError(f"Backend di embedding sconosciuto: {backend} (disponibili: {', '.join(BACKENDS)})")
+
+def export_model(model_dir: str, model_name: str = MODEL_NAME, quantize: bool = True):
+    # Import locali -> necessari solo per l'esportazione, non a runtime
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize
+
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+    os.makedirs(model_dir, exist_ok=True)
+
+    class HiddenStates(torch.nn.Module):
+        # Wrapper che restituisce solo last_hidden_state (il pooling è eseguito in numpy)
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids, return_dict=False)[0]
+
+    dummy = tokenizer(["cd /tmp || wget <URL> || chmod +x <FILE>"], return_tensors="pt")
+    model_path = os.path.join(model_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            HiddenStates(transformer),
+            (dummy["input_ids"], dummy["attention_mask"], dummy["token_type_ids"]),
+            model_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in ("input_ids", "attention_mask", "token_type_ids", "last_hidden_state")},
+            opset_version=14,
+        )
+
+    tokenizer.save_pretrained(model_dir)
+    config = {
+        "model_name": model_name,
+        "max_seq_length": st_model.max_seq_length,
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id,
+        "normalize": any(isinstance(module, Normalize) for module in st_model),
+    }
+    with open(os.path.join(model_dir, "config.json"), "w", encoding="utf-8") as file:
+        json.dump(config, file, indent=2)
+    print(f"[EMB] Modello {model_name} esportato in {model_path}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(model_path, os.path.join(model_dir, "model_int8.onnx"), weight_type=QuantType.QInt8)
+        print(f"[EMB] Versione int8 salvata in {os.path.join(model_dir, 'model_int8.onnx')}")
+
+def bench_backend(backend: str, model_dir: str, threads: int, texts: List[str], batch_size: int, out_path: str):
+    # Misure di un singolo backend, eseguite in un processo dedicato per avere un RSS non influenzato dagli altri backend
+    import numpy as np
+    rss_start = peak_rss_mb()
+    started = time.perf_counter()
+    emb_fn = make_embedding_function(backend, model_dir, threads)
+    emb_fn(["warmup"])
+    load_s = time.perf_counter() - started
+
+    latencies = []
+    for text in texts:
+        t0 = time.perf_counter()
+        emb_fn([text])
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    started = time.perf_counter()
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(emb_fn(texts[start:start + batch_size]))
+    batch_s = time.perf_counter() - started
+
+    np.save(out_path + ".npy", np.asarray(vectors, dtype=np.float32))
+    result = {
+        "backend": backend,
+        "threads": threads,
+        "load_s": load_s,
+        "latency_ms": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "mean": float(np.mean(latencies))},
+        "throughput_docs_s": len(texts) / batch_s if batch_s > 0 else 0.0,
+        "rss_mb": {"before_load": rss_start, "peak": peak_rss_mb()},
+    }
+    with open(out_path, "w", encoding="utf-8") as file:
+        json.dump(result, file)
+
+def benchmark(args) -> Dict[str, Any]:
+    import numpy as np
+    from quantized_index import sample_query_windows
+
+    texts = [" || ".join(w) for w in sample_query_windows(args.sessions, args.context_len, args.n)]
+    if not texts:
+        sys.exit("Nessuna finestra trovata: controlla --sessions e --context-len")
+
+    results, vectors = [], {}
+    with tempfile.TemporaryDirectory() as tmp:
+        texts_path = os.path.join(tmp, "texts.json")
+        with open(texts_path, "w", encoding="utf-8") as file:
+            json.dump(texts, file)
+        for backend in args.backends:
+            out_path = os.path.join(tmp, f"{backend}.json")
+            cmd = [sys.executable, os.path.abspath(__file__), "--bench-backend", backend, "--bench-texts", texts_path,
+                   "--bench-out", out_path, "--model-dir", args.model_dir, "--threads", str(args.threads), "--batch-size", str(args.batch_size)]
+            print(f"[EMB] Benchmark backend {backend}...")
+            if subprocess.run(cmd).returncode != 0:
+                print(f"[EMB ERROR] Benchmark del backend {backend} fallito")
+                continue
+            with open(out_path, "r", encoding="utf-8") as file:
+                results.append(json.load(file))
+            vectors[backend] = np.load(out_path + ".npy")
+
+    # Compatibilità con le collection esistenti -> similarità coseno con i vettori di sentence-transformers
+    reference = vectors.get("sentence-transformers")
+    for result in results:
+        if reference is not None:
+            cos = (vectors[result["backend"]] * reference).sum(axis=1) / (
+                np.linalg.norm(vectors[result["backend"]], axis=1) * np.linalg.norm(reference, axis=1))
+            result["cosine_vs_sentence_transformers"] = {"min": float(cos.min()), "mean": float(cos.mean())}
+
+    report_data = {"texts": len(texts), "batch_size": args.batch_size, "threads": args.threads, "backends": results}
+
+    print("\n=== EMBEDDING BACKEND BENCHMARK ===")
+    print(f"Documenti: {len(texts)} | batch: {args.batch_size} | thread: {args.threads or 'default'}")
+    for result in results:
+        line = (f"{result['backend']:<22} load {result['load_s']:.2f}s | latenza p50 {result['latency_ms']['p50']:.2f} ms "
+                f"p95 {result['latency_ms']['p95']:.2f} ms | {result['throughput_docs_s']:.0f} doc/s | RSS {result['rss_mb']['peak']:.0f} MB")
+        if "cosine_vs_sentence_transformers" in result:
+            line += f" | coseno min {result['cosine_vs_sentence_transformers']['min']:.4f}"
+        print(line)
+
+    if args.report:
+        os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+        with open(args.report, "w", encoding="utf-8") as file:
+            json.dump(report_data, file, indent=2)
+        print(f"Report salvato in: {args.report}")
+    return report_data
+
+# -------------------------
+# MAIN SECTION
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend di embedding ONNX: esportazione del modello e benchmark")
+    parser.add_argument("--export", action="store_true", help="Esporta il modello in ONNX (e la versione int8) nella cartella model-dir")
+    parser.add_argument("--benchmark", action="store_true", help="Confronto tra backend di embedding")
+    parser.add_argument("--model-dir", default=DEFAULT_MODEL_DIR, help="Cartella del modello esportato")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS), help="Backend da confrontare")
+    parser.add_argument("--threads", type=int, default=0, help="Thread di calcolo per ogni backend (0 = default della libreria)")
+    parser.add_argument("--sessions", help="File jsonl da cui estrarre le finestre di prova")
+    parser.add_argument("--context-len", type=int, default=5, help="Numero di comandi di ogni finestra")
+    parser.add_argument("--n", type=int, default=500, help="Numero di finestre di prova")
+    parser.add_argument("--batch-size", type=int, default=256, help="Dimensione dei batch per la misura del throughput")
+    parser.add_argument("--report", default=None, help="File json dove salvare il report")
+    # Flag interne -> processo figlio del benchmark (un processo per backend)
+    parser.add_argument("--bench-backend", help=argparse.SUPPRESS)
+    parser.add_argument("--bench-texts", help=argparse.SUPPRESS)
+    parser.add_argument("--bench-out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.bench_backend:
+        with open(args.bench_texts, "r", encoding="utf-8") as file:
+            texts = json.load(file)
+        bench_backend(args.bench_backend, args.model_dir, args.threads, texts, args.batch_size, args.bench_out)
+        return
+    if args.export:
+        export_model(args.model_dir)
+    if args.benchmark:
+        if not args.sessions:
+            parser.error("--benchmark richiede --sessions")
+        benchmark(args)
+    if not args.export and not args.benchmark:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
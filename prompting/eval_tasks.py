@@ -0,0 +1,166 @@
+# -------------------------
+# INTRODUCTION -> some utils informations about the Python script
+# -------------------------
+
+"""
+Il file contiene la generazione dei task di valutazione, condivisa da core_topk.py e core_rag.py, e la gestione
+delle esecuzioni riprendibili. Un task è composto da sessione, contesto (context_len comandi) e comando expected.
+
+La generazione è in streaming: il file delle sessioni viene letto riga per riga e ogni riga viene decodificata una sola
+volta. Con n = 0 (un task per ogni sessione valida) i task vengono restituiti man mano che il file viene letto, per cui
+le prime richieste al LLM partono subito, senza attendere la lettura dell'intero file. Con n > 0 le sessioni vengono
+scelte con reservoir sampling: in memoria restano solo gli n task del campione, ma il campione è noto (e i task vengono
+restituiti) solo al termine della lettura del file.
+
+La generazione è deterministica: tutte le estrazioni casuali usano un generatore inizializzato con il seed. La lista
+dei task viene salvata, man mano che viene generata, accanto al file dei risultati (<output>.tasks.jsonl): la prima riga
+contiene i parametri della generazione (seed, sessions, context_len, n), le successive i task. Con --resume i task vengono
+rigenerati con gli stessi parametri, quelli già presenti nel file dei risultati (scritti nell'ordine dei task dal runner)
+vengono saltati e i restanti vengono aggiunti in coda al file. All'interno del file sono presenti i seguenti elementi:
+
+- Funzioni:
+    - iter_tasks(sessions_path: str, context_len: int, n: int, seed: int) -> generatore dei task: tra le sessioni con almeno context_len + 1 comandi
+        ne vengono scelte n a caso (tutte se n = 0) e per ognuna viene estratto un comando expected preceduto da context_len comandi di contesto
+    - tasks_path(output_path: str) -> percorso del file con la lista dei task, accanto al file dei risultati
+    - load_tasks(path: str) -> parametri della generazione e lista dei task salvati
+    - load_results(output_path: str) -> record già scritti nel file dei risultati (l'eventuale ultima riga troncata da un crash viene scartata)
+    - prepare_run(args) -> funzione chiamata da prediction_evaluation: restituisce (generatore dei task da valutare, record già presenti,
+        modalità di apertura del file di output, numero di task se noto), gestendo seed, salvataggio della lista dei task e ripresa
+"""
+
+# -------------------------
+# IMPORT SECTION -> imports necessary for the Python script
+# -------------------------
+
+import json
+import os
+import random
+import sys
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# -------------------------
+# FUNCTION SECTION
+# -------------------------
+
+def _make_task(rng: random.Random, sid: str, cmds: List[str], context_len: int) -> Dict[str, Any]:
+    # Dalla sessione, si estrae un comando random che funge da expected, i precedenti da contesto -> tramite questo codice è garantito che il contesto è sempre costituito da context_len comandi
+    indice_expected = rng.randint(context_len, len(cmds) - 1)
+    expected = cmds[indice_expected]
+    context = cmds[indice_expected - context_len : indice_expected]
+    return {"session": sid, "context": context, "expected": expected}
+
+def _iter_sessions(sessions_path: str, context_len: int) -> Iterator[Tuple[str, List[str]]]:
+    # Lettura in streaming: ogni riga viene decodificata una sola volta e vengono restituite le sessioni che presentano context_len + 1 comandi
+    try:
+        with open(sessions_path, "r", encoding="utf-8") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    obj = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                cmds = obj.get("commands", [])
+                if len(cmds) > context_len:
+                    yield obj.get("session", "unk"), cmds
+    except FileNotFoundError:
+        sys.exit(f"Errore: Il file {sessions_path} non esiste.")
+
+def iter_tasks(sessions_path: str, context_len: int, n: int, seed: int) -> Iterator[Dict[str, Any]]:
+    rng = random.Random(seed)
+
+    # n = 0 -> un task per ogni sessione valida, restituito appena letto
+    if n <= 0:
+        for sid, cmds in _iter_sessions(sessions_path, context_len):
+            yield _make_task(rng, sid, cmds, context_len)
+        return
+
+    # n > 0 -> reservoir sampling (algoritmo R): la i-esima sessione valida entra nel campione con probabilità n / i.
+    # Il task viene estratto all'ingresso nel reservoir, per cui in memoria restano solo n contesti e non le intere sessioni
+    reservoir = []
+    for seen, (sid, cmds) in enumerate(_iter_sessions(sessions_path, context_len)):
+        if seen < n:
+            reservoir.append(_make_task(rng, sid, cmds, context_len))
+        else:
+            j = rng.randint(0, seen)
+            if j < n:
+                reservoir[j] = _make_task(rng, sid, cmds, context_len)
+    yield from reservoir
+
+def tasks_path(output_path: str) -> str:
+    root, _ = os.path.splitext(output_path)
+    return root + ".tasks.jsonl"
+
+def load_tasks(path: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    with open(path, "r", encoding="utf-8") as file:
+        lines = [json.loads(line) for line in file if line.strip()]
+    return lines[0], lines[1:]
+
+def load_results(output_path: str) -> List[Dict[str, Any]]:
+    records = []
+    if not os.path.exists(output_path):
+        return records
+    with open(output_path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Riga troncata da un'interruzione durante la scrittura: viene scartata e il task rieseguito
+                break
+    return records
+
+def _persist(path: str, params: Dict[str, Any], tasks: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    # La lista dei task viene salvata man mano che i task vengono generati (prima riga = parametri della generazione)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as fout:
+        fout.write(json.dumps(params) + "\n")
+        for task in tasks:
+            fout.write(json.dumps(task) + "\n")
+            fout.flush()
+            yield task
+
+def _skip_done(tasks: Iterator[Dict[str, Any]], done: List[Dict[str, Any]], output_path: str) -> Iterator[Dict[str, Any]]:
+    # Il runner scrive i risultati nell'ordine dei task: i record presenti devono corrispondere ai primi task generati
+    skipped = 0
+    for task in tasks:
+        if skipped < len(done):
+            rec = done[skipped]
+            if task["session"] != rec.get("session") or task["context"] != rec.get("context") or task["expected"] != rec.get("expected"):
+                sys.exit(f"Errore: {output_path} non corrisponde ai task generati: impossibile riprendere.")
+            skipped += 1
+            continue
+        yield task
+    if skipped < len(done):
+        sys.exit(f"Errore: {output_path} contiene più record dei task generati: impossibile riprendere.")
+
+def prepare_run(args) -> Tuple[Iterator[Dict[str, Any]], List[Dict[str, Any]], str, Optional[int]]:
+    path = tasks_path(args.output)
+    done = []
+    out_mode = "w"
+
+    if args.resume and os.path.exists(path):
+        # Ripresa: i task vengono rigenerati con i parametri salvati (anche se la lista era stata salvata solo in parte)
+        params, _ = load_tasks(path)
+        done = load_results(args.output)
+
+        # Riscrittura dei soli record validi (elimina l'eventuale riga troncata) prima di aggiungere i nuovi in coda
+        with open(args.output, "w", encoding="utf-8") as fout:
+            for rec in done:
+                fout.write(json.dumps(rec) + "\n")
+        out_mode = "a"
+        print(f"--- Ripresa da {args.output}: {len(done)} task già valutati (seed: {params['seed']}) ---")
+    else:
+        if args.resume:
+            print(f"[WARN] Lista dei task {path} non trovata: la valutazione parte da zero.")
+        # Seed non specificato -> ne viene estratto uno e stampato, per poter ripetere la stessa esecuzione
+        seed = args.seed if args.seed is not None else random.randrange(2**32)
+        params = {"seed": seed, "sessions": args.sessions, "context_len": args.context_len, "n": args.n}
+        print(f"--- Preparazione task di valutazione (seed: {seed}) ---")
+
+    tasks = iter_tasks(params["sessions"], params["context_len"], params["n"], params["seed"])
+    tasks = _skip_done(_persist(path, params, tasks), list(done), args.output)
+    print(f"Lista dei task: {path}")
+
+    # Con n > 0 il numero di task è noto in anticipo (al più n), con n = 0 dipende dal file letto in streaming
+    total = max(params["n"] - len(done), 0) if params["n"] > 0 else None
+    return tasks, done, out_mode, total
@@ -6,9 +6,9 @@
 
 """
 - MODALITÀ:
-    Il file contiene la funzione query_gemini() che crea il client per mandare il prompt a LLM gemini 
-    (è possibile scegliere il modello). Tutte le funzionalità di effettivo prompting sono contenute all'interno
-    del file core_topk.py in quanto in comune con lo script evaluate_ollama_topk.py. 
+    Il file invia i prompt al LLM gemini (è possibile scegliere il modello) tramite il backend condiviso
+    llm_backends.GeminiBackend (client creato al primo utilizzo, timeout, retry e risposte strutturate). Tutte le funzionalità
+    di effettivo prompting sono contenute all'interno del file core_topk.py in quanto in comune con lo script evaluate_ollama_topk.py. 
 
 - PRE-REQUISITI (comandi da eseguire da riga di comando):
 
@@ -34,6 +34,17 @@
     - model = per specificare il modello di Gemini
     - n = numero di predictio da eseguire per test  
     - context-len = numero di comandi precedenti al comando di cui bisogna prevederne il successivo (forniscono il contesto di attacco per LLM)
+    - concurrency = numero massimo di richieste al LLM in volo contemporaneamente (1 = esecuzione seriale)
+    - rps = richieste al secondo consentite verso il LLM (default del provider: 2 richieste al secondo per Gemini, 0 = nessun limite)
+    - llm-timeout = timeout in secondi di ogni richiesta a Gemini
+    - llm-retries = tentativi aggiuntivi per le richieste fallite per errori transitori (rate limit, rete, server), con backoff esponenziale
+    - pack = numero di task inviati al LLM in un solo prompt a sezioni numerate (default 1 = un prompt per task, vedi packing.py)
+    - pack-parity = con pack > 1, numero di task (i primi) valutati anche senza packing per confrontare l'accuracy delle due modalità
+    - metrics-interval = secondi tra due scritture delle metriche live (accuracy, empty rate, latenze, token) in <output>.metrics.json (0 = nessun file)
+    - llm-cache = file sqlite della cache su disco delle risposte del LLM (condivisa dagli script evaluate_*)
+    - cache-mode = modalità della cache: rw (default, legge e salva), readonly (legge senza salvare), refresh (interroga di nuovo il LLM e sovrascrive), off (bypass)
+    - seed = seed della generazione dei task (se non specificato ne viene estratto e stampato uno); la lista dei task è salvata accanto ai risultati (<output>.tasks.jsonl)
+    - resume = riprende un'esecuzione interrotta: rilegge la lista dei task salvata, salta i task già presenti nel file dei risultati e aggiunge in coda i restanti
 """
 
 # -------------------------
@@ -44,53 +55,9 @@ from __future__ import annotations
 import argparse, os
 import sys
 import core_topk
-from google.genai.types import HarmCategory, HarmBlockThreshold
-from google.genai import Client
-import os
+import llm_backends
+import llm_cache
 
-# -------------------------
-# GEMINI CALLER SECTION -> creates a client for interacting with Gemini models via the Google API and defines a utility function which sends a prompt to the model and returns the generated text.
-# -------------------------
-
-api_key = os.getenv("GOOGLE_API_KEY")
-if not api_key:
-    sys.exit("ERRORE CRITICO: La variabile d'ambiente GOOGLE_API_KEY non è impostata.")
-
-client = Client(api_key=api_key)
-
-def query_gemini(prompt: str, model_name: str, temp: float = 0.0):
-    try:
-        #Visto che stiamo simulando degli attacchi, è necessario disattivare i blocchi di sicurezza
-        safety_config = [
-            {"category": HarmCategory.HARM_CATEGORY_HATE_SPEECH, "threshold": HarmBlockThreshold.BLOCK_NONE},
-            {"category": HarmCategory.HARM_CATEGORY_HARASSMENT, "threshold": HarmBlockThreshold.BLOCK_NONE},
-            {"category": HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, "threshold": HarmBlockThreshold.BLOCK_NONE},
-            {"category": HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT, "threshold": HarmBlockThreshold.BLOCK_NONE},
-        ]
-
-        response = client.models.generate_content(
-            model=model_name,
-            contents=prompt,
-            config={
-                "temperature": temp, 
-                "top_p": 0.1,
-                "max_output_tokens": 1024,
-                "safety_settings": safety_config # APPLICHIAMO I FILTRI PERMISSIVI
-            }
-        )
-        # Controllo difensivo: se il modello restituisce None o non ha testo
-        if not response or not response.text: return "" 
-        else: return response.text
-
-    except Exception as exc:
-        err_str = str(exc)
-        # Gestione dell'errore in caso di error 404
-        if "404" in err_str: 
-            print(f"\n[ERRORE FATALE] Modello '{model_name}' non trovato.")
-            sys.exit(1)
-        # Restituzione di una stringa vuota per non rompere il loop
-        return ""
-    
 # -------------------------
 # MAIN SECTION
 # -------------------------
@@ -104,10 +71,24 @@ def main():
     ap.add_argument("--k", type=int, default=5, help="Candidati proposti come next command dell'attaccante")
     ap.add_argument("--context-len", type=int, default=5, help="Numero di comandi che rappresentano il contesto di attacco")
     ap.add_argument("--n", type=int, default=0, help="Numero di prediction da eseguire (0 = una prediction per ogni sessione del file di input)")
+    ap.add_argument("--concurrency", type=int, default=4, help="Richieste al LLM in volo contemporaneamente (1 = seriale)")
+    ap.add_argument("--rps", type=float, default=None, help="Richieste al secondo verso il LLM (default del provider, 0 = nessun limite)")
+    ap.add_argument("--llm-timeout", type=float, default=llm_backends.DEFAULT_TIMEOUT, help="Timeout in secondi di ogni richiesta al LLM")
+    ap.add_argument("--llm-retries", type=int, default=llm_backends.DEFAULT_RETRIES, help="Tentativi aggiuntivi per le richieste fallite")
+    ap.add_argument("--pack", type=int, default=1, help="Task per prompt (1 = nessun packing)")
+    ap.add_argument("--pack-parity", type=int, default=0, help="Task valutati anche senza packing per il confronto di accuracy")
+    ap.add_argument("--metrics-interval", type=float, default=30.0, help="Secondi tra due scritture delle metriche live (0 = disattivato)")
+    ap.add_argument("--llm-cache", default=llm_cache.DEFAULT_CACHE_PATH, help="File sqlite della cache delle risposte del LLM")
+    ap.add_argument("--cache-mode", choices=llm_cache.CACHE_MODES, default="rw", help="Modalità della cache: rw, readonly, refresh o off")
+    ap.add_argument("--seed", type=int, default=None, help="Seed della generazione dei task (riproducibilità)")
+    ap.add_argument("--resume", action="store_true", help="Riprende un'esecuzione interrotta aggiungendo i task mancanti al file dei risultati")
     
     args = ap.parse_args()
     if args.output is None:
         args.output = f"output/topk/gemini/gemini_topk_results_n{args.n}_ctx{args.context_len}_k{args.k}.jsonl"
+    if not os.getenv("GOOGLE_API_KEY"):
+        sys.exit("ERRORE CRITICO: La variabile d'ambiente GOOGLE_API_KEY non è impostata.")
+    query_gemini = llm_backends.make_query_model("gemini", timeout=args.llm_timeout, retries=args.llm_retries)
     core_topk.prediction_evaluation(args, "gemini", query_model=query_gemini)
 
 if __name__ == "__main__":
@@ -7,7 +7,7 @@
 
 """
 - MODALITÀ:
-    Il file contiene la funzione query_ollama() per mandare il prompt a LLM ollama (è possibile scegliere il modello). 
+    Il file invia i prompt al LLM ollama (è possibile scegliere il modello) tramite il backend condiviso llm_backends.OllamaBackend. 
     Tutte le funzionalità per il supporto all'approccio RAG (Retrieval-Augmented Generation)
     sono contenute all'interno del file core_rag.py in quanto in comune con lo script evaluate_gemini_rag.py. I risultati della 
     valutazione della prediction vengono salvati nel file output/prova/ollama_rag_result_*.jsonl o 
@@ -33,13 +33,40 @@
     - sessions = per specificare file jsonl contenente le sessioni per eseguire prediction
     - persist-dir = per specificare cartella contenente DB vettoriale
     - index-file = per specificare file jsonl per indicizzazione del DB vettoriale (se diverso da sessions)
+    - index-batch-size = numero di documenti per batch di embedding durante l'indicizzazione
+    - index-workers = numero di worker che calcolano gli embedding in parallelo durante l'indicizzazione (0 = automatico)
     - output = per specificare nome del file dove verranno generati i risultati della prediction
     - model = per specificare nome modello Ollama
     - ollama-url = url per inviare il prompt al modello ollama in locale
+    - keep-alive = tempo di permanenza in memoria del modello sul server Ollama tra una richiesta e l'altra (keep_alive di Ollama)
+    - ollama-timeout = timeout in secondi di ogni richiesta a Ollama
     - k = candidati proposti come next command dell'attaccante
     - rag-k = esempi storici da recuperare nel DB vettoriale
-    - context-len = numero di comandi che rappresentano il contesto di attacco
+    - rag-batch = numero di contesti per ogni retrieve batch al DB vettoriale (retrieve anticipata di tutti i task)
+    - quantized = ricerca vettoriale su indice quantizzato int8/binary (costruito con prompting/quantized_index.py) al posto della collection Chroma
+    - rerank-factor = candidati del passaggio quantizzato per ogni esempio restituito (re-rank float)
+    - embedding-backend = backend del modello di embedding: sentence-transformers, onnx o onnx-int8 (modello esportato con prompting/embeddings.py --export)
+    - embedding-threads = thread CPU del modello di embedding (0 = default della libreria)
+    - onnx-model-dir = cartella del modello ONNX esportato
+    - hnsw-space / hnsw-m / hnsw-construction-ef / hnsw-search-ef = parametri dell'indice HNSW, usati solo alla creazione del DB (default di Chroma se non specificati, vedi prompting/hnsw_sweep.py)
+    - retrieval-mode = modalità di retrieve: vector (default), lexical (indice invertito BM25 sui token dei comandi, senza embedding) o hybrid (candidati BM25 riordinati con la distanza vettoriale)
+    - collapse = indicizzazione collapsed: un rappresentante per cluster di finestre quasi-duplicate, con occorrenze e istogramma dei comandi successivi (solo alla creazione del DB)
+    - predictor = modalità di predizione: llm (default), knn (voto pesato sulla distanza dei next_command dei vicini, senza LLM) o hybrid (LLM solo se la confidenza kNN è sotto soglia)
+    - knn-neighbors = numero di vicini recuperati dal DB per il voto kNN
+    - knn-min-confidence = soglia sulla quota di voto del primo candidato kNN sotto la quale, in modalità hybrid, si interroga il LLM
+    - context-len = numero di comandi che rappresentano il contesto di attacco (scelto al momento della query, lo stesso DB serve tutti i valori)
+    - max-context-len = lunghezza massima delle finestre indicizzate nel DB vettoriale (usata solo alla creazione del DB)
     - n = numero di prediction da eseguire (0 = una prediction per ogni sessione del file di input)
+    - concurrency = numero massimo di richieste al LLM in volo contemporaneamente (default OLLAMA_NUM_PARALLEL o 4, deve corrispondere al parallelismo del server Ollama; 1 = esecuzione seriale)
+    - rps = richieste al secondo consentite verso il LLM (default del provider: nessun limite per Ollama in locale, 0 = nessun limite)
+    - llm-retries = tentativi aggiuntivi per le richieste fallite per errori transitori (rate limit, rete, server), con backoff esponenziale
+    - pack = numero di task inviati al LLM in un solo prompt a sezioni numerate (default 1 = un prompt per task, vedi packing.py)
+    - pack-parity = con pack > 1, numero di task (i primi) valutati anche senza packing per confrontare l'accuracy delle due modalità
+    - metrics-interval = secondi tra due scritture delle metriche live (accuracy, empty rate, latenze, token) in <output>.metrics.json (0 = nessun file)
+    - llm-cache = file sqlite della cache su disco delle risposte del LLM (condivisa dagli script evaluate_*)
+    - cache-mode = modalità della cache: rw (default, legge e salva), readonly (legge senza salvare), refresh (interroga di nuovo il LLM e sovrascrive), off (bypass)
+    - seed = seed della generazione dei task (se non specificato ne viene estratto e stampato uno); la lista dei task è salvata accanto ai risultati (<output>.tasks.jsonl)
+    - resume = riprende un'esecuzione interrotta: rilegge la lista dei task salvata, salta i task già presenti nel file dei risultati e aggiunge in coda i restanti
 
 - OSSERVAZIONI:
 
@@ -56,25 +83,12 @@
 
 from __future__ import annotations
 import argparse
-import requests
 import core_rag
-
-# =============================================================================
-# OLLAMA CALLER SECTION -> The function sends a prompt to a model managed by Ollama via an HTTP POST request and returns the response generated by the model.
-# =============================================================================
-
-def query_ollama(prompt: str, model: str, url: str, temp: float = 0.0, timeout: int=120) -> str:
-    payload = {"model": model, "prompt": prompt, "stream": False, "temperature": temp, "options": {"top_p": 0.1}}     
-    try:
-        response = requests.post(url, json=payload, timeout=timeout)
-        response.raise_for_status()
-        text = response.json().get("response", "")
-
-        return text.strip()
-
-    except Exception as exc:
-        print(f"[OLLAMA ERROR] {exc}")
-        return ""
+import llm_backends
+import llm_cache
+import ollama_client
+import embeddings
+import knn_predictor
 
 # =============================================================================
 # SECTION MAIN
@@ -85,20 +99,53 @@ def main():
     parser.add_argument("--sessions", required=True, help="File jsonl contenente le sessioni per eseguire prediction")
     parser.add_argument("--persist-dir", default="./chroma_storage", help="Cartella contenente DB vettoriale")
     parser.add_argument("--index-file", help="File jsonl per indicizzazione del DB vettoriale (se diverso da sessions)")
+    parser.add_argument("--index-batch-size", type=int, default=4000, help="Documenti per batch di embedding durante l'indicizzazione")
+    parser.add_argument("--index-workers", type=int, default=0, help="Worker di embedding in parallelo durante l'indicizzazione (0 = automatico)")
     parser.add_argument("--output", default=None, help="Nome del file dove verranno generati i risultati della prediction")
     parser.add_argument("--model", default="codellama", help="Modello Ollama (es. llama3, mistral, codellama)")
-    parser.add_argument("--ollama-url", default="http://localhost:11434/api/generate")
+    parser.add_argument("--ollama-url", default=ollama_client.DEFAULT_URL)
+    parser.add_argument("--keep-alive", default=ollama_client.DEFAULT_KEEP_ALIVE, help="Tempo di permanenza in memoria del modello sul server Ollama (es. 30m, -1 = sempre)")
+    parser.add_argument("--ollama-timeout", type=int, default=120, help="Timeout in secondi di ogni richiesta a Ollama")
     parser.add_argument("--k", type=int, default=5, help="Candidati proposti come next command dell'attaccante")
     parser.add_argument("--rag-k", type=int, default=3, help="Esempi storici da recuperare nel DB vettoriale")
+    parser.add_argument("--rag-batch", type=int, default=256, help="Numero di contesti per ogni retrieve batch al DB vettoriale")
+    parser.add_argument("--quantized", choices=["int8", "binary"], default=None, help="Ricerca su indice quantizzato (costruito con prompting/quantized_index.py)")
+    parser.add_argument("--rerank-factor", type=int, default=10, help="Candidati del passaggio quantizzato per ogni esempio restituito")
+    parser.add_argument("--embedding-backend", choices=embeddings.BACKENDS, default="sentence-transformers", help="Backend del modello di embedding")
+    parser.add_argument("--embedding-threads", type=int, default=0, help="Thread CPU del modello di embedding (0 = default della libreria)")
+    parser.add_argument("--onnx-model-dir", default=embeddings.DEFAULT_MODEL_DIR, help="Cartella del modello ONNX esportato")
+    parser.add_argument("--hnsw-space", choices=["l2", "cosine", "ip"], default=None, help="Distanza dell'indice HNSW (solo alla creazione del DB)")
+    parser.add_argument("--hnsw-m", type=int, default=None, help="Parametro M dell'indice HNSW (solo alla creazione del DB)")
+    parser.add_argument("--hnsw-construction-ef", type=int, default=None, help="Parametro construction_ef dell'indice HNSW (solo alla creazione del DB)")
+    parser.add_argument("--hnsw-search-ef", type=int, default=None, help="Parametro search_ef dell'indice HNSW (solo alla creazione del DB)")
+    parser.add_argument("--retrieval-mode", choices=core_rag.RETRIEVAL_MODES, default="vector", help="Modalità di retrieve: vector, lexical o hybrid")
+    parser.add_argument("--collapse", action="store_true", help="Indicizzazione collapsed dei quasi-duplicati (solo alla creazione del DB)")
+    parser.add_argument("--predictor", choices=knn_predictor.PREDICTORS, default="llm", help="Modalità di predizione: llm, knn o hybrid")
+    parser.add_argument("--knn-neighbors", type=int, default=20, help="Vicini recuperati dal DB per il voto kNN")
+    parser.add_argument("--knn-min-confidence", type=float, default=0.5, help="Confidenza kNN sotto la quale (hybrid) si interroga il LLM")
     parser.add_argument("--context-len", type=int, default=5, help="Numero di comandi che rappresentano il contesto di attacco")
+    parser.add_argument("--max-context-len", type=int, default=10, help="Lunghezza massima delle finestre indicizzate (solo alla creazione del DB)")
     parser.add_argument("--n", type=int, default=0, help="Numero di prediction da eseguire (0 = una prediction per ogni sessione del file di input)")
+    parser.add_argument("--concurrency", type=int, default=ollama_client.DEFAULT_PARALLEL, help="Richieste al LLM in volo contemporaneamente (default OLLAMA_NUM_PARALLEL, 1 = seriale)")
+    parser.add_argument("--rps", type=float, default=None, help="Richieste al secondo verso il LLM (default del provider, 0 = nessun limite)")
+    parser.add_argument("--llm-retries", type=int, default=llm_backends.DEFAULT_RETRIES, help="Tentativi aggiuntivi per le richieste fallite")
+    parser.add_argument("--pack", type=int, default=1, help="Task per prompt (1 = nessun packing)")
+    parser.add_argument("--pack-parity", type=int, default=0, help="Task valutati anche senza packing per il confronto di accuracy")
+    parser.add_argument("--metrics-interval", type=float, default=30.0, help="Secondi tra due scritture delle metriche live (0 = disattivato)")
+    parser.add_argument("--llm-cache", default=llm_cache.DEFAULT_CACHE_PATH, help="File sqlite della cache delle risposte del LLM")
+    parser.add_argument("--cache-mode", choices=llm_cache.CACHE_MODES, default="rw", help="Modalità della cache: rw, readonly, refresh o off")
+    parser.add_argument("--seed", type=int, default=None, help="Seed della generazione dei task (riproducibilità)")
+    parser.add_argument("--resume", action="store_true", help="Riprende un'esecuzione interrotta aggiungendo i task mancanti al file dei risultati")
     
     args = parser.parse_args()
     if args.output is None: args.output = f"output/rag/ollama/ollama_rag_results_n{args.n}_ctx{args.context_len}_k{args.k}.jsonl"
-    # Modifico il nome della cartella di contenimento dei vettori -> db fortemente influenzato da context_len
-    args.persist_dir = f"{args.persist_dir}_ctx{args.context_len}"
     
+    # Pool di connessioni dimensionato sulle richieste in parallelo e modello caricato una sola volta (keep_alive)
+    ollama_client.configure(pool_size=args.concurrency, keep_alive=args.keep_alive, timeout=args.ollama_timeout)
+    ollama_client.get_client(args.ollama_url).load_model(args.model)
+    query_ollama = llm_backends.make_query_model("ollama", retries=args.llm_retries)
     core_rag.prediction_evaluation(args, "ollama", query_model=query_ollama)
+    print(ollama_client.get_client(args.ollama_url).stats_summary())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -6,7 +6,7 @@
 
 """
 - MODALITÀ:
-    Il file contiene la funzione query_ollama() per mandare il prompt a LLM ollama (è possibile scegliere il modello)
+    Il file invia i prompt al LLM ollama (è possibile scegliere il modello) tramite il backend condiviso llm_backends.OllamaBackend
     Tutte le funzionalità di effettivo prompting sono contenute all'interno del file core_topk.py in quanto 
     in comune con lo script evaluate_gemini_topk.py. 
 
@@ -36,8 +36,20 @@
     - k = numero di comandi generati per la prediction
     - model = per specificare il modello di Ollama
     - ollama-url = per specificare l'url per eseguire prompt Ollama
+    - keep-alive = tempo di permanenza in memoria del modello sul server Ollama tra una richiesta e l'altra (keep_alive di Ollama)
+    - ollama-timeout = timeout in secondi di ogni richiesta a Ollama
     - n = numero di predictio da eseguire per test  
     - context-len = numero di comandi precedenti al comando di cui bisogna prevederne il successivo (forniscono il contesto di attacco per LLM)
+    - concurrency = numero massimo di richieste al LLM in volo contemporaneamente (default OLLAMA_NUM_PARALLEL o 4, deve corrispondere al parallelismo del server Ollama; 1 = esecuzione seriale)
+    - rps = richieste al secondo consentite verso il LLM (default del provider: nessun limite per Ollama in locale, 0 = nessun limite)
+    - llm-retries = tentativi aggiuntivi per le richieste fallite per errori transitori (rate limit, rete, server), con backoff esponenziale
+    - pack = numero di task inviati al LLM in un solo prompt a sezioni numerate (default 1 = un prompt per task, vedi packing.py)
+    - pack-parity = con pack > 1, numero di task (i primi) valutati anche senza packing per confrontare l'accuracy delle due modalità
+    - metrics-interval = secondi tra due scritture delle metriche live (accuracy, empty rate, latenze, token) in <output>.metrics.json (0 = nessun file)
+    - llm-cache = file sqlite della cache su disco delle risposte del LLM (condivisa dagli script evaluate_*)
+    - cache-mode = modalità della cache: rw (default, legge e salva), readonly (legge senza salvare), refresh (interroga di nuovo il LLM e sovrascrive), off (bypass)
+    - seed = seed della generazione dei task (se non specificato ne viene estratto e stampato uno); la lista dei task è salvata accanto ai risultati (<output>.tasks.jsonl)
+    - resume = riprende un'esecuzione interrotta: rilegge la lista dei task salvata, salta i task già presenti nel file dei risultati e aggiunge in coda i restanti
 """
 
 # -------------------------
@@ -46,24 +58,10 @@
 
 from __future__ import annotations
 import argparse
-import requests
 import core_topk
-
-# -------------------------
-# OLLAMA CALLER SECTION -> The function sends a prompt to a model managed by Ollama via an HTTP POST request and returns the response generated by the model.
-# -------------------------
-
-def query_ollama(prompt: str, model: str, url: str, temp: float=0.0, timeout: int=120) -> str:
-    payload = {"model": model, "prompt": prompt, "temperature": temp, "stream": False, "options": {"top_p": 0.1}}
-    try:
-        response = requests.post(url, json=payload, timeout=timeout)
-        response.raise_for_status()
-        text = response.json().get("response", "")
-        return text.strip()
-    
-    except Exception as exc:
-        print(f"[OLLAMA ERROR] {exc}")
-        return ""
+import llm_backends
+import llm_cache
+import ollama_client
 
 # -------------------------
 # MAIN SECTION
@@ -74,16 +72,33 @@ def main():
     ap.add_argument("--sessions", help="File json contenenti le sessioni: ogni riga deve essere strutturata come: session, commands (list)")
     ap.add_argument("--whitelist", choices=["yes", "no"], default="yes", help="Con opzione attivata, esegue il prompt con whitelist")
     ap.add_argument("--model", default="codellama", help="Nome modello Ollama")
-    ap.add_argument("--ollama-url", default="http://localhost:11434/api/generate")
+    ap.add_argument("--ollama-url", default=ollama_client.DEFAULT_URL)
+    ap.add_argument("--keep-alive", default=ollama_client.DEFAULT_KEEP_ALIVE, help="Tempo di permanenza in memoria del modello sul server Ollama (es. 30m, -1 = sempre)")
+    ap.add_argument("--ollama-timeout", type=int, default=120, help="Timeout in secondi di ogni richiesta a Ollama")
     ap.add_argument("--output", default=None, help="Nome del file dove verranno generati i risultati della prediction")
     ap.add_argument("--k", type=int, default=5, help="Candidati proposti come next command dell'attaccante")
     ap.add_argument("--context-len", type=int, default=5, help="Numero di comandi che rappresentano il contesto di attacco")
     ap.add_argument("--n", type=int, default=0, help="Numero di prediction da eseguire (0 = una prediction per ogni sessione del file di input)")
+    ap.add_argument("--concurrency", type=int, default=ollama_client.DEFAULT_PARALLEL, help="Richieste al LLM in volo contemporaneamente (default OLLAMA_NUM_PARALLEL, 1 = seriale)")
+    ap.add_argument("--rps", type=float, default=None, help="Richieste al secondo verso il LLM (default del provider, 0 = nessun limite)")
+    ap.add_argument("--llm-retries", type=int, default=llm_backends.DEFAULT_RETRIES, help="Tentativi aggiuntivi per le richieste fallite")
+    ap.add_argument("--pack", type=int, default=1, help="Task per prompt (1 = nessun packing)")
+    ap.add_argument("--pack-parity", type=int, default=0, help="Task valutati anche senza packing per il confronto di accuracy")
+    ap.add_argument("--metrics-interval", type=float, default=30.0, help="Secondi tra due scritture delle metriche live (0 = disattivato)")
+    ap.add_argument("--llm-cache", default=llm_cache.DEFAULT_CACHE_PATH, help="File sqlite della cache delle risposte del LLM")
+    ap.add_argument("--cache-mode", choices=llm_cache.CACHE_MODES, default="rw", help="Modalità della cache: rw, readonly, refresh o off")
+    ap.add_argument("--seed", type=int, default=None, help="Seed della generazione dei task (riproducibilità)")
+    ap.add_argument("--resume", action="store_true", help="Riprende un'esecuzione interrotta aggiungendo i task mancanti al file dei risultati")
     
     args = ap.parse_args()
     if args.output is None:
         args.output = f"output/topk/ollama/ollama_topk_results_n{args.n}_ctx{args.context_len}_k{args.k}.jsonl"
+    # Pool di connessioni dimensionato sulle richieste in parallelo e modello caricato una sola volta (keep_alive)
+    ollama_client.configure(pool_size=args.concurrency, keep_alive=args.keep_alive, timeout=args.ollama_timeout)
+    ollama_client.get_client(args.ollama_url).load_model(args.model)
+    query_ollama = llm_backends.make_query_model("ollama", retries=args.llm_retries)
     core_topk.prediction_evaluation(args, "ollama", query_model=query_ollama)
+    print(ollama_client.get_client(args.ollama_url).stats_summary())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+# -------------------------
+# INTRODUCTION -> some utils informations about the Python script
+# -------------------------
+
+"""
+- MODALITÀ:
+    Il file contiene il comando di sweep dei parametri HNSW della collection Chroma (space, M, construction_ef, search_ef).
+    Su un campione delle sessioni del file di TRAIN viene costruito una sola volta il DB di base (embedding calcolati una
+    volta sola); i vettori vengono poi copiati in un DB candidato per ogni combinazione della griglia di parametri.
+    Le finestre di query provengono da sessioni del TRAIN escluse dal campione indicizzato (oppure dal file --sessions).
+
+    Per ogni configurazione vengono misurati:
+
+        - ann_recall = recall@k dei vicini HNSW rispetto alla ricerca esatta (forza bruta in numpy, con la stessa distanza)
+        - hit_recall = recall@k del comando successivo (il vero next command è tra i next_command dei vicini)
+        - latenza delle query singole (p50 / p99, embedding escluso) e tempo di costruzione
+        - spazio su disco del DB candidato
+
+    Le configurazioni Pareto-ottime (nessun'altra ha recall maggiore o uguale e p99 minore o uguale, con almeno una delle due
+    strettamente migliore) vengono indicate come consigliate. Le configurazioni scelte si applicano con le flag --hnsw-*
+    degli script di valutazione, alla creazione del DB.
+
+    Elementi presenti:
+
+        - sample_sessions(train_path: str, n_sessions: int, holdout: float, seed: int = 0) -> campione di sessioni da indicizzare e sessioni escluse per le query
+        - exact_neighbors(queries: np.ndarray, vectors: np.ndarray, space: str, k: int) -> vicini esatti (forza bruta) per la ground truth
+        - pareto_front(results: List[Dict[str, Any]], objective: str) -> configurazioni non dominate su recall@k e latenza p99
+        - sweep(args) -> costruzione dei DB candidati, misure e report
+
+- COMANDO PER ESECUZIONE:
+
+    python3 prompting/hnsw_sweep.py --train output/cowrie_TRAIN.jsonl --sample-sessions 500 --context-len 5 --k 3 --m 8 16 32 --construction-ef 64 100 200 --search-ef 10 50 100
+
+    dove le varie flag sono:
+    - train = file jsonl di TRAIN da cui estrarre il campione
+    - sessions = file jsonl con le sessioni da usare come query (default: sessioni del TRAIN escluse dal campione)
+    - sample-sessions = numero di sessioni del campione
+    - holdout = frazione del campione riservata alle query (solo senza --sessions)
+    - context-len = numero di comandi delle finestre di query (il DB di base è costruito con max_context_len = context-len)
+    - k = numero di vicini restituiti
+    - n = numero massimo di finestre di query
+    - space / m / construction-ef / search-ef = griglia dei parametri HNSW
+    - objective = recall usata per il fronte di Pareto (ann o hit)
+    - work-dir = cartella dei DB del campione (default: cartella temporanea, eliminata a fine sweep)
+    - report = file json del report (default output/bench/hnsw_sweep_<timestamp>.json)
+"""
+
+# -------------------------
+# IMPORT SECTION -> imports necessary for the Python script
+# -------------------------
+
+from __future__ import annotations
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+import core_rag
+from utils import percentile
+from quantized_index import dir_size
+from retrieval_bench import load_test_windows
+
+# -------------------------
+# FUNCTION SECTION
+# -------------------------
+
+ADD_BATCH = 5000     # vettori per ogni add nei DB candidati (limite di batch di Chroma)
+
+def sample_sessions(train_path: str, n_sessions: int, holdout: float, seed: int = 0) -> Tuple[List[str], List[str]]:
+    with open(train_path, "r", encoding="utf-8") as file:
+        lines = [line for line in file if line.strip()]
+    rng = random.Random(seed)
+    sample = rng.sample(lines, min(n_sessions, len(lines)))
+    n_holdout = int(len(sample) * holdout)
+    return sample[n_holdout:], sample[:n_holdout]
+
+def exact_neighbors(queries: np.ndarray, vectors: np.ndarray, space: str, k: int) -> np.ndarray:
+    import numpy as np
+    # Distanze come definite da Chroma/hnswlib: l2 al quadrato, cosine = 1 - coseno, ip = 1 - prodotto scalare
+    if space == "l2":
+        dists = (queries ** 2).sum(axis=1)[:, None] - 2 * queries @ vectors.T + (vectors ** 2).sum(axis=1)[None, :]
+    elif space == "cosine":
+        q = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        v = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        dists = 1 - q @ v.T
+    else:
+        dists = 1 - queries @ vectors.T
+    k = min(k, vectors.shape[0])
+    top = np.argpartition(dists, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(top, np.argsort(np.take_along_axis(dists, top, axis=1), axis=1), axis=1)
+
+def pareto_front(results: List[Dict[str, Any]], objective: str) -> List[Dict[str, Any]]:
+    key = f"{objective}_recall"
+    front = []
+    for r in results:
+        dominated = any(
+            o[key] >= r[key] and o["latency_ms"]["p99"] <= r["latency_ms"]["p99"]
+            and (o[key] > r[key] or o["latency_ms"]["p99"] < r["latency_ms"]["p99"])
+            for o in results if o is not r
+        )
+        if not dominated:
+            front.append(r)
+    return sorted(front, key=lambda r: r["latency_ms"]["p99"])
+
+def read_base(collection, page_size: int = 50000) -> Dict[str, Any]:
+    import numpy as np
+    data = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        for key in data:
+            data[key].extend(page[key])
+        offset += len(page["ids"])
+    data["embeddings"] = np.asarray(data["embeddings"], dtype=np.float32)
+    return data
+
+def sweep(args) -> Dict[str, Any]:
+    # Import locali -> numpy e chromadb non servono per --help
+    import numpy as np
+    import chromadb
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="hnsw_sweep_")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        # Campione del TRAIN -> DB di base (embedding calcolati una sola volta)
+        index_lines, holdout_lines = sample_sessions(args.train, args.sample_sessions, args.holdout)
+        sample_path = os.path.join(work_dir, "sample.jsonl")
+        with open(sample_path, "w", encoding="utf-8") as file:
+            file.writelines(index_lines)
+        base = core_rag.VectorContextRetriever(persist_dir=os.path.join(work_dir, "base"), max_context_len=args.context_len)
+        base.index_file(sample_path, max_context_len=args.context_len, checkpoint_path=os.path.join(work_dir, "base", "DB_checkpoint.txt"))
+        data = read_base(base.collection)
+        print(f"[SWEEP] DB di base: {len(data['ids'])} vettori")
+
+        # Finestre di query e ground truth (forza bruta sulle sole finestre di lunghezza context_len, come il filtro della retrieve)
+        if args.sessions:
+            queries_path = args.sessions
+        else:
+            queries_path = os.path.join(work_dir, "queries.jsonl")
+            with open(queries_path, "w", encoding="utf-8") as file:
+                file.writelines(holdout_lines)
+        windows = load_test_windows(queries_path, args.context_len, args.n)
+        if not windows:
+            sys.exit("Nessuna finestra di query trovata: aumenta --sample-sessions / --holdout o usa --sessions")
+        query_emb = np.asarray(base.emb_fn([" || ".join(w["context"]) for w in windows]), dtype=np.float32)
+        rows = np.array([i for i, meta in enumerate(data["metadatas"]) if meta.get("window_len") == args.context_len])
+        where = {"window_len": args.context_len}
+        if len(rows) == 0:
+            sys.exit(f"Nessun vettore con window_len = {args.context_len} nel campione: aumenta --sample-sessions")
+        print(f"[SWEEP] Finestre di query: {len(windows)} | vettori candidati (window_len = {args.context_len}): {len(rows)}")
+
+        truth_by_space = {}
+        for space in args.space:
+            top = exact_neighbors(query_emb, data["embeddings"][rows], space, args.k)
+            truth_by_space[space] = [{data["ids"][rows[j]] for j in row} for row in top]
+
+        results = []
+        grid = list(itertools.product(args.space, args.m, args.construction_ef, args.search_ef))
+        for idx, (space, m, construction_ef, search_ef) in enumerate(grid, 1):
+            hnsw = core_rag.hnsw_metadata(space, m, construction_ef, search_ef)
+            cfg_dir = os.path.join(work_dir, f"cfg_{idx}")
+            shutil.rmtree(cfg_dir, ignore_errors=True)
+            client = chromadb.PersistentClient(path=cfg_dir)
+            collection = client.create_collection(name="sweep", metadata={"layout": "multi_len", "max_context_len": args.context_len, **hnsw})
+
+            started = time.perf_counter()
+            for start in range(0, len(data["ids"]), ADD_BATCH):
+                end = start + ADD_BATCH
+                collection.add(ids=data["ids"][start:end], embeddings=data["embeddings"][start:end].tolist(),
+                               documents=data["documents"][start:end], metadatas=data["metadatas"][start:end])
+            build_s = time.perf_counter() - started
+
+            latencies, ann_hits, cmd_hits = [], 0, 0
+            for q, w, truth in zip(query_emb, windows, truth_by_space[space]):
+                t0 = time.perf_counter()
+                found = collection.query(query_embeddings=[q.tolist()], n_results=args.k, where=where, include=["metadatas"])
+                latencies.append((time.perf_counter() - t0) * 1000)
+                ann_hits += len(truth & set(found["ids"][0]))
+                cmd_hits += any(meta["next_command"].strip() == w["expected"].strip() for meta in found["metadatas"][0])
+
+            result = {
+                "params": hnsw,
+                "ann_recall": ann_hits / max(sum(len(t) for t in truth_by_space[space]), 1),
+                "hit_recall": cmd_hits / len(windows),
+                "latency_ms": {"p50": percentile(latencies, 50), "p99": percentile(latencies, 99)},
+                "build_s": build_s,
+                "disk_bytes": dir_size(cfg_dir),
+            }
+            results.append(result)
+            print(f"[SWEEP] {idx}/{len(grid)} {hnsw} -> ann R@{args.k} {result['ann_recall']:.2%} | hit R@{args.k} {result['hit_recall']:.2%} | "
+                  f"p99 {result['latency_ms']['p99']:.2f} ms | build {build_s:.1f}s")
+            del client
+            shutil.rmtree(cfg_dir, ignore_errors=True)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    front = pareto_front(results, args.objective)
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "train": args.train,
+        "sample_sessions": args.sample_sessions,
+        "vectors": len(data["ids"]),
+        "queries": len(windows),
+        "context_len": args.context_len,
+        "k": args.k,
+        "objective": args.objective,
+        "results": results,
+        "pareto": front,
+    }
+
+    print(f"\n=== HNSW SWEEP - CONFIGURAZIONI CONSIGLIATE (Pareto su {args.objective} recall@{args.k} / p99) ===")
+    for r in front:
+        flags = " ".join(f"--hnsw-{key.split(':')[1].lower().replace('_', '-')} {value}" for key, value in r["params"].items())
+        print(f"{r[args.objective + '_recall']:.2%} recall | p99 {r['latency_ms']['p99']:.2f} ms | disco {r['disk_bytes'] / 2**20:.1f} MB -> {flags}")
+
+    report_path = args.report or os.path.join("output", "bench", f"hnsw_sweep_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Report salvato in: {report_path}")
+    return report
+
+# -------------------------
+# MAIN SECTION
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep dei parametri HNSW su un campione del TRAIN (recall@k vs latenza p99)")
+    parser.add_argument("--train", required=True, help="File jsonl di TRAIN da cui estrarre il campione")
+    parser.add_argument("--sessions", default=None, help="File jsonl con le sessioni da usare come query (default: sessioni escluse dal campione)")
+    parser.add_argument("--sample-sessions", type=int, default=500, help="Numero di sessioni del campione")
+    parser.add_argument("--holdout", type=float, default=0.1, help="Frazione del campione riservata alle query")
+    parser.add_argument("--context-len", type=int, default=5, help="Numero di comandi delle finestre di query")
+    parser.add_argument("--k", type=int, default=3, help="Numero di vicini restituiti")
+    parser.add_argument("--n", type=int, default=1000, help="Numero massimo di finestre di query")
+    parser.add_argument("--space", nargs="+", choices=["l2", "cosine", "ip"], default=["l2"], help="Distanze da provare")
+    parser.add_argument("--m", type=int, nargs="+", default=[8, 16, 32], help="Valori di M da provare")
+    parser.add_argument("--construction-ef", type=int, nargs="+", default=[64, 100, 200], help="Valori di construction_ef da provare")
+    parser.add_argument("--search-ef", type=int, nargs="+", default=[10, 50, 100], help="Valori di search_ef da provare")
+    parser.add_argument("--objective", choices=["ann", "hit"], default="ann", help="Recall usata per il fronte di Pareto")
+    parser.add_argument("--work-dir", default=None, help="Cartella dei DB del campione (default: temporanea)")
+    parser.add_argument("--report", default=None, help="File json del report")
+    args = parser.parse_args()
+    sweep(args)
+
+if __name__ == "__main__":
+    main()
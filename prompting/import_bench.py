@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+# -------------------------
+# INTRODUCTION -> some utils informations about the Python script
+# -------------------------
+
+"""
+- MODALITÀ:
+    Il file contiene il benchmark del tempo di import dei moduli di prompting/ (in particolare degli script evaluate_*),
+    per evitare che un import pesante in testa a un modulo renda di nuovo lento l'avvio di tutti gli script (anche un
+    semplice --help). Le dipendenze pesanti (chromadb, numpy, tqdm, asyncio, requests, modelli di embedding, client dei
+    provider) vengono importate nel punto di utilizzo e non in testa ai moduli. Per ogni modulo il benchmark:
+
+        - esegue "python -X importtime -c 'import <modulo>'" in un processo dedicato (runs volte, si tiene il minimo)
+        - riporta il tempo cumulativo di import e gli import più costosi
+        - verifica che nessuna dipendenza pesante (HEAVY_MODULES) venga importata all'import del modulo
+        - considera un errore anche un modulo che non si riesce a importare (es. import di chromadb in testa al modulo
+          su una macchina senza chromadb): l'import di un modulo di prompting/ deve riuscire anche senza le dipendenze pesanti
+        - con --baseline confronta i tempi con un report precedente (salvato con --save-baseline), con una tolleranza
+
+    Lo script termina con codice di uscita 1 se un modulo non è importabile, importa una dipendenza pesante o supera la baseline, così
+    può essere usato come controllo prima di un commit o in CI. Il controllo sulle dipendenze non dipende dalla
+    macchina, quello sui tempi sì: la baseline va salvata sulla stessa macchina su cui si esegue il confronto.
+
+    Elementi presenti:
+
+        - TARGETS = moduli misurati di default (tutti i moduli di prompting/, entry point e moduli condivisi)
+        - HEAVY_MODULES = dipendenze che non devono essere importate all'avvio dei moduli
+        - parse_importtime(stderr: str) -> righe di -X importtime (modulo, tempo proprio, tempo cumulativo, profondità)
+        - measure(module: str, runs: int = 5) -> tempo cumulativo di import (minimo sulle runs), import più costosi e dipendenze pesanti importate
+        - compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float, slack_ms: float) -> moduli che superano la baseline
+
+- COMANDO PER ESECUZIONE:
+
+    - Salvataggio della baseline (da eseguire sul commit di riferimento)
+
+        python3 prompting/import_bench.py --save-baseline output/bench/import_baseline.json
+
+    - Controllo di una modifica
+
+        python3 prompting/import_bench.py --baseline output/bench/import_baseline.json --tolerance 0.25
+
+    dove le varie flag sono:
+    - modules = moduli da misurare (default TARGETS = tutti i moduli di prompting/)
+    - runs = numero di esecuzioni per modulo (si tiene il tempo minimo, meno sensibile al rumore)
+    - top = numero di import più costosi da mostrare per ogni modulo
+    - baseline = report json di una run precedente con cui confrontare i tempi
+    - tolerance = aumento relativo consentito rispetto alla baseline (0.25 = +25%)
+    - slack-ms = aumento assoluto consentito in ms (evita falsi positivi sui moduli molto veloci)
+    - save-baseline = file json dove salvare il report di questa run
+    - allow-heavy = non considera un errore l'import delle dipendenze pesanti (solo misura dei tempi)
+"""
+
+# -------------------------
+# IMPORT SECTION -> imports necessary for the Python script
+# -------------------------
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+# -------------------------
+# FUNCTION SECTION
+# -------------------------
+
+PROMPTING_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Tutti i moduli di prompting/ (entry point e moduli condivisi): un nuovo script viene controllato senza modificare la lista
+TARGETS = sorted(name[:-3] for name in os.listdir(PROMPTING_DIR) if name.endswith(".py") and name != "import_bench.py")
+
+HEAVY_MODULES = [
+    "chromadb", "numpy", "tqdm", "asyncio", "requests", "torch", "sentence_transformers", "onnxruntime", "tokenizers", "google.genai",
+]
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    # Formato di ogni riga: "import time: <self us> | <cumulative us> | <indentazione><modulo>"
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(parts[0]), int(parts[1]), depth))
+    return rows
+
+def measure(module: str, runs: int = 5) -> Dict[str, Any]:
+    best, best_rows = None, []
+    for _ in range(max(1, runs)):
+        # Processo dedicato per ogni misura: nessun modulo già presente in sys.modules
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, cwd=PROMPTING_DIR,
+                              env=dict(os.environ, PYTHONPATH=PROMPTING_DIR, PYTHONDONTWRITEBYTECODE="1"))
+        if proc.returncode != 0:
+            error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit code {proc.returncode}"
+            return {"module": module, "error": error}
+        rows = parse_importtime(proc.stderr)
+        total = next((cumulative for name, _, cumulative, depth in rows if name == module and depth == 0), None)
+        if total is not None and (best is None or total < best):
+            best, best_rows = total, rows
+
+    imported = {name for name, _, _, _ in best_rows}
+    heavy = [name for name in HEAVY_MODULES if name in imported]
+    heaviest = sorted((row for row in best_rows if row[0] != module and row[3] <= 2), key=lambda row: row[2], reverse=True)
+    return {
+        "module": module,
+        "cumulative_ms": round((best or 0) / 1000, 2),
+        "modules_imported": len(imported),
+        "heavy": heavy,
+        "heaviest": [{"module": name, "cumulative_ms": round(cumulative / 1000, 2)} for name, _, cumulative, _ in heaviest],
+    }
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float, slack_ms: float) -> List[str]:
+    regressions = []
+    for module, result in results.items():
+        ref = baseline.get(module)
+        if not ref or "cumulative_ms" not in ref or "cumulative_ms" not in result:
+            continue
+        limit = ref["cumulative_ms"] * (1 + tolerance) + slack_ms
+        if result["cumulative_ms"] > limit:
+            regressions.append(f"{module}: {result['cumulative_ms']:.1f} ms (baseline {ref['cumulative_ms']:.1f} ms, limite {limit:.1f} ms)")
+    return regressions
+
+# -------------------------
+# MAIN SECTION
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del tempo di import dei moduli di prompting/ (python -X importtime)")
+    parser.add_argument("modules", nargs="*", default=TARGETS, help="Moduli da misurare (default: tutti i moduli di prompting/)")
+    parser.add_argument("--runs", type=int, default=5, help="Esecuzioni per modulo (si tiene il tempo minimo)")
+    parser.add_argument("--top", type=int, default=5, help="Import più costosi da mostrare per ogni modulo")
+    parser.add_argument("--baseline", default=None, help="Report json di una run precedente con cui confrontare i tempi")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Aumento relativo consentito rispetto alla baseline")
+    parser.add_argument("--slack-ms", type=float, default=10.0, help="Aumento assoluto consentito rispetto alla baseline (ms)")
+    parser.add_argument("--save-baseline", default=None, help="File json dove salvare il report di questa run")
+    parser.add_argument("--allow-heavy", action="store_true", help="Non considera un errore l'import delle dipendenze pesanti")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        if not os.path.exists(args.baseline):
+            sys.exit(f"Errore: baseline {args.baseline} non trovata (creala con --save-baseline)")
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)["modules"]
+
+    results, failures = {}, []
+    print(f"=== IMPORT TIME ({sys.executable}, minimo su {args.runs} run) ===")
+    for module in args.modules:
+        result = measure(module, args.runs)
+        results[module] = result
+        if "error" in result:
+            # Le dipendenze pesanti sono importate nel punto di utilizzo: un modulo che non si importa (es. chromadb assente) è una regressione
+            print(f"{module:<24} non importabile: {result['error']}")
+            failures.append(f"{module}: non importabile ({result['error']})")
+            continue
+        ref = f" (baseline {baseline[module]['cumulative_ms']:.1f} ms)" if baseline and module in baseline and "cumulative_ms" in baseline[module] else ""
+        print(f"{module:<24} {result['cumulative_ms']:>8.1f} ms  {result['modules_imported']:>4} moduli{ref}")
+        for item in result["heaviest"][:args.top]:
+            print(f"    {item['module']:<40} {item['cumulative_ms']:>8.1f} ms")
+        if result["heavy"]:
+            print(f"    [!] dipendenze pesanti importate all'avvio: {', '.join(result['heavy'])}")
+            if not args.allow_heavy:
+                failures.append(f"{module}: importa {', '.join(result['heavy'])}")
+
+    if baseline:
+        failures.extend(compare(results, baseline, args.tolerance, args.slack_ms))
+
+    if args.save_baseline:
+        # Import locale -> git_commit serve solo al salvataggio della baseline
+        from retrieval_bench import git_commit
+        os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+        with open(args.save_baseline, "w", encoding="utf-8") as file:
+            json.dump({"timestamp": datetime.now().isoformat(timespec="seconds"), "git_commit": git_commit(), "python": sys.version.split()[0],
+                       "runs": args.runs, "modules": results}, file, indent=2)
+        print(f"\nBaseline salvata in {args.save_baseline}")
+
+    if failures:
+        print("\n[REGRESSIONE] " + "\n[REGRESSIONE] ".join(failures))
+        sys.exit(1)
+    print("\nNessuna regressione del tempo di import.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# -------------------------
+# INTRODUCTION -> some utils informations about the Python script
+# -------------------------
+
+"""
+Il file contiene il predittore kNN-vote, alternativo al LLM: i comandi successivi dei vicini restituiti dalla retrieve
+del DB vettoriale (già ordinati per distanza) vengono aggregati con un voto pesato sulla distanza e i k comandi con
+il punteggio più alto sono restituiti direttamente come prediction, in pochi millisecondi e senza costo di LLM.
+La quota di voto del primo candidato è usata come confidenza: in modalità "hybrid" il LLM viene interrogato solo
+quando la confidenza è inferiore alla soglia. È utilizzato da core_rag.py (valutazione) e dal defender
+(copiato nella VM dal role Ansible defender). All'interno del file sono presenti i seguenti elementi:
+
+- PREDICTORS = modalità di predizione disponibili (llm, knn, hybrid)
+- Funzioni:
+    - knn_vote(examples: List[Dict[str, Any]], k: int) -> voto pesato dei next_command dei vicini, restituisce i k comandi con la loro quota di voto
+    - knn_predict(examples: List[Dict[str, Any]], k: int) -> candidati e confidenza (quota di voto del primo candidato)
+    - use_llm(predictor: str, confidence: float, min_confidence: float) -> indica se la prediction deve essere delegata al LLM
+"""
+
+# -------------------------
+# IMPORT SECTION -> imports necessary for the Python script
+# -------------------------
+
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+from rag_index import DISTANCE_EPS
+
+# -------------------------
+# FUNCTION SECTION
+# -------------------------
+
+PREDICTORS = ("llm", "knn", "hybrid")
+
+def knn_vote(examples: List[Dict[str, Any]], k: int) -> List[Tuple[str, float]]:
+    # Ogni vicino vota il proprio next_command con peso 1 / (distanza + eps); gli esempi dell'indice esatto pesano per il numero di occorrenze
+    # I cluster di un DB collapsed votano con l'intero istogramma dei comandi successivi (occorrenze di ogni comando)
+    scores = defaultdict(float)
+    for ex in examples:
+        weight = 1 / (ex.get("distance", 0.0) + DISTANCE_EPS)
+        votes = ex.get("next_hist") or {ex["next_command"]: ex.get("count", 1)}
+        for cmd, count in votes.items():
+            cmd = cmd.strip()
+            if cmd:
+                scores[cmd] += count * weight
+
+    total = sum(scores.values())
+    if total == 0:
+        return []
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+    return [(cmd, score / total) for cmd, score in ranked]
+
+def knn_predict(examples: List[Dict[str, Any]], k: int) -> Tuple[List[str], float]:
+    ranked = knn_vote(examples, k)
+    if not ranked:
+        return [], 0.0
+    return [cmd for cmd, _ in ranked], ranked[0][1]
+
+def use_llm(predictor: str, confidence: float, min_confidence: float) -> bool:
+    if predictor == "llm":
+        return True
+    if predictor == "knn":
+        return False
+    # hybrid -> il LLM è riservato ai turni a bassa confidenza
+    return confidence < min_confidence
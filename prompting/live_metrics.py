@@ -0,0 +1,201 @@
+# -------------------------
+# INTRODUCTION -> some utils informations about the Python script
+# -------------------------
+
+"""
+Il file contiene le metriche live della valutazione, aggiornate da core_topk.py e core_rag.py durante l'esecuzione: in
+una valutazione di più ore le accuracy e le latenze non sono note solo alla fine, per cui un'esecuzione lenta o degradata
+(risposte vuote, latenza del LLM in crescita, retrieve lenta) può essere individuata e interrotta subito. Le metriche sono:
+
+    - top-1 / top-k / empty rate cumulativi (compresi i record già presenti con --resume) e sulle ultime window prediction
+    - latenza del LLM e della retrieve (per task, solo RAG) p50 / p95 sulle ultime window misure
+    - chiamate ed errori del LLM, token del prompt e generati, token generati al secondo (sul tempo trascorso e sul
+      tempo delle chiamate)
+    - risposte e latenza p50 / p95 del predictor kNN (backend knn, --predictor knn|hybrid), contate a parte dal LLM
+
+Le misure del LLM arrivano dalle risposte strutturate dei backend (llm_backends.add_observer): le risposte lette dalla
+cache su disco non sono chiamate al LLM e non vengono contate. Le metriche sono mostrate nella barra di tqdm e scritte
+ogni interval secondi nel file <output>.metrics.json, accanto al file dei risultati (scrittura atomica, il file è
+sempre leggibile durante l'esecuzione). All'interno del file sono presenti i seguenti elementi:
+
+- metrics_path(output_path: str) -> percorso del file delle metriche, accanto al file dei risultati
+- Classe LiveMetrics:
+    - __init__(self, path: str, k: int, interval: float = 30.0, window: int = 500, done: List[Dict[str, Any]] = None) -> done = record già presenti (--resume)
+    - start(self) / close(self) -> registrazione dell'observer sui backend, scrittura finale del file e rimozione dell'observer
+    - record_task(self, hit: bool, rank: int, empty: bool) -> esito di una prediction
+    - record_llm(self, response) -> risposta di una chiamata al LLM o del predictor kNN (llm_backends.LLMResponse)
+    - record_retrieval(self, latency_s: float, tasks: int) -> durata di una retrieve a blocchi di tasks contesti
+    - snapshot(self) -> dizionario con le metriche correnti
+    - tick(self, bar = None) -> aggiornamento della barra tqdm (al più una volta al secondo) e scrittura periodica del file
+    - summary(self) -> stringa con latenze e token per il summary finale
+"""
+
+# -------------------------
+# IMPORT SECTION -> imports necessary for the Python script
+# -------------------------
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List
+import llm_backends
+from utils import percentile
+
+# -------------------------
+# FUNCTION SECTION
+# -------------------------
+
+def metrics_path(output_path: str) -> str:
+    root, _ = os.path.splitext(output_path)
+    return root + ".metrics.json"
+
+# -------------------------
+# CLASS SECTION
+# -------------------------
+
+class LiveMetrics:
+
+    def __init__(self, path: str, k: int, interval: float = 30.0, window: int = 500, done: List[Dict[str, Any]] = None):
+        self.path = path
+        self.k = k
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.last_write = self.started
+        self.last_postfix = 0.0
+
+        # Esiti cumulativi (con --resume partono dai record già presenti) e sulle ultime window prediction
+        done = done or []
+        self.resumed = len(done)
+        self.tasks = len(done)
+        self.top1 = sum(1 for r in done if r["hit"] and r["rank"] == 1)
+        self.topk = sum(1 for r in done if r["hit"])
+        self.empty = sum(1 for r in done if not r["candidates"])
+        self.recent = deque(maxlen=window)
+
+        self.llm_calls = 0
+        self.llm_errors = 0
+        self.llm_time_s = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_latency = deque(maxlen=window)
+        self.knn_calls = 0
+        self.knn_latency = deque(maxlen=window)
+        self.retrieval_latency = deque(maxlen=window)
+
+    def start(self):
+        llm_backends.add_observer(self.record_llm)
+        return self
+
+    def close(self):
+        llm_backends.remove_observer(self.record_llm)
+        if self.interval > 0:
+            self.write()
+
+    def record_task(self, hit: bool, rank: int, empty: bool):
+        with self.lock:
+            self.tasks += 1
+            self.topk += bool(hit)
+            self.top1 += bool(hit) and rank == 1
+            self.empty += bool(empty)
+            self.recent.append((bool(hit), bool(hit) and rank == 1, bool(empty)))
+
+    def record_llm(self, response):
+        with self.lock:
+            if response.backend == "knn":
+                # Predictor kNN -> nessun token, non è una chiamata al LLM
+                self.knn_calls += 1
+                self.knn_latency.append(response.latency_s)
+                return
+            self.llm_calls += 1
+            self.llm_errors += response.error is not None
+            self.llm_time_s += response.latency_s
+            self.prompt_tokens += response.prompt_tokens
+            self.completion_tokens += response.completion_tokens
+            self.llm_latency.append(response.latency_s)
+
+    def record_retrieval(self, latency_s: float, tasks: int):
+        # La retrieve è a blocchi: la latenza registrata è quella per task del blocco
+        with self.lock:
+            self.retrieval_latency.append(latency_s / max(1, tasks))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            elapsed = time.time() - self.started
+            recent = list(self.recent)
+            llm_latency = list(self.llm_latency)
+            knn_latency = list(self.knn_latency)
+            retrieval_latency = list(self.retrieval_latency)
+            n = self.tasks
+            return {
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "elapsed_s": round(elapsed, 1),
+                "tasks": n,
+                "tasks_resumed": self.resumed,
+                "tasks_per_s": round((n - self.resumed) / elapsed, 3) if elapsed else 0.0,
+                "top1": self.top1 / n if n else 0.0,
+                "topk": self.topk / n if n else 0.0,
+                "empty_rate": self.empty / n if n else 0.0,
+                "window": {
+                    "tasks": len(recent),
+                    "top1": sum(r[1] for r in recent) / len(recent) if recent else 0.0,
+                    "topk": sum(r[0] for r in recent) / len(recent) if recent else 0.0,
+                    "empty_rate": sum(r[2] for r in recent) / len(recent) if recent else 0.0,
+                },
+                "llm": {
+                    "calls": self.llm_calls,
+                    "errors": self.llm_errors,
+                    "latency_p50_ms": round(percentile(llm_latency, 50) * 1000, 1),
+                    "latency_p95_ms": round(percentile(llm_latency, 95) * 1000, 1),
+                    "prompt_tokens": self.prompt_tokens,
+                    "completion_tokens": self.completion_tokens,
+                    "completion_tokens_per_s": round(self.completion_tokens / elapsed, 2) if elapsed else 0.0,
+                    "completion_tokens_per_llm_s": round(self.completion_tokens / self.llm_time_s, 2) if self.llm_time_s else 0.0,
+                },
+                "knn": {
+                    "calls": self.knn_calls,
+                    "latency_p50_ms": round(percentile(knn_latency, 50) * 1000, 2),
+                    "latency_p95_ms": round(percentile(knn_latency, 95) * 1000, 2),
+                },
+                "retrieval": {
+                    "latency_p50_ms": round(percentile(retrieval_latency, 50) * 1000, 2),
+                    "latency_p95_ms": round(percentile(retrieval_latency, 95) * 1000, 2),
+                },
+            }
+
+    def write(self):
+        # Scrittura atomica: chi legge il file durante l'esecuzione non trova mai un json a metà
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(dict(self.snapshot(), k=self.k), file, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def tick(self, bar=None):
+        now = time.time()
+        if bar is not None and now - self.last_postfix >= 1.0:
+            self.last_postfix = now
+            snap = self.snapshot()
+            bar.set_postfix_str(f"top1 {snap['top1']:.1%} top{self.k} {snap['topk']:.1%} empty {snap['empty_rate']:.1%} "
+                                f"llm p50 {snap['llm']['latency_p50_ms']:.0f}ms p95 {snap['llm']['latency_p95_ms']:.0f}ms "
+                                f"{snap['llm']['completion_tokens_per_s']:.1f} tok/s", refresh=False)
+        if self.interval > 0 and now - self.last_write >= self.interval:
+            self.last_write = now
+            self.write()
+
+    def summary(self) -> str:
+        snap = self.snapshot()
+        llm, knn, retrieval = snap["llm"], snap["knn"], snap["retrieval"]
+        line = (f"LLM: {llm['calls']} chiamate ({llm['errors']} errori) | latenza p50 {llm['latency_p50_ms']:.0f} ms "
+                f"p95 {llm['latency_p95_ms']:.0f} ms | token prompt {llm['prompt_tokens']} generati {llm['completion_tokens']} "
+                f"({llm['completion_tokens_per_s']:.1f} token/s)")
+        if knn["calls"]:
+            line += f"\nkNN: {knn['calls']} risposte | latenza p50 {knn['latency_p50_ms']:.2f} ms p95 {knn['latency_p95_ms']:.2f} ms"
+        if self.retrieval_latency:
+            line += f"\nRetrieve: latenza per task p50 {retrieval['latency_p50_ms']:.2f} ms p95 {retrieval['latency_p95_ms']:.2f} ms"
+        if self.interval > 0:
+            line += f"\nMetriche live: {self.path}"
+        return line
@@ -0,0 +1,363 @@
+# -------------------------
+# INTRODUCTION -> some utils informations about the Python script
+# -------------------------
+
+"""
+Il file contiene lo strato comune dei backend di predizione, condiviso dagli script evaluate_*, da sweep.py e dal
+defender (copiato nella VM dal role Ansible defender). Ogni backend espone la stessa interfaccia, sincrona e asincrona:
+
+    - generate(prompt, temperature, top_p, **context) -> LLMResponse (usata dai thread del runner concorrente)
+    - agenerate(prompt, temperature, top_p, **context) -> LLMResponse (coroutine, es. più richieste in parallelo con generate_many)
+
+e restituisce una risposta strutturata (LLMResponse): testo, latenza, token del prompt e generati, finish reason ed
+eventuale errore. Rispetto alle funzioni query_* usate in precedenza:
+
+    - il client del provider viene creato al primo utilizzo (non all'import) e riutilizzato da tutte le richieste
+      (Gemini: un Client per chiave API, Ollama: sessione con pool di connessioni di ollama_client.py)
+    - ogni richiesta ha un timeout e gli errori transitori (rate limit, errori di rete o del server) vengono ripetuti fino
+      a retries volte con backoff esponenziale; solo al termine dei tentativi la risposta è vuota (con error valorizzato)
+    - il modello inesistente (errore 404) resta un errore fatale, come nelle funzioni query_* originali
+    - con il parametro cache (llm_cache.LLMCache) le risposte passano dalla cache su disco, con le stesse chiavi della
+      cache degli script evaluate_* (backend, modello, prompt, temperature, top_p)
+
+All'interno del file sono presenti i seguenti elementi:
+
+- DEFAULT_TIMEOUT / DEFAULT_RETRIES / DEFAULT_BACKOFF_S = timeout (secondi), tentativi aggiuntivi e attesa iniziale tra i tentativi
+- ModelNotFoundError = modello inesistente durante una chiamata asincrona (generate_many termina lo script, come generate)
+- Classe LLMResponse:
+    risposta strutturata (text, backend, model, latency_s, prompt_tokens, completion_tokens, finish_reason, error, cached, meta).
+    I token non riportati dal provider sono stimati in locale (meta["estimated_tokens"] = True, vedi token_usage.py)
+    - to_dict(self) -> dizionario serializzabile in json
+- Classe LLMBackend:
+    classe base dei backend, gestisce cache, timeout e retry; le sottoclassi implementano _call (e, se il provider lo consente, _acall)
+    - generate(self, prompt: str, temperature: float, top_p: float, **context) -> LLMResponse
+    - agenerate(self, prompt: str, temperature: float, top_p: float, **context) -> LLMResponse (coroutine)
+- Backend disponibili (BACKENDS):
+    - GeminiBackend = API Gemini (google-genai), con filtri di sicurezza disattivati e chiamate asincrone native (client.aio)
+    - OllamaBackend = server Ollama locale tramite ollama_client.py (keep_alive, pool di connessioni, statistiche TTFT)
+    - MockBackend = risposta fissa e latenza simulata, senza rete (prove della pipeline, anche con prompt packed)
+    - KNNBackend = predictor statistico kNN-vote (knn_predictor.py): context examples = vicini recuperati dal DB, k = numero di candidati.
+        Usato da core_rag.py e dal defender con predictor knn / hybrid (prompt vuoto): le risposte (candidati su righe separate,
+        meta["confidence"]) arrivano agli observer come quelle del LLM, senza token né costo
+- Funzioni:
+    - make_backend(name: str, model: str, **kwargs) -> nuovo backend
+    - get_backend(name: str, model: str, **kwargs) -> backend condiviso per (nome, modello, parametri), creato alla prima richiesta
+    - make_query_model(name: str, **kwargs) -> funzione query_model(prompt, model, url=None, temp=TEMPERATURE) usata da core_topk / core_rag / sweep
+    - generate_many(backend: LLMBackend, prompts: List[str], concurrency: int, **kwargs) -> risposte di più prompt eseguiti in parallelo (asyncio)
+    - add_observer(observer: Callable) / remove_observer(observer: Callable) -> funzioni chiamate con ogni LLMResponse ottenuta dal provider
+        (escluse le risposte lette dalla cache), es. metriche live della valutazione (live_metrics.py)
+"""
+
+# -------------------------
+# IMPORT SECTION -> imports necessary for the Python script
+# -------------------------
+
+import os
+import re
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+import llm_cache
+import token_usage
+
+# -------------------------
+# CLASS SECTION
+# -------------------------
+
+DEFAULT_TIMEOUT = 120
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF_S = 1.0
+
+class ModelNotFoundError(RuntimeError):
+    pass
+
+class LLMResponse:
+
+    def __init__(self, text: str = "", backend: str = "", model: str = "", latency_s: float = 0.0, prompt_tokens: int = 0,
+                 completion_tokens: int = 0, finish_reason: str = "", error: Optional[str] = None, cached: bool = False,
+                 meta: Optional[Dict[str, Any]] = None):
+        self.text = text
+        self.backend = backend
+        self.model = model
+        self.latency_s = latency_s
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.finish_reason = finish_reason
+        self.error = error
+        self.cached = cached
+        self.meta = meta or {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+class LLMBackend:
+
+    name = "base"
+    cacheable = True        # i predictor locali (mock, knn) non passano dalla cache
+    estimate_tokens = True  # token non riportati dal provider -> stima locale (token_usage.estimate_tokens)
+
+    def __init__(self, model: str, timeout: float = DEFAULT_TIMEOUT, retries: int = DEFAULT_RETRIES,
+                 backoff_s: float = DEFAULT_BACKOFF_S, cache: llm_cache.LLMCache = None):
+        self.model = model
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.backoff_s = backoff_s
+        self.cache = cache if self.cacheable else None
+
+    def _call(self, prompt: str, temperature: float, top_p: float, **context) -> LLMResponse:
+        raise NotImplementedError
+
+    async def _acall(self, prompt: str, temperature: float, top_p: float, **context) -> LLMResponse:
+        # Default per i provider senza client asincrono: la chiamata sincrona gira in un thread separato
+        import asyncio
+        return await asyncio.to_thread(self._call, prompt, temperature, top_p, **context)
+
+    def _is_fatal(self, exc: Exception) -> bool:
+        # Modello inesistente -> ripetere la richiesta non serve
+        return "404" in str(exc)
+
+    def _fatal(self, exc: Exception):
+        print(f"\n[ERRORE FATALE] Modello '{self.model}' non trovato ({self.name}): {exc}")
+        sys.exit(1)
+
+    def _cached(self, prompt: str, temperature: float, top_p: float) -> Optional[LLMResponse]:
+        if self.cache is None:
+            return None
+        text = self.cache.lookup(self.name, self.model, prompt, temperature, top_p)
+        if text is None:
+            return None
+        return LLMResponse(text, self.name, self.model, cached=True)
+
+    def _finish(self, response: LLMResponse, prompt: str, temperature: float, top_p: float, started: float) -> LLMResponse:
+        response.backend = self.name
+        response.model = self.model
+        response.latency_s = time.perf_counter() - started
+        if self.estimate_tokens and (not response.prompt_tokens or (response.text and not response.completion_tokens)):
+            # Es. Ollama non riporta prompt_eval_count quando il prompt è già nella sua cache
+            response.prompt_tokens = response.prompt_tokens or token_usage.estimate_tokens(prompt)
+            response.completion_tokens = response.completion_tokens or token_usage.estimate_tokens(response.text)
+            response.meta["estimated_tokens"] = True
+        if self.cache is not None:
+            self.cache.store(self.name, self.model, prompt, response.text, temperature, top_p)
+        _notify(response)
+        return response
+
+    def _failed(self, exc: Exception, started: float) -> LLMResponse:
+        print(f"[{self.name.upper()} ERROR] {exc}")
+        response = LLMResponse("", self.name, self.model, latency_s=time.perf_counter() - started, error=str(exc))
+        _notify(response)
+        return response
+
+    def generate(self, prompt: str, temperature: float = llm_cache.TEMPERATURE, top_p: float = llm_cache.TOP_P, **context) -> LLMResponse:
+        cached = self._cached(prompt, temperature, top_p)
+        if cached is not None:
+            return cached
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                return self._finish(self._call(prompt, temperature, top_p, **context), prompt, temperature, top_p, started)
+            except Exception as exc:
+                if self._is_fatal(exc):
+                    self._fatal(exc)
+                if attempt == self.retries:
+                    return self._failed(exc, started)
+                time.sleep(self.backoff_s * 2 ** attempt)
+
+    async def agenerate(self, prompt: str, temperature: float = llm_cache.TEMPERATURE, top_p: float = llm_cache.TOP_P, **context) -> LLMResponse:
+        import asyncio
+        cached = self._cached(prompt, temperature, top_p)
+        if cached is not None:
+            return cached
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                response = await asyncio.wait_for(self._acall(prompt, temperature, top_p, **context), self.timeout)
+                return self._finish(response, prompt, temperature, top_p, started)
+            except Exception as exc:
+                if self._is_fatal(exc):
+                    # Nel loop asincrono sys.exit non terminerebbe lo script: l'errore viene propagato al chiamante
+                    raise ModelNotFoundError(f"Modello '{self.model}' non trovato ({self.name}): {exc}") from exc
+                if attempt == self.retries:
+                    return self._failed(exc, started)
+                await asyncio.sleep(self.backoff_s * 2 ** attempt)
+
+class GeminiBackend(LLMBackend):
+
+    name = "gemini"
+    _clients: Dict[str, Any] = {}
+    _clients_lock = threading.Lock()
+
+    def __init__(self, model: str, api_key: str = None, max_output_tokens: int = 1024, **kwargs):
+        super().__init__(model, **kwargs)
+        self.api_key = api_key
+        self.max_output_tokens = max_output_tokens
+        self._config_base = None
+
+    def _client(self):
+        # Client creato al primo utilizzo e condiviso da tutti i backend con la stessa chiave (connessioni riutilizzate)
+        api_key = self.api_key or os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            sys.exit("ERRORE CRITICO: La variabile d'ambiente GOOGLE_API_KEY non è impostata.")
+        with self._clients_lock:
+            if api_key not in self._clients:
+                from google.genai import Client
+                self._clients[api_key] = Client(api_key=api_key, http_options={"timeout": int(self.timeout * 1000)})
+            return self._clients[api_key]
+
+    def _config(self, temperature: float, top_p: float) -> Dict[str, Any]:
+        if self._config_base is None:
+            from google.genai.types import HarmCategory, HarmBlockThreshold
+            #Visto che stiamo simulando degli attacchi, è necessario disattivare i blocchi di sicurezza
+            self._config_base = {
+                "max_output_tokens": self.max_output_tokens,
+                "safety_settings": [
+                    {"category": HarmCategory.HARM_CATEGORY_HATE_SPEECH, "threshold": HarmBlockThreshold.BLOCK_NONE},
+                    {"category": HarmCategory.HARM_CATEGORY_HARASSMENT, "threshold": HarmBlockThreshold.BLOCK_NONE},
+                    {"category": HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, "threshold": HarmBlockThreshold.BLOCK_NONE},
+                    {"category": HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT, "threshold": HarmBlockThreshold.BLOCK_NONE},
+                ],
+            }
+        return dict(self._config_base, temperature=temperature, top_p=top_p)
+
+    def _parse(self, response) -> LLMResponse:
+        # Controllo difensivo: se il modello restituisce None o non ha testo la risposta è vuota
+        text = (response.text or "") if response else ""
+        usage = getattr(response, "usage_metadata", None)
+        candidates = getattr(response, "candidates", None) or []
+        finish_reason = getattr(candidates[0], "finish_reason", None) if candidates else None
+        return LLMResponse(text,
+                           prompt_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+                           completion_tokens=getattr(usage, "candidates_token_count", 0) or 0,
+                           finish_reason=getattr(finish_reason, "name", str(finish_reason or "")))
+
+    def _call(self, prompt: str, temperature: float, top_p: float, **context) -> LLMResponse:
+        response = self._client().models.generate_content(model=self.model, contents=prompt, config=self._config(temperature, top_p))
+        return self._parse(response)
+
+    async def _acall(self, prompt: str, temperature: float, top_p: float, **context) -> LLMResponse:
+        response = await self._client().aio.models.generate_content(model=self.model, contents=prompt, config=self._config(temperature, top_p))
+        return self._parse(response)
+
+class OllamaBackend(LLMBackend):
+
+    name = "ollama"
+
+    def __init__(self, model: str, url: str = None, **kwargs):
+        super().__init__(model, **kwargs)
+        # Import locale -> requests serve solo con il backend Ollama (non nel defender)
+        import ollama_client
+        self.client = ollama_client.get_client(url or ollama_client.DEFAULT_URL)
+
+    def _call(self, prompt: str, temperature: float, top_p: float, **context) -> LLMResponse:
+        data = self.client.request(prompt, self.model, temperature, top_p)
+        return LLMResponse(data.get("response", "").strip(),
+                           prompt_tokens=data.get("prompt_eval_count", 0),
+                           completion_tokens=data.get("eval_count", 0),
+                           finish_reason=data.get("done_reason", ""))
+
+class MockBackend(LLMBackend):
+
+    name = "mock"
+    cacheable = False
+
+    def __init__(self, model: str = "mock", response: str = "ls\nwhoami\npwd\nuname -a\ncat /etc/passwd", latency_s: float = 0.0, **kwargs):
+        super().__init__(model, **kwargs)
+        self.response = response
+        self.latency_s = latency_s
+
+    def _call(self, prompt: str, temperature: float, top_p: float, **context) -> LLMResponse:
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        # Prompt packed (packing.py) -> una sezione di risposta per ogni task
+        sections = re.findall(r"^### TASK (\d+)$", prompt, re.M)
+        text = "\n".join(f"### TASK {i}\n{self.response}" for i in sections) if sections else self.response
+        return LLMResponse(text, finish_reason="STOP")
+
+class KNNBackend(LLMBackend):
+
+    name = "knn"
+    cacheable = False
+    estimate_tokens = False
+
+    def __init__(self, model: str = "knn", **kwargs):
+        super().__init__(model, **kwargs)
+
+    def _call(self, prompt: str, temperature: float, top_p: float, examples: List[Dict[str, Any]] = None, k: int = 5, **context) -> LLMResponse:
+        from knn_predictor import knn_predict
+        candidates, confidence = knn_predict(examples or [], k)
+        return LLMResponse("\n".join(candidates), finish_reason="STOP", meta={"confidence": confidence})
+
+# -------------------------
+# FUNCTION SECTION
+# -------------------------
+
+BACKENDS: Dict[str, Callable[..., LLMBackend]] = {"gemini": GeminiBackend, "ollama": OllamaBackend, "mock": MockBackend, "knn": KNNBackend}
+_backends: Dict[Any, LLMBackend] = {}
+_backends_lock = threading.Lock()
+_loop = None
+_observers: List[Callable[[LLMResponse], None]] = []
+
+def add_observer(observer: Callable[[LLMResponse], None]):
+    _observers.append(observer)
+
+def remove_observer(observer: Callable[[LLMResponse], None]):
+    if observer in _observers:
+        _observers.remove(observer)
+
+def _notify(response: LLMResponse):
+    # Risposte effettive del provider (non quelle lette dalla cache), anche in caso di errore
+    for observer in list(_observers):
+        observer(response)
+
+def make_backend(name: str, model: str, **kwargs) -> LLMBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Backend sconosciuto: {name} (disponibili: {', '.join(BACKENDS)})")
+    return BACKENDS[name](model, **kwargs)
+
+def get_backend(name: str, model: str, **kwargs) -> LLMBackend:
+    key = (name, model, tuple(sorted((k, id(v) if k == "cache" else v) for k, v in kwargs.items())))
+    with _backends_lock:
+        if key not in _backends:
+            _backends[key] = make_backend(name, model, **kwargs)
+        return _backends[key]
+
+def make_query_model(name: str, **kwargs) -> Callable[..., str]:
+    # Firma delle funzioni query_* degli script evaluate_*: (prompt, model) per gemini, (prompt, model, url) per ollama
+    def query_model(prompt: str, model: str, url: str = None, temp: float = llm_cache.TEMPERATURE) -> str:
+        if name == "ollama":
+            return get_backend(name, model, url=url, **kwargs).generate(prompt, temp).text
+        return get_backend(name, model, **kwargs).generate(prompt, temp).text
+    return query_model
+
+def _event_loop() -> "asyncio.AbstractEventLoop":
+    # Loop asincrono unico, in un thread dedicato: i client asincroni dei provider restano legati sempre allo stesso loop
+    # (asyncio importato solo qui e nei metodi asincroni -> gli script che usano solo generate non ne pagano l'import)
+    import asyncio
+    global _loop
+    with _backends_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-backends-loop", daemon=True).start()
+        return _loop
+
+def generate_many(backend: LLMBackend, prompts: List[str], concurrency: int = 4, **kwargs) -> List[LLMResponse]:
+    # Più prompt indipendenti (es. le difese dei comandi predetti) in parallelo, al massimo concurrency richieste in volo
+    if not prompts:
+        return []
+    import asyncio
+
+    async def run():
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def one(prompt):
+            async with semaphore:
+                return await backend.agenerate(prompt, **kwargs)
+
+        return await asyncio.gather(*(one(prompt) for prompt in prompts))
+
+    try:
+        return asyncio.run_coroutine_threadsafe(run(), _event_loop()).result()
+    except ModelNotFoundError as exc:
+        print(f"\n[ERRORE FATALE] {exc}")
+        sys.exit(1)
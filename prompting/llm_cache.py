@@ -0,0 +1,173 @@
+# -------------------------
+# INTRODUCTION -> some utils informations about the Python script
+# -------------------------
+
+"""
+Il file contiene la cache su disco delle risposte del LLM, condivisa dai quattro script evaluate_*: a temperatura 0
+la risposta per lo stesso prompt è (nelle intenzioni) deterministica, per cui rieseguire una valutazione dopo un crash,
+una modifica della valutazione o di utils.normalize_for_compare non deve interrogare di nuovo il LLM.
+Le risposte sono salvate in un file sqlite, indirizzate per contenuto con la chiave (backend, modello, hash del prompt,
+temperature, top_p). Le risposte vuote (errori, timeout) non vengono salvate. All'interno del file sono presenti i seguenti elementi:
+
+- TEMPERATURE / TOP_P = parametri di campionamento usati dalle funzioni query_* degli script evaluate_* (fanno parte della chiave)
+- DEFAULT_CACHE_PATH = file sqlite di default della cache
+- CACHE_MODES = modalità della cache:
+    - rw = legge le risposte presenti e salva le nuove (default)
+    - readonly = legge le risposte presenti, ma non salva le nuove (es. cache condivisa da non modificare)
+    - refresh = ignora le risposte presenti, interroga il LLM e sovrascrive la cache
+    - off = bypass completo, nessuna lettura nè scrittura
+- Classe LLMCache:
+    - __init__(self, path: str, mode: str = "rw") -> apertura (o creazione) del file sqlite
+    - key(backend: str, model: str, prompt: str, temperature: float, top_p: float) -> chiave sha256 della richiesta
+    - get(self, key: str) / put(self, key: str, backend: str, model: str, response: str) -> lettura e scrittura di una risposta
+    - lookup(self, backend, model, prompt, temperature, top_p) / store(self, backend, model, prompt, response, temperature, top_p) -> lettura
+        e scrittura secondo la modalità della cache (usate da wrap e dai backend di llm_backends.py)
+    - wrap(self, query_model, backend: str, model: str, temperature: float = TEMPERATURE, top_p: float = TOP_P) -> restituisce
+        una funzione con la stessa firma di query_model che consulta la cache prima di interrogare il LLM (thread-safe, usabile dal runner concorrente)
+    - summary(self) -> stringa con hit/miss della cache
+    - close(self)
+
+- COMANDO PER ESECUZIONE (statistiche della cache):
+
+    python3 prompting/llm_cache.py --path output/llm_cache.sqlite3
+
+    dove le varie flag sono:
+    - path = file sqlite della cache
+"""
+
+# -------------------------
+# IMPORT SECTION -> imports necessary for the Python script
+# -------------------------
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Callable, Optional
+
+# -------------------------
+# CLASS SECTION
+# -------------------------
+
+TEMPERATURE = 0.0
+TOP_P = 0.1
+DEFAULT_CACHE_PATH = "output/llm_cache.sqlite3"
+CACHE_MODES = ("rw", "readonly", "refresh", "off")
+
+class LLMCache:
+
+    def __init__(self, path: str, mode: str = "rw"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Modalità cache non valida: {mode}")
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = None
+        if mode == "off":
+            return
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Connessione condivisa dai thread del runner: gli accessi sono serializzati da self.lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                backend TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    @staticmethod
+    def key(backend: str, model: str, prompt: str, temperature: float, top_p: float) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        raw = json.dumps([backend, model, prompt_hash, float(temperature), float(top_p)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, backend: str, model: str, response: str):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses (key, backend, model, response, created) VALUES (?, ?, ?, ?, ?)",
+                              (key, backend, model, response, time.time()))
+            self.conn.commit()
+
+    def lookup(self, backend: str, model: str, prompt: str, temperature: float = TEMPERATURE, top_p: float = TOP_P) -> Optional[str]:
+        # Risposta presente in cache (None se assente o se la modalità non prevede la lettura); aggiorna hit/miss
+        if self.mode == "off":
+            return None
+        response = None
+        if self.mode != "refresh":
+            response = self.get(self.key(backend, model, prompt, temperature, top_p))
+        with self.lock:
+            if response is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return response
+
+    def store(self, backend: str, model: str, prompt: str, response: str, temperature: float = TEMPERATURE, top_p: float = TOP_P):
+        # Le risposte vuote sono errori del provider (vedi query_*): non vengono salvate per poterle ripetere
+        if response and self.mode in ("rw", "refresh"):
+            self.put(self.key(backend, model, prompt, temperature, top_p), backend, model, response)
+
+    def wrap(self, query_model: Callable[..., str], backend: str, model: str,
+             temperature: float = TEMPERATURE, top_p: float = TOP_P) -> Callable[..., str]:
+        if self.mode == "off":
+            return query_model
+
+        def cached_query(prompt: str, *args, **kwargs) -> str:
+            response = self.lookup(backend, model, prompt, temperature, top_p)
+            if response is not None:
+                return response
+            response = query_model(prompt, *args, **kwargs)
+            self.store(backend, model, prompt, response, temperature, top_p)
+            return response
+
+        return cached_query
+
+    def summary(self) -> str:
+        if self.mode == "off":
+            return "LLM cache: off"
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"LLM cache ({self.mode}, {self.path}): {self.hits}/{total} hit ({rate:.2%})"
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+# -------------------------
+# MAIN SECTION
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Statistiche della cache su disco delle risposte LLM")
+    parser.add_argument("--path", default=DEFAULT_CACHE_PATH, help="File sqlite della cache")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        sys.exit(f"Errore: la cache {args.path} non esiste.")
+    conn = sqlite3.connect(args.path)
+    rows = conn.execute("SELECT backend, model, COUNT(*) FROM responses GROUP BY backend, model ORDER BY backend, model").fetchall()
+    conn.close()
+
+    print(f"=== LLM CACHE: {args.path} ({os.path.getsize(args.path) / 1024**2:.1f} MB) ===")
+    for backend, model, count in rows:
+        print(f"{backend:8s} {model:30s} {count} risposte")
+
+if __name__ == "__main__":
+    main()
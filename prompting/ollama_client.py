@@ -0,0 +1,143 @@
+# -------------------------
+# INTRODUCTION -> some utils informations about the Python script
+# -------------------------
+
+"""
+Il file contiene il client HTTP per Ollama condiviso da evaluate_ollama_topk.py, evaluate_ollama_rag.py e sweep.py.
+Rispetto a una requests.post per ogni prompt:
+
+    - le richieste passano da una requests.Session con un pool di connessioni persistenti (nessun nuovo handshake TCP
+      per ogni prompt), dimensionato sul numero di richieste in parallelo
+    - ogni richiesta imposta keep_alive, per cui il modello resta caricato in memoria tra una richiesta e l'altra
+      (e viene caricato una sola volta all'inizio con load_model)
+    - il numero di richieste in parallelo (--concurrency del runner) ha come default OLLAMA_NUM_PARALLEL, cioè il numero
+      di richieste che il server Ollama elabora contemporaneamente
+    - temperature e top_p sono inviati dentro "options", dove Ollama li legge (il campo "temperature" al primo livello
+      del payload viene ignorato dal server)
+    - dalle statistiche restituite da Ollama (durate in nanosecondi) vengono calcolati per ogni richiesta il time to
+      first token (caricamento del modello + valutazione del prompt) e i token generati al secondo
+
+All'interno del file sono presenti i seguenti elementi:
+
+- DEFAULT_URL / DEFAULT_KEEP_ALIVE / DEFAULT_PARALLEL = valori di default (DEFAULT_PARALLEL letto da OLLAMA_NUM_PARALLEL, 4 se non impostato)
+- Classe OllamaClient:
+    - __init__(self, url: str, pool_size: int, keep_alive: str, timeout: int) -> creazione della sessione con il pool di connessioni
+    - load_model(self, model: str) -> caricamento del modello sul server (richiesta senza prompt) con keep_alive
+    - request(self, prompt: str, model: str, temp: float, top_p: float) -> risposta completa di Ollama (solleva un'eccezione in caso di errore)
+    - generate(self, prompt: str, model: str, temp: float, top_p: float) -> testo generato (stringa vuota in caso di errore)
+    - stats_summary(self) -> stringa con richieste, errori, TTFT p50/p95 e token al secondo
+- Funzioni:
+    - configure(pool_size: int, keep_alive: str, timeout: int) -> parametri dei client creati da get_client
+    - get_client(url: str) -> client condiviso per url (creato alla prima richiesta)
+    - query_ollama(prompt: str, model: str, url: str, temp: float, top_p: float) -> funzione di query usata dagli script evaluate_ollama_*
+"""
+
+# -------------------------
+# IMPORT SECTION -> imports necessary for the Python script
+# -------------------------
+
+import os
+import threading
+from typing import Any, Dict
+import llm_cache
+from utils import percentile
+
+# -------------------------
+# CLASS SECTION
+# -------------------------
+
+DEFAULT_URL = "http://localhost:11434/api/generate"
+DEFAULT_KEEP_ALIVE = "30m"
+DEFAULT_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", "4") or 4)
+NS = 1e9
+
+class OllamaClient:
+
+    def __init__(self, url: str = DEFAULT_URL, pool_size: int = DEFAULT_PARALLEL, keep_alive: str = DEFAULT_KEEP_ALIVE, timeout: int = 120):
+        self.url = url
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        # Pool di connessioni persistenti: una connessione per ogni richiesta in parallelo
+        # (requests importato alla creazione del client: gli script evaluate_* leggono le costanti del modulo già nel parser)
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.ttft_s = []
+        self.tokens_per_s = []
+        self.eval_tokens = 0
+        self.prompt_tokens = 0
+
+    def load_model(self, model: str):
+        # Una richiesta senza prompt carica il modello in memoria e lo mantiene per keep_alive
+        try:
+            self.session.post(self.url, json={"model": model, "keep_alive": self.keep_alive}, timeout=self.timeout).raise_for_status()
+        except Exception as exc:
+            print(f"[OLLAMA ERROR] Caricamento del modello {model}: {exc}")
+
+    def request(self, prompt: str, model: str, temp: float = llm_cache.TEMPERATURE, top_p: float = llm_cache.TOP_P) -> Dict[str, Any]:
+        # Risposta completa di Ollama (testo, token, done_reason, durate): gli errori vengono sollevati al chiamante (retry in llm_backends.py)
+        payload = {"model": model, "prompt": prompt, "stream": False, "keep_alive": self.keep_alive,
+                   "options": {"temperature": temp, "top_p": top_p}}
+        try:
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except Exception:
+            with self.lock:
+                self.calls += 1
+                self.errors += 1
+            raise
+
+        # Statistiche di Ollama (ns): con stream disattivato il primo token arriva dopo caricamento del modello e valutazione del prompt
+        eval_count = data.get("eval_count", 0)
+        eval_duration = data.get("eval_duration", 0)
+        with self.lock:
+            self.calls += 1
+            self.eval_tokens += eval_count
+            self.prompt_tokens += data.get("prompt_eval_count", 0)
+            if "prompt_eval_duration" in data:
+                self.ttft_s.append((data.get("load_duration", 0) + data["prompt_eval_duration"]) / NS)
+            if eval_count and eval_duration:
+                self.tokens_per_s.append(eval_count / (eval_duration / NS))
+        return data
+
+    def generate(self, prompt: str, model: str, temp: float = llm_cache.TEMPERATURE, top_p: float = llm_cache.TOP_P) -> str:
+        try:
+            return self.request(prompt, model, temp, top_p).get("response", "").strip()
+        except Exception as exc:
+            print(f"[OLLAMA ERROR] {exc}")
+            return ""
+
+    def stats_summary(self) -> str:
+        with self.lock:
+            mean_tps = sum(self.tokens_per_s) / len(self.tokens_per_s) if self.tokens_per_s else 0.0
+            return (f"Ollama: {self.calls} richieste ({self.errors} errori) | TTFT p50 {percentile(self.ttft_s, 50) * 1000:.0f} ms "
+                    f"p95 {percentile(self.ttft_s, 95) * 1000:.0f} ms | {mean_tps:.1f} token/s | "
+                    f"token prompt {self.prompt_tokens} generati {self.eval_tokens}")
+
+# -------------------------
+# FUNCTION SECTION
+# -------------------------
+
+_config = {"pool_size": DEFAULT_PARALLEL, "keep_alive": DEFAULT_KEEP_ALIVE, "timeout": 120}
+_clients: Dict[str, OllamaClient] = {}
+_clients_lock = threading.Lock()
+
+def configure(pool_size: int = DEFAULT_PARALLEL, keep_alive: str = DEFAULT_KEEP_ALIVE, timeout: int = 120):
+    _config.update(pool_size=pool_size, keep_alive=keep_alive, timeout=timeout)
+
+def get_client(url: str = DEFAULT_URL) -> OllamaClient:
+    with _clients_lock:
+        if url not in _clients:
+            _clients[url] = OllamaClient(url, **_config)
+        return _clients[url]
+
+def query_ollama(prompt: str, model: str, url: str = DEFAULT_URL, temp: float = llm_cache.TEMPERATURE, top_p: float = llm_cache.TOP_P) -> str:
+    return get_client(url).generate(prompt, model, temp, top_p)
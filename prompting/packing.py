@@ -0,0 +1,180 @@
+# -------------------------
+# INTRODUCTION -> some utils informations about the Python script
+# -------------------------
+
+"""
+Il file contiene la modalità di packing dei prompt, utilizzata da core_topk.py e core_rag.py con --pack N: N task
+indipendenti (ognuno con il proprio contesto e, nel RAG, con i propri esempi recuperati dal DB) vengono inseriti in un
+solo prompt, in sezioni numerate "### TASK i", con un'unica intestazione di istruzioni. Per i provider limitati dal
+numero di richieste (es. quote per minuto di Gemini) una sola chiamata valuta N task.
+La risposta viene divisa nelle sezioni dei singoli task; le sezioni mancanti o vuote (risposta malformata) vengono
+rieseguite con il prompt del singolo task. Con --pack-parity M i primi M task vengono valutati anche senza packing, per
+confrontare l'accuracy delle due modalità sugli stessi task e verificare che l'accelerazione non peggiori le prediction.
+All'interno del file sono presenti i seguenti elementi:
+
+- Funzioni:
+    - iter_packs(items: Iterable, size: int) -> raggruppa gli item in blocchi di size elementi
+    - make_packed_prompt(sections: List[str], k: int, instructions: str = "", preamble: str = "") -> prompt con le sezioni numerate dei task
+    - parse_packed_response(text: str, n: int) -> testo della risposta per ognuna delle n sezioni (None se mancante o vuota)
+    - query_packed(jobs: List[Dict[str, Any]], query: Callable, ...) -> risposta grezza per ogni job del blocco, con retry dei task malformati
+    - run_packed(jobs: Iterable, size: int, query: Callable, ...) -> esegue i blocchi sul runner concorrente (runner.run_ordered) e
+        restituisce (job, risposta, risposta senza packing) nell'ordine dei job. La risposta senza packing è presente solo per
+        i primi parity job (altrimenti None); i job per cui needs_call(job) è falso (es. risposte kNN) non entrano nel prompt
+- Classe PackStats:
+    contatori del packing (chiamate packed, task, sezioni malformate rieseguite) e confronto di accuracy con i task valutati anche senza packing:
+    - add_parity(self, expected: str, packed: List[str], unpacked: List[str]) -> aggiunge un task al confronto
+    - summary(self) -> stringa con statistiche del packing e parità di accuracy
+"""
+
+# -------------------------
+# IMPORT SECTION -> imports necessary for the Python script
+# -------------------------
+
+import re
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import runner
+import utils
+
+# -------------------------
+# FUNCTION SECTION
+# -------------------------
+
+SECTION_RE = re.compile(r"^\s*[#*]*\s*TASK\s+(\d+)\s*[#*:]*\s*$", re.I | re.M)
+
+def iter_packs(items: Iterable, size: int) -> Iterator[List[Any]]:
+    pack = []
+    for item in items:
+        pack.append(item)
+        if len(pack) >= size:
+            yield pack
+            pack = []
+    if pack:
+        yield pack
+
+def make_packed_prompt(sections: List[str], k: int, instructions: str = "", preamble: str = "") -> str:
+    body = "\n\n".join(f"### TASK {i}\n{section}" for i, section in enumerate(sections, 1))
+    return f"""
+You are an AI simulating a cyber-attacker inside an SSH honeypot.
+Below are {len(sections)} INDEPENDENT attacker sessions, numbered '### TASK 1' to '### TASK {len(sections)}'.
+For EACH task, predict the EXACT next command the attacker will type.
+
+INSTRUCTIONS:
+1. Analyze each task separately: tasks are unrelated to each other.
+2. For each task, output the {k} most likely next commands.
+3. Answer with the header '### TASK i' for every task, in the same order, followed ONLY by raw commands, one per line. No explanations.
+{instructions}{preamble}
+{body}
+
+ANSWER ({len(sections)} sections, {k} raw commands each):
+""".strip()
+
+def parse_packed_response(text: str, n: int) -> List[Optional[str]]:
+    sections: List[Optional[str]] = [None] * n
+    if not text:
+        return sections
+    matches = list(SECTION_RE.finditer(text))
+    for pos, match in enumerate(matches):
+        idx = int(match.group(1)) - 1
+        end = matches[pos + 1].start() if pos + 1 < len(matches) else len(text)
+        content = text[match.end():end].strip()
+        # Sezione fuori intervallo, duplicata o vuota -> considerata malformata
+        if 0 <= idx < n and sections[idx] is None and content:
+            sections[idx] = content
+    return sections
+
+def query_packed(jobs: List[Dict[str, Any]], query: Callable[[str], str], make_packed: Callable[[List[Dict[str, Any]]], str],
+                 make_single: Callable[[Dict[str, Any]], str], stats: "PackStats", acquire: Callable[[], None] = None) -> List[str]:
+    # Blocco di un solo task -> prompt originale, nessun packing
+    if len(jobs) == 1:
+        return [query(make_single(jobs[0]))]
+
+    raw = query(make_packed(jobs))
+    sections = parse_packed_response(raw, len(jobs))
+    responses = []
+    retried = 0
+    for job, section in zip(jobs, sections):
+        if section is None:
+            # Sezione malformata -> retry del singolo task con il suo prompt (rispettando il rate limit del provider)
+            retried += 1
+            if acquire is not None:
+                acquire()
+            section = query(make_single(job))
+        responses.append(section or "")
+    stats.add_pack(len(jobs), retried)
+    return responses
+
+def run_packed(jobs: Iterable[Dict[str, Any]], size: int, query: Callable[[str], str], make_packed: Callable[[List[Dict[str, Any]]], str],
+               make_single: Callable[[Dict[str, Any]], str], stats: "PackStats", concurrency: int, limiter: runner.RateLimiter = None,
+               parity: int = 0, needs_call: Callable[[Dict[str, Any]], bool] = None) -> Iterator[Tuple[Dict[str, Any], Optional[str], Optional[str]]]:
+    needs_call = needs_call or (lambda job: True)
+    acquire = limiter.acquire if limiter is not None else None
+
+    def worker(indexed_pack):
+        start, pack = indexed_pack
+        to_query = [job for job in pack if needs_call(job)]
+        raws = iter(query_packed(to_query, query, make_packed, make_single, stats, acquire) if to_query else [])
+        out = []
+        for i, job in enumerate(pack):
+            if not needs_call(job):
+                out.append((None, None))
+                continue
+            raw = next(raws)
+            unpacked = None
+            if size > 1 and start + i < parity:
+                # Stesso task valutato senza packing, per il confronto di accuracy
+                if acquire is not None:
+                    acquire()
+                unpacked = query(make_single(job))
+            out.append((raw, unpacked))
+        return out
+
+    # Ogni blocco è un item del runner: al più concurrency prompt packed in volo, un token del limiter per blocco
+    packs = ((p * size, pack) for p, pack in enumerate(iter_packs(jobs, max(1, size))))
+    for (_, pack), out in runner.run_ordered(packs, worker, concurrency, limiter, needs_call=lambda ip: any(needs_call(j) for j in ip[1])):
+        for job, (raw, unpacked) in zip(pack, out):
+            yield job, raw, unpacked
+
+# -------------------------
+# CLASS SECTION
+# -------------------------
+
+class PackStats:
+
+    def __init__(self, k: int):
+        self.k = k
+        self.lock = threading.Lock()
+        self.packed_calls = 0
+        self.packed_tasks = 0
+        self.retried = 0
+        self.parity_tasks = 0
+        self.parity_hits = {"packed": 0, "unpacked": 0}
+        self.parity_top1 = {"packed": 0, "unpacked": 0}
+        self.parity_disagree = 0
+
+    def add_pack(self, tasks: int, retried: int):
+        with self.lock:
+            self.packed_calls += 1
+            self.packed_tasks += tasks
+            self.retried += retried
+
+    def add_parity(self, expected: str, packed: List[str], unpacked: List[str]):
+        # Stessa regola di confronto della valutazione (utils.score_candidates) per le due modalità
+        results = {"packed": utils.score_candidates(expected, packed[:self.k]), "unpacked": utils.score_candidates(expected, unpacked[:self.k])}
+        self.parity_tasks += 1
+        for mode, (hit, rank) in results.items():
+            self.parity_hits[mode] += hit
+            self.parity_top1[mode] += hit and rank == 1
+        self.parity_disagree += results["packed"][0] != results["unpacked"][0]
+
+    def summary(self) -> str:
+        lines = [f"Packing: {self.packed_calls} chiamate per {self.packed_tasks} task "
+                 f"({self.packed_tasks / self.packed_calls if self.packed_calls else 0:.1f} task/chiamata) | "
+                 f"sezioni malformate rieseguite: {self.retried}"]
+        if self.parity_tasks:
+            n = self.parity_tasks
+            lines.append(f"Parità packed vs unpacked su {n} task: "
+                         f"top-1 {self.parity_top1['packed'] / n:.2%} vs {self.parity_top1['unpacked'] / n:.2%} | "
+                         f"top-{self.k} {self.parity_hits['packed'] / n:.2%} vs {self.parity_hits['unpacked'] / n:.2%} | "
+                         f"esito diverso: {self.parity_disagree}/{n}")
+        return "\n".join(lines)
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+
+# -------------------------
+# INTRODUCTION -> some utils informations about the Python script
+# -------------------------
+
+"""
+- MODALITÀ:
+    Il file contiene l'indice quantizzato del DB vettoriale, alternativo alla collection Chroma per ridurre lo spazio su
+    disco e in memoria (i vettori float32 a 384 dimensioni di MiniLM occupano diversi GB sull'intero dataset, mentre la VM
+    dell'honeypot ha un disco da 25GB). Sono supportate due modalità di memorizzazione:
+
+        - int8 = ogni componente viene quantizzata su 8 bit con una scala per dimensione (4x più piccolo di float32)
+        - binary = si memorizza solo il segno di ogni componente, 1 bit per dimensione (32x più piccolo di float32)
+
+    La ricerca avviene in due passi: un passaggio veloce sui codici quantizzati seleziona rerank_factor * k candidati,
+    poi i candidati vengono riordinati con la distanza L2 calcolata sui vettori float16 salvati accanto ai codici
+    (vectors.npy, letto in memory-map: solo le righe dei candidati vengono lette dal disco, nessun embedding ricalcolato).
+    La scala int8 di ogni dimensione è calcolata sul massimo assoluto di tutti i vettori, non di una sola pagina.
+    Le distanze restituite sono L2 al quadrato, come quelle della collection Chroma (spazio di default "l2").
+
+    Lo store è autonomo: documenti e metadati completi (items.sqlite3) e i metadati della collection (meta.json) sono
+    salvati insieme ai vettori, per cui la retrieve (core_rag.py e defender) funziona senza la collection Chroma. Nella VM
+    basta copiare persist-dir/quantized_<mode> e rag_index.sqlite3 (role db_vettoriale con vector_store: int8 / binary)
+    invece di tutta la cartella chroma_storage. I vettori aggiunti dopo la costruzione (indicizzazione online del
+    defender) vengono salvati in coda (extra_vectors.f16) e cercati in modo esatto; ricostruendo lo store dalla
+    collection vengono inclusi nei codici quantizzati.
+
+    Elementi presenti:
+
+        - Classe QuantizedIndex:
+            - build(collection, out_dir: str, mode: str, page_size: int = 50000) -> costruisce l'indice leggendo a pagine embedding, documenti e metadati della collection (vettori float16 in un primo passaggio, codici quantizzati nel secondo)
+            - __init__(self, index_dir: str, emb_fn) -> apertura di un indice già costruito (codici e vettori float16 sono letti in memory-map)
+            - count(self) / get(self, ids = None, include = ..., limit = None, offset = 0) / add(self, ids, documents, metadatas, embeddings = None) -> stessa interfaccia della collection Chroma usata dalla retrieve e dall'indicizzazione online
+            - search(self, query_embeddings, k: int, rerank_factor: int = 10, rerank: bool = True, window_len: int = None) -> ricerca dei k vicini per ogni query, con re-rank float dei candidati (con window_len si considerano solo le finestre di quella lunghezza, come il filtro della collection multi-lunghezza)
+        - find_store(persist_dir: str, mode: str = None) -> cartella dello store quantizzato del DB (None se assente)
+        - store_disk_bytes(persist_dir: str, quantized: str = None) -> spazio su disco effettivo della configurazione (Chroma oppure store quantizzato autonomo)
+        - report(args) -> confronto con la collection Chroma: spazio su disco effettivo, memoria dei vettori e recall@k persa
+
+- COMANDO PER ESECUZIONE (costruzione dell'indice e report):
+
+    python3 prompting/quantized_index.py --persist-dir ./chroma_storage --mode int8 --sessions output/cowrie_TEST.jsonl --context-len 5 --n 500 --k 3
+
+    dove le varie flag sono:
+    - persist-dir = cartella contenente DB vettoriale (l'indice viene salvato in persist-dir/quantized_<mode>)
+    - mode = tipo di quantizzazione (int8 o binary)
+    - sessions = file jsonl da cui estrarre le finestre usate come query per misurare la recall@k
+    - context-len = numero di comandi di ogni finestra di query
+    - n = numero di query per la misura della recall
+    - k = numero di vicini restituiti
+    - rerank-factor = candidati del passaggio quantizzato per ogni vicino restituito
+    - rebuild = ricostruisce l'indice anche se già presente
+    - report = file json dove salvare il report (opzionale)
+"""
+
+# -------------------------
+# IMPORT SECTION -> imports necessary for the Python script
+# -------------------------
+
+# numpy e tqdm sono importati nei metodi che li usano: retrieval_bench.py, hnsw_sweep.py e core_rag.py importano il modulo
+# anche solo per le funzioni di utilità (--help, dimensioni su disco) senza pagarne l'import
+from __future__ import annotations
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, List
+
+# -------------------------
+# CLASS SECTION
+# -------------------------
+
+MODES = ("int8", "binary")
+INDEX_VERSION = 3                                                               # 2 = vettori float16 per il re-rank, 3 = metadati completi (store autonomo, senza Chroma)
+SCAN_CHUNK = 65536                                                              # righe di codici analizzate per ogni blocco della ricerca
+EXTRA_VECTORS = "extra_vectors.f16"                                             # vettori aggiunti dopo la costruzione (float16 in coda, ricerca esatta)
+
+class QuantizedIndex:
+    def __init__(self, index_dir: str, emb_fn):
+        import numpy as np
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as file:
+            self.meta = json.load(file)
+        self.mode = self.meta["mode"]
+        self.emb_fn = emb_fn
+        if self.meta.get("version", 1) < INDEX_VERSION:
+            raise ValueError(f"Indice quantizzato {index_dir} costruito con una versione precedente: ricostruirlo con prompting/quantized_index.py --rebuild")
+        # Metadati della collection di origine (layout multi-lunghezza, max_context_len, collapsed) -> stessi campi di collection.metadata
+        self.metadata = self.meta.get("collection_metadata", {})
+        # Codici e vettori restano su disco (memory-map): in memoria vengono portati solo i blocchi analizzati e le righe dei candidati
+        self.codes = np.load(os.path.join(index_dir, "codes.npy"), mmap_mode="r")
+        self.vectors = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode="r")
+        self.scale = np.load(os.path.join(index_dir, "scale.npy")) if self.mode == "int8" else None
+        # Lunghezza di ogni finestra (0 per i DB legacy senza metadato window_len)
+        window_len_path = os.path.join(index_dir, "window_len.npy")
+        self.window_lens = np.load(window_len_path) if os.path.exists(window_len_path) else np.zeros(len(self.codes), dtype=np.uint8)
+        self.items = sqlite3.connect(os.path.join(index_dir, "items.sqlite3"), check_same_thread=False)
+        self.lock = threading.Lock()
+
+        # Vettori aggiunti dopo la costruzione (es. indicizzazione online del defender): pochi rispetto al DB, cercati in modo esatto
+        self.extra_path = os.path.join(index_dir, EXTRA_VECTORS)
+        self.base_count = len(self.codes)
+        self.extra_vectors = np.zeros((0, self.meta["dim"]), dtype=np.float32)
+        self.extra_window_lens = np.zeros(0, dtype=np.uint8)
+        if os.path.exists(self.extra_path):
+            self._load_extra()
+
+    def _load_extra(self):
+        import numpy as np
+        # Una scrittura interrotta può lasciare un vettore parziale in coda o righe senza vettore -> si tengono solo le aggiunte complete
+        row_bytes = self.meta["dim"] * 2
+        size = os.path.getsize(self.extra_path)
+        n_items = self.items.execute("SELECT COUNT(*) FROM items WHERE row >= ?", (self.base_count,)).fetchone()[0]
+        n = min(size // row_bytes, n_items)
+        if size != n * row_bytes:
+            os.truncate(self.extra_path, n * row_bytes)
+        if n_items > n:
+            self.items.execute("DELETE FROM items WHERE row >= ?", (self.base_count + n,))
+            self.items.commit()
+        self.extra_vectors = np.fromfile(self.extra_path, dtype=np.float16).reshape(n, self.meta["dim"]).astype(np.float32)
+        metas = [json.loads(m) for (m,) in self.items.execute("SELECT metadata FROM items WHERE row >= ? ORDER BY row", (self.base_count,))]
+        self.extra_window_lens = np.array([meta.get("window_len", 0) for meta in metas], dtype=np.uint8)
+
+    @staticmethod
+    def build(collection, out_dir: str, mode: str, page_size: int = 50000) -> str:
+        import numpy as np
+        from tqdm import tqdm
+        if mode not in MODES:
+            raise ValueError(f"Modalità di quantizzazione non supportata: {mode}")
+        os.makedirs(out_dir, exist_ok=True)
+        total = collection.count()
+        if total == 0:
+            raise ValueError("La collection è vuota: niente da quantizzare")
+
+        for name in ("items.sqlite3", EXTRA_VECTORS):
+            if os.path.exists(os.path.join(out_dir, name)):
+                os.remove(os.path.join(out_dir, name))
+        items = sqlite3.connect(os.path.join(out_dir, "items.sqlite3"))
+        items.execute("CREATE TABLE items (row INTEGER PRIMARY KEY, id TEXT UNIQUE, document TEXT, metadata TEXT)")
+
+        # Primo passaggio -> vettori float16 (re-rank), documenti e massimo assoluto di ogni dimensione su tutte le pagine
+        vectors, abs_max = None, None
+        window_lens = np.zeros(total, dtype=np.uint8)
+        for offset in tqdm(range(0, total, page_size), desc="Lettura vettori", unit="page"):
+            page = collection.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+            emb = np.asarray(page["embeddings"], dtype=np.float32)
+            if vectors is None:
+                dim = emb.shape[1]
+                vectors = np.lib.format.open_memmap(os.path.join(out_dir, "vectors.npy"), mode="w+", dtype=np.float16, shape=(total, dim))
+                abs_max = np.zeros(dim, dtype=np.float32)
+            end = offset + len(emb)
+            vectors[offset:end] = emb
+            abs_max = np.maximum(abs_max, np.abs(emb).max(axis=0))
+            window_lens[offset:end] = [meta.get("window_len", 0) for meta in page["metadatas"]]
+            items.executemany(
+                "INSERT INTO items VALUES (?, ?, ?, ?)",
+                [(offset + i, page["ids"][i], page["documents"][i], json.dumps(meta)) for i, meta in enumerate(page["metadatas"])]
+            )
+        vectors.flush()
+
+        # Secondo passaggio -> codici quantizzati dai vettori salvati (la scala int8 copre tutti i vettori, nessuna saturazione)
+        scale = None
+        if mode == "int8":
+            scale = 127.0 / np.maximum(abs_max, 1e-6)
+            np.save(os.path.join(out_dir, "scale.npy"), scale.astype(np.float32))
+            codes = np.lib.format.open_memmap(os.path.join(out_dir, "codes.npy"), mode="w+", dtype=np.int8, shape=(total, dim))
+        else:
+            codes = np.lib.format.open_memmap(os.path.join(out_dir, "codes.npy"), mode="w+", dtype=np.uint8, shape=(total, (dim + 7) // 8))
+        for start in tqdm(range(0, total, SCAN_CHUNK), desc=f"Quantizzazione {mode}", unit="block"):
+            codes[start:start + SCAN_CHUNK] = quantize(np.asarray(vectors[start:start + SCAN_CHUNK], dtype=np.float32), mode, scale)
+        codes.flush()
+        np.save(os.path.join(out_dir, "window_len.npy"), window_lens)
+        items.commit()
+        items.close()
+
+        with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as file:
+            json.dump({"mode": mode, "count": total, "dim": dim, "version": INDEX_VERSION, "vectors": "float16",
+                       "collection_metadata": dict(collection.metadata or {}), "created": int(time.time())}, file, indent=2)
+        return out_dir
+
+    # Stessa interfaccia (ridotta) della collection Chroma usata dalla retrieve -> lo store può sostituire la collection
+    def count(self) -> int:
+        return self.base_count + len(self.extra_vectors)
+
+    def get(self, ids: List[str] = None, include: List[str] = ("documents", "metadatas"), limit: int = None, offset: int = 0) -> Dict[str, Any]:
+        with self.lock:
+            if ids is not None:
+                placeholders = ",".join("?" * len(ids))
+                found = self.items.execute(f"SELECT row, id, document, metadata FROM items WHERE id IN ({placeholders})", list(ids)).fetchall()
+            else:
+                found = self.items.execute("SELECT row, id, document, metadata FROM items ORDER BY row LIMIT ? OFFSET ?",
+                                           (limit if limit is not None else -1, offset)).fetchall()
+        result = {"ids": [row[1] for row in found]}
+        if "documents" in include:
+            result["documents"] = [row[2] for row in found]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(row[3]) for row in found]
+        if "embeddings" in include:
+            result["embeddings"] = [self._vector(row[0]) for row in found]
+        return result
+
+    def add(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]], embeddings=None):
+        import numpy as np
+        # Come collection.add: senza embeddings i vettori vengono calcolati con il modello di embedding dello store
+        with self.lock:
+            placeholders = ",".join("?" * len(ids))
+            existing = {row[0] for row in self.items.execute(f"SELECT id FROM items WHERE id IN ({placeholders})", list(ids))}
+        keep = [i for i, vector_id in enumerate(ids) if vector_id not in existing]
+        if not keep:
+            return
+        ids, documents, metadatas = [ids[i] for i in keep], [documents[i] for i in keep], [metadatas[i] for i in keep]
+        emb = np.asarray(self.emb_fn(documents) if embeddings is None else [embeddings[i] for i in keep], dtype=np.float32)
+        with self.lock:
+            start = self.count()
+            with open(self.extra_path, "ab") as file:
+                file.write(emb.astype(np.float16).tobytes())
+            self.items.executemany("INSERT INTO items VALUES (?, ?, ?, ?)",
+                                   [(start + i, ids[i], documents[i], json.dumps(meta)) for i, meta in enumerate(metadatas)])
+            self.items.commit()
+            self.extra_vectors = np.concatenate([self.extra_vectors, emb.astype(np.float16).astype(np.float32)])
+            self.extra_window_lens = np.concatenate([self.extra_window_lens, np.array([m.get("window_len", 0) for m in metadatas], dtype=np.uint8)])
+
+    def _vector(self, row: int) -> List[float]:
+        import numpy as np
+        if row < self.base_count:
+            return np.asarray(self.vectors[row], dtype=np.float32).tolist()
+        return self.extra_vectors[row - self.base_count].tolist()
+
+    # Passaggio veloce sui codici quantizzati -> restituisce per ogni query le righe dei migliori n_candidates
+    def _candidates(self, queries: np.ndarray, n_candidates: int, window_len: int = None) -> np.ndarray:
+        import numpy as np
+        n_candidates = min(n_candidates, len(self.codes) if window_len is None else int((self.window_lens == window_len).sum()))
+        if n_candidates == 0:
+            return np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        query_codes = quantize(queries, self.mode, None) if self.mode == "binary" else queries
+        popcount = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)   # bit a 1 per ogni valore di un byte
+
+        for start in range(0, len(self.codes), SCAN_CHUNK):
+            block = np.asarray(self.codes[start:start + SCAN_CHUNK])
+            if self.mode == "int8":
+                # Distanza L2 con i vettori de-quantizzati, a meno del termine |q|^2 costante per ogni query (punteggio più alto = più simile)
+                dequant = block.astype(np.float32) / self.scale
+                scores = 2 * queries @ dequant.T - (dequant ** 2).sum(axis=1)
+            else:
+                # Distanza di Hamming tra i bit di segno (punteggio = -distanza), calcolata a gruppi di query per limitare la memoria
+                scores = np.empty((len(queries), len(block)), dtype=np.float32)
+                for q in range(0, len(queries), 8):
+                    xor = np.bitwise_xor(query_codes[q:q + 8, None, :], block[None, :, :])
+                    scores[q:q + 8] = -popcount[xor].sum(axis=2, dtype=np.int32)
+            if window_len is not None:
+                scores[:, self.window_lens[start:start + len(block)] != window_len] = -np.inf
+            rows = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_rows = np.concatenate([best_rows, rows], axis=1)
+            if best_scores.shape[1] > n_candidates:
+                keep = np.argpartition(-best_scores, n_candidates - 1, axis=1)[:, :n_candidates]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_rows, order, axis=1)
+
+    def _items(self, rows: List[int]) -> Dict[int, tuple]:
+        placeholders = ",".join("?" * len(rows))
+        with self.lock:
+            cursor = self.items.execute(f"SELECT row, id, document, metadata FROM items WHERE row IN ({placeholders})", rows)
+            return {row[0]: (row[1], row[2], json.loads(row[3])) for row in cursor}
+
+    def search(self, query_embeddings, k: int, rerank_factor: int = 10, rerank: bool = True, window_len: int = None) -> List[List[Dict[str, Any]]]:
+        import numpy as np
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        candidate_rows = self._candidates(queries, k * rerank_factor if rerank else k, window_len)
+        with self.lock:
+            extra_vectors, extra_window_lens = self.extra_vectors, self.extra_window_lens
+        # Vettori aggiunti dopo la costruzione -> tutti candidati (con il filtro window_len), distanza esatta nel re-rank
+        extra_rows = [self.base_count + i for i in range(len(extra_vectors)) if window_len is None or extra_window_lens[i] == window_len] if rerank else []
+        if candidate_rows.shape[1] == 0 and not extra_rows:
+            return [[] for _ in queries]
+        items = self._items(sorted({int(r) for r in candidate_rows.ravel()} | set(extra_rows)))
+
+        results = []
+        for q, rows in zip(queries, candidate_rows):
+            rows = [int(r) for r in rows]
+            if rerank:
+                # Re-rank: distanza L2 al quadrato dalla query sui vettori float16 salvati (solo le righe dei candidati lette dal disco)
+                cand_emb = np.asarray(self.vectors[rows], dtype=np.float32).reshape(len(rows), -1)
+                if extra_rows:
+                    cand_emb = np.concatenate([cand_emb, extra_vectors[[r - self.base_count for r in extra_rows]]])
+                    rows = rows + extra_rows
+                dists = ((cand_emb - q) ** 2).sum(axis=1)
+                order = np.argsort(dists)[:k]
+                chosen = [(rows[i], float(dists[i])) for i in order]
+            else:
+                chosen = [(r, float("nan")) for r in rows[:k]]
+            results.append([
+                {"id": items[r][0], "context": items[r][1], "next_command": items[r][2]["next_command"], "distance": d,
+                 "session_id": items[r][2].get("session_id", "unknown"), "metadata": items[r][2]}
+                for r, d in chosen
+            ])
+        return results
+
+# -------------------------
+# FUNCTION SECTION
+# -------------------------
+
+def find_store(persist_dir: str, mode: str = None) -> str:
+    # Store quantizzato della cartella del DB: quello della modalità richiesta oppure, con mode None, il primo presente
+    for candidate in ([mode] if mode else MODES):
+        index_dir = os.path.join(persist_dir, f"quantized_{candidate}")
+        if os.path.exists(os.path.join(index_dir, "meta.json")):
+            return index_dir
+    return None
+
+def store_disk_bytes(persist_dir: str, quantized: str = None) -> int:
+    # Spazio su disco effettivo della configurazione: Chroma (senza gli store quantizzati) oppure il solo store quantizzato
+    # con gli indici che la retrieve usa accanto (indice esatto / lessicale e hash dei vettori indicizzati)
+    if quantized:
+        sidecars = [os.path.join(persist_dir, name) for name in ("rag_index.sqlite3", "DB_seen_ids.bin")]
+        return dir_size(os.path.join(persist_dir, f"quantized_{quantized}")) + sum(os.path.getsize(path) for path in sidecars if os.path.exists(path))
+    return dir_size(persist_dir) - sum(dir_size(os.path.join(persist_dir, f"quantized_{m}")) for m in MODES)
+
+def quantize(emb: np.ndarray, mode: str, scale) -> np.ndarray:
+    import numpy as np
+    if mode == "int8":
+        return np.clip(np.rint(emb * scale), -127, 127).astype(np.int8)
+    return np.packbits(emb > 0, axis=1)
+
+def dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def sample_query_windows(sessions_path: str, context_len: int, n: int, seed: int = 0) -> List[List[str]]:
+    # Finestre di context_len comandi estratte in modo casuale (ma riproducibile) dalle sessioni
+    rng = random.Random(seed)
+    windows = []
+    with open(sessions_path, "r", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip(): continue
+            cmds = json.loads(line).get("commands", [])
+            if len(cmds) > context_len:
+                start = rng.randint(0, len(cmds) - 1 - context_len)
+                windows.append(cmds[start:start + context_len])
+    return rng.sample(windows, min(n, len(windows)))
+
+def report(args) -> Dict[str, Any]:
+    # Import locale -> core_rag carica chromadb e il modello di embedding
+    import core_rag
+
+    rag = core_rag.VectorContextRetriever(persist_dir=args.persist_dir)
+    window_len = min(args.context_len, rag.max_context_len) if rag.multi_len else None
+    index_dir = os.path.join(args.persist_dir, f"quantized_{args.mode}")
+    if args.rebuild or not os.path.exists(os.path.join(index_dir, "meta.json")):
+        started = time.time()
+        QuantizedIndex.build(rag.collection, index_dir, args.mode)
+        print(f"[QUANT] Indice {args.mode} costruito in {time.time() - started:.1f}s")
+    index = QuantizedIndex(index_dir, rag.emb_fn)
+
+    # Spazio occupato: disco effettivo delle due configurazioni (collection Chroma oppure store quantizzato autonomo con
+    # codici, vettori float16, documenti e indici accanto) e memoria dei soli vettori
+    chroma_bytes = store_disk_bytes(args.persist_dir)
+    quant_bytes = store_disk_bytes(args.persist_dir, args.mode)
+    float_vectors_bytes = index.meta["count"] * index.meta["dim"] * 4
+    code_bytes = index.codes.nbytes
+    rerank_bytes = index.vectors.nbytes
+
+    # Recall@k: sovrapposizione tra i k vicini della collection Chroma e quelli dell'indice quantizzato
+    windows = sample_query_windows(args.sessions, args.context_len, args.n)
+    if not windows:
+        sys.exit("Nessuna finestra di query trovata: controlla --sessions e --context-len")
+    query_texts = [" || ".join(w) for w in windows]
+    query_emb = rag.emb_fn(query_texts)
+    truth = rag.collection.query(query_embeddings=query_emb, n_results=args.k, where={"window_len": window_len} if window_len else None, include=[])["ids"]
+
+    recalls = {}
+    latencies = {}
+    for label, rerank in (("quantized", False), ("quantized+rerank", True)):
+        started = time.time()
+        found = index.search(query_emb, args.k, rerank_factor=args.rerank_factor, rerank=rerank, window_len=window_len)
+        latencies[label] = (time.time() - started) / len(windows) * 1000
+        hits = sum(len(set(t) & {ex["id"] for ex in f}) for t, f in zip(truth, found))
+        recalls[label] = hits / max(sum(len(t) for t in truth), 1)
+
+    result = {
+        "mode": args.mode,
+        "vectors": index.meta["count"],
+        "dim": index.meta["dim"],
+        "disk_bytes": {"chroma": chroma_bytes, "quantized_store": quant_bytes},
+        "vector_memory_bytes": {"float32": float_vectors_bytes, "quantized": code_bytes, "saved": float_vectors_bytes - code_bytes, "float16_rerank_on_disk": rerank_bytes},
+        "queries": len(windows),
+        "k": args.k,
+        "rerank_factor": args.rerank_factor,
+        "recall_at_k_vs_chroma": recalls,
+        "recall_at_k_lost": {label: 1.0 - r for label, r in recalls.items()},
+        "avg_query_ms": latencies,
+    }
+
+    print("\n=== QUANTIZED INDEX REPORT ===")
+    print(f"Mode: {args.mode} | Vettori: {result['vectors']} x {result['dim']}")
+    print(f"Disco: Chroma {chroma_bytes / 2**20:.1f} MB | store quantizzato autonomo {quant_bytes / 2**20:.1f} MB (codici, vettori float16, documenti e indici)")
+    print(f"Memoria vettori: float32 {float_vectors_bytes / 2**20:.1f} MB -> codici {code_bytes / 2**20:.1f} MB (+ {rerank_bytes / 2**20:.1f} MB float16 su disco, letti solo per i candidati)")
+    for label, r in recalls.items():
+        print(f"Recall@{args.k} vs Chroma ({label}): {r:.2%} (persa {1 - r:.2%}) | {latencies[label]:.2f} ms/query")
+
+    if args.report:
+        os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+        with open(args.report, "w", encoding="utf-8") as file:
+            json.dump(result, file, indent=2)
+        print(f"Report salvato in: {args.report}")
+    return result
+
+# -------------------------
+# MAIN SECTION
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Costruzione indice quantizzato del DB vettoriale e report spazio/recall")
+    parser.add_argument("--persist-dir", required=True, help="Cartella contenente DB vettoriale")
+    parser.add_argument("--mode", choices=MODES, default="int8", help="Tipo di quantizzazione")
+    parser.add_argument("--sessions", required=True, help="File jsonl da cui estrarre le finestre di query")
+    parser.add_argument("--context-len", type=int, default=5, help="Numero di comandi di ogni finestra di query")
+    parser.add_argument("--n", type=int, default=500, help="Numero di query per la misura della recall")
+    parser.add_argument("--k", type=int, default=3, help="Numero di vicini restituiti")
+    parser.add_argument("--rerank-factor", type=int, default=10, help="Candidati del passaggio quantizzato per ogni vicino restituito")
+    parser.add_argument("--rebuild", action="store_true", help="Ricostruisce l'indice anche se già presente")
+    parser.add_argument("--report", default=None, help="File json dove salvare il report")
+    args = parser.parse_args()
+    report(args)
+
+if __name__ == "__main__":
+    main()
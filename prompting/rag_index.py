@@ -0,0 +1,341 @@
+# -------------------------
+# INTRODUCTION -> some utils informations about the Python script
+# -------------------------
+
+"""
+Il file contiene gli indici "laterali" del DB vettoriale, salvati in un file sqlite accanto al DB Chroma
+(persist_dir/rag_index.sqlite3). È utilizzato da core_rag.py (indicizzazione e retrieve) e dal defender
+(copiato nella VM dal role Ansible defender). All'interno del file sono presenti i seguenti elementi:
+
+- Classe ExactWindowIndex:
+    Indice esatto delle finestre di contesto. Molti contesti live coincidono esattamente con un context_str già
+    indicizzato (i bot ripetono gli stessi script): per questi non serve calcolare l'embedding né interrogare il DB
+    vettoriale. L'indice associa l'hash a 64 bit della finestra alla tabella delle frequenze dei comandi successivi
+    (contate su tutte le occorrenze del file di indicizzazione, duplicati compresi). La classe presenta le funzioni:
+
+    - __init__(self, persist_dir: str) -> apertura (o creazione) del file sqlite
+    - exists(persist_dir: str) -> verifica la presenza dell'indice nella cartella del DB
+    - clear(self) -> svuota l'indice (nuova indicizzazione da zero)
+    - add_counts(self, counts: Dict[Tuple[int, str], int]) -> incremento delle frequenze (context_hash, next_command)
+    - lookup(self, context_str: str, k: int) -> restituisce i k comandi successivi più frequenti per la finestra, con il loro conteggio
+
+- Classe CollapsedWindowIndex:
+    Aggregazione delle finestre quasi-duplicate per l'indicizzazione "collapsed" (core_rag.index_file su una collection creata
+    con collapse=True). Le finestre che differiscono solo per placeholder, argomenti o spazi hanno la stessa forma canonica
+    (canonical_window, basata su utils.normalize_for_compare): per ogni cluster si salvano un rappresentante (la prima finestra
+    osservata), il numero di occorrenze e l'istogramma dei comandi successivi. Le tabelle sono nello stesso file sqlite
+    dell'indice esatto, così le frequenze dei due indici e lo stato di avanzamento sono scritti nella stessa transazione.
+    La classe presenta le funzioni:
+
+    - __init__(self, persist_dir: str) -> apertura (o creazione) delle tabelle dei cluster
+    - clear(self) -> svuota cluster, istogrammi, indice esatto e stato (nuova indicizzazione da zero)
+    - get_state(self, key: str, default: str = None) / add_batch(...) -> stato di avanzamento e aggiunta atomica di un batch di frequenze
+    - iter_clusters(self, after_hash: int, page_size: int) -> cluster in ordine di hash successivi ad after_hash (None = dall'inizio) (per riprendere la scrittura nel DB vettoriale)
+    - histograms(self, canon_hashes: List[int], top: int) -> istogramma dei comandi successivi di ogni cluster
+    - stats(self) -> numero di cluster e di occorrenze
+
+- Classe LexicalIndex:
+    Indice invertito (sqlite FTS5, ranking BM25) sui token dei comandi delle finestre indicizzate: nomi dei binari e path
+    restano token interi (tokenchars "/._-<>"). Serve per la generazione economica dei candidati nella retrieve lessicale e
+    ibrida di core_rag (nessun embedding per la modalità lessicale). Per limitare il costo delle query c'è una tabella FTS5
+    per ogni window_len (lexical_w<n>, lexical_w0 per i DB legacy). La classe presenta le funzioni:
+
+    - __init__(self, persist_dir: str) -> apertura del file sqlite
+    - clear(self) -> elimina tutte le tabelle lessicali
+    - count(self) -> numero di finestre indicizzate
+    - add(self, rows: List[Tuple[str, str, int]]) -> indicizzazione di (vector_id, documento, window_len), idempotente sul vector_id
+    - search(self, context_str: str, window_len: int, n: int) -> n finestre con punteggio BM25 migliore (vector_id, punteggio)
+    - build_from_collection(self, collection, page_size: int = 50000) -> costruzione dell'indice da una collection già esistente
+
+- DISTANCE_EPS = epsilon sulla distanza dei pesi 1 / (distanza + eps), condiviso con il voto kNN (knn_predictor.py)
+- Funzioni:
+    - context_hash(context_str: str) -> hash a 64 bit (con segno, come gli INTEGER sqlite) di una finestra di contesto
+    - canonical_window(window: List[str]) -> forma canonica di una finestra (nome comando + primo path di ogni segmento della pipeline)
+    - vector_hash(vector_id: str) / load_hashes(path: str) / append_hashes(path: str, hashes) -> set compatto di hash a 64 bit degli id
+      dei vettori indicizzati (DB_seen_ids.bin), scritto da core_rag.index_file e dall'indicizzazione online del defender
+    - rank_collapsed(examples: List[Dict[str, Any]], metas: List[Dict[str, Any]], k: int) -> k cluster di un DB collapsed ordinati per
+      similarità pesata con le occorrenze (la retrieve ne recupera k * COLLAPSED_OVERFETCH), usata da core_rag.py e dal defender
+"""
+
+# -------------------------
+# IMPORT SECTION -> imports necessary for the Python script
+# -------------------------
+
+import hashlib
+import json
+from array import array
+import math
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, Iterator, List, Tuple
+import utils
+
+# -------------------------
+# FUNCTION SECTION
+# -------------------------
+
+INDEX_FILENAME = "rag_index.sqlite3"
+
+def context_hash(context_str: str) -> int:
+    return int.from_bytes(hashlib.sha1(context_str.encode()).digest()[:8], "big", signed=True)
+
+def canonical_window(window: List[str]) -> str:
+    # Ogni comando diventa "nome path" per ogni segmento della pipeline -> spariscono placeholder, argomenti, redirezioni e spazi
+    return " || ".join(
+        " | ".join(f"{name} {path}".strip() for name, path in utils.normalize_for_compare(cmd))
+        for cmd in window
+    )
+
+# Hash a 64 bit dell'id SHA1 di un vettore (primi 16 caratteri esadecimali)
+def vector_hash(vector_id: str) -> int:
+    return int(vector_id[:16], 16)
+
+# Byte finali di una scrittura interrotta a metà di un hash (es. processo terminato durante append_hashes) -> scartati anche dal file,
+# così le aggiunte successive restano allineate a 8 byte
+def _trim_partial_hash(path: str, size: int) -> int:
+    tail = size % 8
+    if tail:
+        print(f"[RAG] {path}: scartati {tail} byte di un hash scritto a metà")
+        os.truncate(path, size - tail)
+    return size - tail
+
+# Lettura del file binario degli hash (interi a 64 bit senza segno, 8 byte ciascuno)
+def load_hashes(path: str) -> set:
+    hashes = array("Q")
+    with open(path, "rb") as file:
+        data = file.read()
+    hashes.frombytes(data[:_trim_partial_hash(path, len(data))])
+    return set(hashes)
+
+# Aggiunta in coda al file binario degli hash
+def append_hashes(path: str, hashes) -> None:
+    if os.path.exists(path):
+        _trim_partial_hash(path, os.path.getsize(path))
+    with open(path, "ab") as file:
+        array("Q", hashes).tofile(file)
+
+DISTANCE_EPS = 1e-3         # evita la divisione per zero sulle finestre identiche (distance = 0, percorso veloce dell'indice esatto)
+COLLAPSED_OVERFETCH = 3     # vicini recuperati per ogni esempio restituito da un DB collapsed (prima del ranking per frequenza)
+
+# Ranking dei cluster di un DB collapsed: similarità pesata con il logaritmo delle occorrenze -> i pattern frequenti salgono in cima
+def rank_collapsed(examples: List[Dict[str, Any]], metas: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+    for ex, meta in zip(examples, metas):
+        ex["count"] = meta.get("count", 1)
+        ex["next_hist"] = json.loads(meta.get("next_hist", "{}"))
+    examples.sort(key=lambda ex: (1 + math.log(ex["count"])) / (ex["distance"] + DISTANCE_EPS), reverse=True)
+    return examples[:k]
+
+EXACT_TABLE_SQL = (
+    "CREATE TABLE IF NOT EXISTS exact_windows ("
+    "context_hash INTEGER NOT NULL, next_command TEXT NOT NULL, count INTEGER NOT NULL, "
+    "PRIMARY KEY (context_hash, next_command)) WITHOUT ROWID"
+)
+EXACT_UPSERT_SQL = (
+    "INSERT INTO exact_windows (context_hash, next_command, count) VALUES (?, ?, ?) "
+    "ON CONFLICT (context_hash, next_command) DO UPDATE SET count = count + excluded.count"
+)
+
+# -------------------------
+# CLASS SECTION
+# -------------------------
+
+class ExactWindowIndex:
+    def __init__(self, persist_dir: str):
+        os.makedirs(persist_dir, exist_ok=True)
+        self.path = os.path.join(persist_dir, INDEX_FILENAME)
+        # La connessione è condivisa tra il thread di retrieve e il writer dell'indicizzazione -> accesso serializzato dal lock
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute(EXACT_TABLE_SQL)
+
+    @staticmethod
+    def exists(persist_dir: str) -> bool:
+        return os.path.exists(os.path.join(persist_dir, INDEX_FILENAME))
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM exact_windows")
+
+    def add_counts(self, counts: Dict[Tuple[int, str], int]):
+        if not counts:
+            return
+        with self.lock, self.conn:
+            self.conn.executemany(EXACT_UPSERT_SQL, [(h, cmd, n) for (h, cmd), n in counts.items()])
+
+    def lookup(self, context_str: str, k: int) -> List[Tuple[str, int]]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT next_command, count FROM exact_windows WHERE context_hash = ? "
+                "ORDER BY count DESC, next_command LIMIT ?",
+                (context_hash(context_str), k)
+            ).fetchall()
+        return [(cmd, count) for cmd, count in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class CollapsedWindowIndex:
+    def __init__(self, persist_dir: str):
+        os.makedirs(persist_dir, exist_ok=True)
+        self.path = os.path.join(persist_dir, INDEX_FILENAME)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute(EXACT_TABLE_SQL)
+            # canon_hash INTEGER PRIMARY KEY -> alias del rowid, la scansione in ordine di hash è quindi sequenziale
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS collapsed_windows ("
+                "canon_hash INTEGER PRIMARY KEY, window_len INTEGER NOT NULL, representative TEXT NOT NULL, count INTEGER NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS collapsed_next ("
+                "canon_hash INTEGER NOT NULL, next_command TEXT NOT NULL, count INTEGER NOT NULL, "
+                "PRIMARY KEY (canon_hash, next_command)) WITHOUT ROWID"
+            )
+            self.conn.execute("CREATE TABLE IF NOT EXISTS collapsed_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def clear(self):
+        with self.lock, self.conn:
+            for table in ("exact_windows", "collapsed_windows", "collapsed_next", "collapsed_state"):
+                self.conn.execute(f"DELETE FROM {table}")
+
+    def get_state(self, key: str, default: str = None) -> str:
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM collapsed_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_state(self, key: str, value: str):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO collapsed_state (key, value) VALUES (?, ?)", (key, value))
+
+    def add_batch(self, windows: Dict[int, Tuple[int, str, int]], next_counts: Dict[Tuple[int, str], int],
+                  exact_counts: Dict[Tuple[int, str], int], state: Dict[str, str]):
+        # windows: canon_hash -> (window_len, rappresentante, occorrenze). Il rappresentante resta quello del primo inserimento
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO collapsed_windows (canon_hash, window_len, representative, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (canon_hash) DO UPDATE SET count = count + excluded.count",
+                [(h, window_len, rep, n) for h, (window_len, rep, n) in windows.items()]
+            )
+            self.conn.executemany(
+                "INSERT INTO collapsed_next (canon_hash, next_command, count) VALUES (?, ?, ?) "
+                "ON CONFLICT (canon_hash, next_command) DO UPDATE SET count = count + excluded.count",
+                [(h, cmd, n) for (h, cmd), n in next_counts.items()]
+            )
+            self.conn.executemany(EXACT_UPSERT_SQL, [(h, cmd, n) for (h, cmd), n in exact_counts.items()])
+            self.conn.executemany("INSERT OR REPLACE INTO collapsed_state (key, value) VALUES (?, ?)", list(state.items()))
+
+    def iter_clusters(self, after_hash: int, page_size: int) -> Iterator[List[Tuple[int, int, str, int]]]:
+        # after_hash = None -> scansione dall'inizio
+        while True:
+            where, params = ("WHERE canon_hash > ? ", (after_hash, page_size)) if after_hash is not None else ("", (page_size,))
+            with self.lock:
+                page = self.conn.execute(
+                    "SELECT canon_hash, window_len, representative, count FROM collapsed_windows "
+                    f"{where}ORDER BY canon_hash LIMIT ?",
+                    params
+                ).fetchall()
+            if not page:
+                return
+            yield page
+            after_hash = page[-1][0]
+
+    def histograms(self, canon_hashes: List[int], top: int) -> Dict[int, List[Tuple[str, int]]]:
+        result = {h: [] for h in canon_hashes}
+        with self.lock:
+            for start in range(0, len(canon_hashes), 500):
+                chunk = canon_hashes[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT canon_hash, next_command, count FROM collapsed_next WHERE canon_hash IN ({placeholders}) "
+                    "ORDER BY canon_hash, count DESC, next_command", chunk
+                ).fetchall()
+                for h, cmd, n in rows:
+                    if len(result[h]) < top:
+                        result[h].append((cmd, n))
+        return result
+
+    def stats(self) -> Tuple[int, int]:
+        with self.lock:
+            clusters, occurrences = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(count), 0) FROM collapsed_windows").fetchone()
+        return clusters, occurrences
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+LEXICAL_TOKEN_RE = re.compile(r"[\w/.\-<>]+")     # stessi caratteri dei token del tokenizer FTS5 (tokenchars)
+LEXICAL_MAX_TOKENS = 64                           # token distinti usati per ogni query
+
+class LexicalIndex:
+    def __init__(self, persist_dir: str):
+        os.makedirs(persist_dir, exist_ok=True)
+        self.path = os.path.join(persist_dir, INDEX_FILENAME)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.tables = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'lexical_w[0-9]*'")
+                           if row[0][len("lexical_w"):].isdigit()}
+
+    def _table(self, window_len: int) -> str:
+        # Chiamata con il lock acquisito
+        name = f"lexical_w{int(window_len)}"
+        if name not in self.tables:
+            self.conn.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5("
+                "content, vector_id UNINDEXED, tokenize = \"unicode61 tokenchars '/._-<>'\")"
+            )
+            self.tables.add(name)
+        return name
+
+    def clear(self):
+        with self.lock, self.conn:
+            for name in self.tables:
+                self.conn.execute(f"DROP TABLE IF EXISTS {name}")
+            self.tables = set()
+
+    def count(self) -> int:
+        with self.lock:
+            return sum(self.conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0] for name in self.tables)
+
+    def add(self, rows: List[Tuple[str, str, int]]):
+        if not rows:
+            return
+        # rowid = primi 8 byte dell'id SHA1 del vettore -> INSERT OR REPLACE rende l'aggiunta idempotente (riprese, upsert)
+        by_table: Dict[int, list] = {}
+        for vector_id, document, window_len in rows:
+            by_table.setdefault(window_len or 0, []).append((int.from_bytes(bytes.fromhex(vector_id[:16]), "big", signed=True), document, vector_id))
+        with self.lock, self.conn:
+            for window_len, values in by_table.items():
+                self.conn.executemany(f"INSERT OR REPLACE INTO {self._table(window_len)} (rowid, content, vector_id) VALUES (?, ?, ?)", values)
+
+    def search(self, context_str: str, window_len: int, n: int) -> List[Tuple[str, float]]:
+        name = f"lexical_w{int(window_len or 0)}"
+        tokens = list(dict.fromkeys(LEXICAL_TOKEN_RE.findall(context_str.lower())))[:LEXICAL_MAX_TOKENS]
+        if name not in self.tables or not tokens:
+            return []
+        query = " OR ".join('"' + token.replace('"', '""') + '"' for token in tokens)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT vector_id, bm25({name}) FROM {name} WHERE {name} MATCH ? ORDER BY bm25({name}) LIMIT ?",
+                (query, n)
+            ).fetchall()
+        # bm25() di FTS5 è negativo (più basso = più rilevante) -> punteggio positivo
+        return [(vector_id, -score) for vector_id, score in rows]
+
+    def build_from_collection(self, collection, page_size: int = 50000):
+        offset = 0
+        while True:
+            page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            self.add([(vector_id, doc, (meta or {}).get("window_len", 0)) for vector_id, doc, meta in zip(page["ids"], page["documents"], page["metadatas"])])
+            offset += len(page["ids"])
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+# -------------------------
+# INTRODUCTION -> some utils informations about the Python script
+# -------------------------
+
+"""
+- MODALITÀ:
+    Il file contiene il motore di rivalutazione offline dei file di risultati (*_results_*.jsonl) prodotti dagli script
+    evaluate_* e da sweep.py: le metriche vengono ricalcolate a partire dai candidati già salvati, senza interrogare di
+    nuovo il LLM, per cui è possibile cambiare la regola di confronto tra candidato e comando expected e valutarne
+    l'effetto in pochi secondi. Per ogni file e per ogni politica di confronto vengono calcolate:
+
+        - top-1 e top-k accuracy (k = --k, default tutti i candidati salvati)
+        - MRR (mean reciprocal rank del primo candidato corretto)
+        - per i file RAG: db_hit rate, hit influenzati / non influenzati dal DB e accuracy con e senza db_hit
+
+    La normalizzazione (utils.normalize_for_compare) è memorizzata per ogni comando distinto e l'esito del confronto per
+    ogni coppia (expected, candidato) distinta: nei file di risultati gli stessi comandi si ripetono
+    moltissime volte, per cui il costo è dominato dalla sola lettura del file.
+
+    Elementi presenti:
+
+        - POLICIES = registro delle politiche di confronto (nome -> funzione sui comandi normalizzati)
+        - register_policy(name: str, description: str) -> decoratore per aggiungere una politica al registro
+        - normalize(cmd: str) -> normalizzazione memorizzata per comando distinto
+        - rank_of(policy: str, expected: str, candidates: List[str]) -> posizione (1-based) del primo candidato corretto, 0 se assente
+        - rescore_file(path: str, policies: List[str], k: int = 0, workers: int = 1) -> metriche del file per ogni politica. Il file viene diviso
+            in intervalli di byte (allineati alle righe) valutati in parallelo da workers processi, ognuno con le proprie cache
+
+    Politiche disponibili:
+
+        - legacy = regola storica degli script evaluate_* (utils.score_candidates): stesso numero di segmenti della pipeline e
+            confronto del solo primo segmento (nome comando + path compatibile)
+        - pipeline = stesso numero di segmenti e confronto di tutti i segmenti della pipeline (nome comando + path compatibile)
+        - name = confronto del solo nome del primo comando
+        - exact = stringhe identiche a meno degli spazi
+
+- COMANDO PER ESECUZIONE:
+
+    python3 prompting/rescore.py output/rag/ollama/*.jsonl --policy legacy pipeline name --k 5
+
+    dove le varie flag sono:
+    - files = file di risultati da rivalutare (i file <output>.tasks.jsonl vengono ignorati)
+    - policy = politiche di confronto da applicare (vedi POLICIES)
+    - k = numero di candidati considerati per la top-k (0 = tutti i candidati salvati)
+    - workers = processi per la rivalutazione di ogni file (default = numero di CPU)
+    - report = file json in cui salvare le metriche (opzionale)
+"""
+
+# -------------------------
+# IMPORT SECTION -> imports necessary for the Python script
+# -------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Tuple
+import utils
+
+# -------------------------
+# POLICY REGISTRY
+# -------------------------
+
+Normalized = Tuple[Tuple[str, str], ...]
+POLICIES: Dict[str, Dict[str, Any]] = {}
+
+def register_policy(name: str, description: str):
+    def decorator(fn: Callable[[Normalized, Normalized, str, str], bool]):
+        POLICIES[name] = {"description": description, "match": fn}
+        return fn
+    return decorator
+
+def _path_compatible(exp_path: str, cand_path: str) -> bool:
+    return not exp_path or not cand_path or exp_path in cand_path or cand_path in exp_path
+
+@register_policy("legacy", "Regola storica (utils.score_candidates): solo il primo segmento della pipeline")
+def _match_legacy(norm_expected: Normalized, norm_cand: Normalized, expected: str, cand: str) -> bool:
+    if len(norm_cand) != len(norm_expected):
+        return False
+    exp_name, exp_path = norm_expected[0]
+    cand_name, cand_path = norm_cand[0]
+    return exp_name == cand_name and _path_compatible(exp_path, cand_path)
+
+@register_policy("pipeline", "Tutti i segmenti della pipeline (nome comando + path compatibile)")
+def _match_pipeline(norm_expected: Normalized, norm_cand: Normalized, expected: str, cand: str) -> bool:
+    if len(norm_cand) != len(norm_expected):
+        return False
+    return all(e_name == c_name and _path_compatible(e_path, c_path)
+               for (e_name, e_path), (c_name, c_path) in zip(norm_expected, norm_cand))
+
+@register_policy("name", "Solo il nome del primo comando")
+def _match_name(norm_expected: Normalized, norm_cand: Normalized, expected: str, cand: str) -> bool:
+    return bool(norm_cand) and norm_expected[0][0] == norm_cand[0][0]
+
+@register_policy("exact", "Stringhe identiche a meno degli spazi")
+def _match_exact(norm_expected: Normalized, norm_cand: Normalized, expected: str, cand: str) -> bool:
+    return " ".join(expected.split()) == " ".join(cand.split())
+
+# -------------------------
+# FUNCTION SECTION
+# -------------------------
+
+@lru_cache(maxsize=None)
+def normalize(cmd: str) -> Normalized:
+    return tuple(utils.normalize_for_compare(cmd))
+
+@lru_cache(maxsize=None)
+def _pair_match(policy: str, expected: str, cand: str) -> bool:
+    norm_expected = normalize(expected)
+    if not norm_expected:
+        return False
+    return POLICIES[policy]["match"](norm_expected, normalize(cand), expected, cand)
+
+def rank_of(policy: str, expected: str, candidates: List[str]) -> int:
+    for rnk, cand in enumerate(candidates, 1):
+        if _pair_match(policy, expected, cand):
+            return rnk
+    return 0
+
+def _file_chunks(path: str, workers: int) -> List[Tuple[int, int]]:
+    # Divisione del file in intervalli di byte allineati all'inizio di una riga, uno per worker
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as file:
+        for i in range(1, workers):
+            file.seek(max(size * i // workers, bounds[-1]))
+            file.readline()
+            bounds.append(min(file.tell(), size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+def _score_chunk(path: str, start: int, end: int, policies: Tuple[str, ...], k: int) -> Dict[str, Any]:
+    counters = {p: {"top1": 0, "topk": 0, "rr": 0.0, "db_hit_hits": 0, "clean_hits": 0} for p in policies}
+    total = 0
+    db_hit_total = 0
+    has_db_hit = False
+
+    with open(path, "rb") as file:
+        file.seek(start)
+        pos = start
+        for line in file:
+            if pos >= end:
+                break
+            pos += len(line)
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "candidates" not in rec:
+                continue
+            total += 1
+            candidates = rec["candidates"][:k] if k > 0 else rec["candidates"]
+            db_hit = rec.get("db_hit")
+            if db_hit is not None:
+                has_db_hit = True
+                db_hit_total += bool(db_hit)
+
+            expected = rec["expected"]
+            for policy in policies:
+                rank = rank_of(policy, expected, candidates)
+                if not rank:
+                    continue
+                c = counters[policy]
+                c["topk"] += 1
+                c["top1"] += rank == 1
+                c["rr"] += 1 / rank
+                if db_hit:
+                    c["db_hit_hits"] += 1
+                else:
+                    c["clean_hits"] += 1
+
+    return {"total": total, "db_hit_total": db_hit_total, "has_db_hit": has_db_hit, "counters": counters}
+
+def rescore_file(path: str, policies: List[str], k: int = 0, workers: int = 1) -> Dict[str, Any]:
+    policies = tuple(policies)
+    chunks = _file_chunks(path, max(1, workers))
+    if len(chunks) > 1:
+        # Decodifica json e confronto in parallelo su processi distinti (il costo è dominato dalla CPU)
+        with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+            parts = list(pool.map(_score_chunk, [path] * len(chunks), [s for s, _ in chunks], [e for _, e in chunks],
+                                  [policies] * len(chunks), [k] * len(chunks)))
+    else:
+        parts = [_score_chunk(path, start, end, policies, k) for start, end in chunks]
+
+    total = sum(p["total"] for p in parts)
+    db_hit_total = sum(p["db_hit_total"] for p in parts)
+    has_db_hit = any(p["has_db_hit"] for p in parts)
+
+    metrics = {}
+    for policy in policies:
+        c = {key: sum(p["counters"][policy][key] for p in parts) for key in parts[0]["counters"][policy]} if parts else {}
+        m = {
+            "top1": c["top1"] / total if total else 0.0,
+            "topk": c["topk"] / total if total else 0.0,
+            "mrr": c["rr"] / total if total else 0.0,
+        }
+        if has_db_hit:
+            # Split sul db_hit: hit ottenuti quando l'expected era tra i next_command recuperati dal DB e quando non lo era
+            m["hits_with_db_hit"] = c["db_hit_hits"]
+            m["hits_without_db_hit"] = c["clean_hits"]
+            m["topk_given_db_hit"] = c["db_hit_hits"] / db_hit_total if db_hit_total else 0.0
+            m["topk_given_no_db_hit"] = c["clean_hits"] / (total - db_hit_total) if total - db_hit_total else 0.0
+        metrics[policy] = m
+
+    return {"file": path, "records": total, "db_hit_rate": db_hit_total / total if has_db_hit and total else None, "policies": metrics}
+
+# -------------------------
+# MAIN SECTION
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Rivalutazione offline dei file di risultati con politiche di confronto diverse")
+    parser.add_argument("files", nargs="+", help="File di risultati (*_results_*.jsonl)")
+    parser.add_argument("--policy", nargs="+", default=["legacy"], help=f"Politiche di confronto ({', '.join(POLICIES)})")
+    parser.add_argument("--k", type=int, default=0, help="Candidati considerati per la top-k (0 = tutti)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processi per la rivalutazione di ogni file")
+    parser.add_argument("--report", default=None, help="File json in cui salvare le metriche")
+    args = parser.parse_args()
+
+    unknown = [p for p in args.policy if p not in POLICIES]
+    if unknown:
+        parser.error(f"Politiche sconosciute: {', '.join(unknown)} (disponibili: {', '.join(POLICIES)})")
+
+    files = [f for f in args.files if not f.endswith(".tasks.jsonl")]
+    if not files:
+        sys.exit("Nessun file di risultati da rivalutare.")
+
+    results = []
+    started = time.time()
+    for path in files:
+        if not os.path.exists(path):
+            print(f"[WARN] File {path} non trovato")
+            continue
+        results.append(rescore_file(path, args.policy, args.k, args.workers))
+    elapsed = time.time() - started
+
+    print("\n=== RESCORING SUMMARY ===")
+    print(f"{'file':<60} {'policy':<10} {'record':>8} {'top-1':>8} {'top-k':>8} {'MRR':>7} {'db_hit':>8}")
+    for res in results:
+        db_rate = f"{res['db_hit_rate']:.2%}" if res["db_hit_rate"] is not None else "-"
+        for policy, m in res["policies"].items():
+            print(f"{os.path.basename(res['file']):<60} {policy:<10} {res['records']:>8} {m['top1']:>8.2%} {m['topk']:>8.2%} {m['mrr']:>7.4f} {db_rate:>8}")
+            if "topk_given_db_hit" in m:
+                print(f"{'':<60} {'':<10} hit con db_hit: {m['hits_with_db_hit']} ({m['topk_given_db_hit']:.2%}) | "
+                      f"senza db_hit: {m['hits_without_db_hit']} ({m['topk_given_no_db_hit']:.2%})")
+    records = sum(res["records"] for res in results)
+    print(f"Record rivalutati: {records} in {elapsed:.2f}s")
+
+    if args.report:
+        os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+        with open(args.report, "w", encoding="utf-8") as file:
+            json.dump({"k": args.k, "results": results}, file, indent=2)
+        print(f"Report salvato in: {args.report}")
+
+if __name__ == "__main__":
+    main()
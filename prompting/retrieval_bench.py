@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+# -------------------------
+# INTRODUCTION -> some utils informations about the Python script
+# -------------------------
+
+"""
+- MODALITÀ:
+    Il file contiene la suite di benchmark della fase di retrieval del RAG, per verificare se una modifica al retriever
+    (o un backend alternativo) rende la retrieve più veloce o peggiore. Per ogni finestra di test estratta dal file di
+    sessioni (tipicamente cowrie_TEST.jsonl) si verifica se il vero comando successivo compare tra i next_command dei
+    vicini restituiti (recall@k). Per ogni backend vengono misurati anche:
+
+        - latenza delle query singole (percentili p50 / p95 / p99)
+        - query al secondo con retrieve a batch (retrieve_many)
+        - tempo di costruzione dell'indice del backend (quando viene costruito durante il benchmark)
+        - spazio su disco del DB e degli indici usati
+        - RSS di picco del processo
+
+    Ogni backend è eseguito in un processo dedicato, così l'RSS misurato non dipende dagli altri backend. Il risultato
+    è salvato in un report json (con commit git e parametri della run) per confrontare le run nel tempo.
+
+    Elementi presenti:
+
+        - BACKENDS = registro dei backend (nome -> parametri di VectorContextRetriever e indice da costruire)
+        - register_backend(name: str, description: str, **retriever_kwargs) -> aggiunta di un backend al registro
+        - load_test_windows(sessions_path: str, context_len: int, n: int, seed: int = 0) -> finestre di test (contesto + comando successivo)
+        - bench_backend(name: str, args, windows: List[Dict[str, Any]]) -> misure di un singolo backend
+        - run_benchmark(args) -> esecuzione di tutti i backend richiesti e scrittura del report
+
+- COMANDO PER ESECUZIONE:
+
+    python3 prompting/retrieval_bench.py --sessions output/cowrie_TEST.jsonl --persist-dir ./chroma_storage --backends chroma chroma-vector int8 --context-len 5 --k 1 3 5 10 --n 2000
+
+    dove le varie flag sono:
+    - sessions = file jsonl con le sessioni di test
+    - persist-dir = cartella contenente DB vettoriale
+    - index-file = file jsonl con cui indicizzare il DB prima del benchmark (opzionale, il tempo di indicizzazione viene riportato)
+    - backends = backend da confrontare (vedi BACKENDS)
+    - context-len = numero di comandi di ogni finestra di test
+    - k = valori di k per la recall@k (la retrieve usa il k massimo)
+    - n = numero di finestre di test (0 = tutte le finestre del file)
+    - latency-n = numero di query singole per la misura della latenza
+    - batch-size = contesti per ogni retrieve_many nella misura delle query al secondo
+    - report = file json del report (default output/bench/retrieval_<timestamp>.json)
+"""
+
+# -------------------------
+# IMPORT SECTION -> imports necessary for the Python script
+# -------------------------
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+from utils import peak_rss_mb, percentile
+from quantized_index import QuantizedIndex, store_disk_bytes
+
+# -------------------------
+# BACKEND REGISTRY
+# -------------------------
+
+BACKENDS: Dict[str, Dict[str, Any]] = {}
+
+def register_backend(name: str, description: str, **retriever_kwargs):
+    BACKENDS[name] = {"description": description, "kwargs": retriever_kwargs}
+
+register_backend("chroma", "Collection Chroma + percorso veloce dell'indice esatto (configurazione di default)")
+register_backend("chroma-vector", "Sola ricerca vettoriale sulla collection Chroma (indice esatto disattivato)", use_exact_index=False)
+register_backend("int8", "Indice quantizzato int8 con re-rank float", quantized="int8", use_exact_index=False)
+register_backend("binary", "Indice quantizzato binario con re-rank float", quantized="binary", use_exact_index=False)
+register_backend("lexical", "Indice invertito BM25 sui token dei comandi (nessun embedding)", retrieval_mode="lexical", use_exact_index=False)
+register_backend("hybrid", "Candidati BM25 riordinati con la distanza vettoriale", retrieval_mode="hybrid", use_exact_index=False)
+register_backend("onnx", "Collection Chroma con embedding ONNX su CPU", embedding_backend="onnx", use_exact_index=False)
+register_backend("onnx-int8", "Collection Chroma con embedding ONNX int8 su CPU", embedding_backend="onnx-int8", use_exact_index=False)
+
+# -------------------------
+# FUNCTION SECTION
+# -------------------------
+
+def load_test_windows(sessions_path: str, context_len: int, n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    # Ogni posizione con almeno context_len comandi precedenti è una finestra di test (contesto -> comando successivo)
+    windows = []
+    with open(sessions_path, "r", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip(): continue
+            obj = json.loads(line)
+            cmds = obj.get("commands", [])
+            for i in range(context_len, len(cmds)):
+                windows.append({"session": obj.get("session", "unk"), "context": cmds[i - context_len:i], "expected": cmds[i]})
+    if n > 0 and len(windows) > n:
+        windows = random.Random(seed).sample(windows, n)
+    return windows
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+def bench_backend(name: str, args, windows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # Import locale -> core_rag carica chromadb e il modello di embedding (misurati nell'RSS del backend)
+    import core_rag
+
+    kwargs = dict(BACKENDS[name]["kwargs"])
+    rss_start = peak_rss_mb()
+    build_s = None
+
+    # Indice quantizzato costruito al primo utilizzo -> il tempo di costruzione entra nel report
+    quantized = kwargs.get("quantized")
+    if quantized and not os.path.exists(os.path.join(args.persist_dir, f"quantized_{quantized}", "meta.json")):
+        base = core_rag.VectorContextRetriever(persist_dir=args.persist_dir)
+        started = time.perf_counter()
+        QuantizedIndex.build(base.collection, os.path.join(args.persist_dir, f"quantized_{quantized}"), quantized)
+        build_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    rag = core_rag.VectorContextRetriever(persist_dir=args.persist_dir, **kwargs)
+    rag.retrieve_many([["ls"]], 1)
+    load_s = time.perf_counter() - started
+
+    k_max = max(args.k)
+    contexts = [w["context"] for w in windows]
+
+    # Latenza delle query singole
+    latencies = []
+    for ctx in contexts[:args.latency_n]:
+        t0 = time.perf_counter()
+        rag.retrieve_many([ctx], k_max)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    # Query al secondo con retrieve a batch + recall@k sui risultati
+    rag.exact_lookups, rag.exact_hits = 0, 0
+    started = time.perf_counter()
+    retrieved = []
+    for start in range(0, len(contexts), args.batch_size):
+        retrieved.extend(rag.retrieve_many(contexts[start:start + args.batch_size], k_max, batch_size=args.batch_size))
+    batch_s = time.perf_counter() - started
+
+    recall = {}
+    for k in args.k:
+        hits = sum(core_rag.hit_db_examples(w["expected"], examples[:k]) for w, examples in zip(windows, retrieved))
+        recall[str(k)] = hits / len(windows)
+
+    # Spazio su disco effettivo dei file usati dal backend: collection Chroma oppure store quantizzato autonomo (senza Chroma)
+    disk_bytes = store_disk_bytes(args.persist_dir, quantized)
+
+    return {
+        "backend": name,
+        "description": BACKENDS[name]["description"],
+        "params": kwargs,
+        "vectors": rag.collection.count(),
+        "recall_at_k": recall,
+        "latency_ms": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "p99": percentile(latencies, 99), "queries": len(latencies)},
+        "batch_qps": len(contexts) / batch_s if batch_s > 0 else 0.0,
+        "exact_fast_path_rate": rag.exact_hits / rag.exact_lookups if rag.exact_lookups else 0.0,
+        "load_s": load_s,
+        "build_s": build_s,
+        "disk_bytes": disk_bytes,
+        "rss_mb": {"before_load": rss_start, "peak": peak_rss_mb()},
+    }
+
+def run_benchmark(args) -> Dict[str, Any]:
+    windows = load_test_windows(args.sessions, args.context_len, args.n)
+    if not windows:
+        sys.exit("Nessuna finestra di test trovata: controlla --sessions e --context-len")
+    print(f"[BENCH] Finestre di test: {len(windows)}")
+
+    # Indicizzazione opzionale del DB prima del benchmark (tempo di costruzione della collection Chroma)
+    db_build_s = None
+    if args.index_file:
+        import core_rag
+        rag = core_rag.VectorContextRetriever(persist_dir=args.persist_dir, max_context_len=args.max_context_len)
+        started = time.perf_counter()
+        rag.index_file(args.index_file, max_context_len=args.max_context_len, checkpoint_path=os.path.join(args.persist_dir, "DB_checkpoint.txt"))
+        db_build_s = time.perf_counter() - started
+        del rag
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        windows_path = os.path.join(tmp, "windows.json")
+        with open(windows_path, "w", encoding="utf-8") as file:
+            json.dump(windows, file)
+        for name in args.backends:
+            out_path = os.path.join(tmp, f"{name}.json")
+            cmd = [sys.executable, os.path.abspath(__file__), "--bench-backend", name, "--bench-windows", windows_path, "--bench-out", out_path,
+                   "--sessions", args.sessions, "--persist-dir", args.persist_dir, "--k", *map(str, args.k),
+                   "--latency-n", str(args.latency_n), "--batch-size", str(args.batch_size)]
+            print(f"[BENCH] Backend {name}...")
+            if subprocess.run(cmd).returncode != 0:
+                print(f"[BENCH ERROR] Benchmark del backend {name} fallito")
+                continue
+            with open(out_path, "r", encoding="utf-8") as file:
+                results.append(json.load(file))
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "sessions": args.sessions,
+        "persist_dir": args.persist_dir,
+        "context_len": args.context_len,
+        "windows": len(windows),
+        "k": args.k,
+        "batch_size": args.batch_size,
+        "db_build_s": db_build_s,
+        "backends": results,
+    }
+
+    print("\n=== RETRIEVAL BENCHMARK ===")
+    print(f"Finestre: {len(windows)} | context_len: {args.context_len} | batch: {args.batch_size}")
+    for r in results:
+        recalls = " ".join(f"R@{k} {v:.2%}" for k, v in r["recall_at_k"].items())
+        print(f"{r['backend']:<14} {recalls} | p50 {r['latency_ms']['p50']:.1f} ms p99 {r['latency_ms']['p99']:.1f} ms | "
+              f"{r['batch_qps']:.0f} q/s | disco {r['disk_bytes'] / 2**20:.0f} MB | RSS {r['rss_mb']['peak']:.0f} MB")
+
+    report_path = args.report or os.path.join("output", "bench", f"retrieval_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Report salvato in: {report_path}")
+    return report
+
+# -------------------------
+# MAIN SECTION
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark della retrieve: recall@k, latenza, throughput, disco e RSS")
+    parser.add_argument("--sessions", required=True, help="File jsonl con le sessioni di test")
+    parser.add_argument("--persist-dir", default="./chroma_storage", help="Cartella contenente DB vettoriale")
+    parser.add_argument("--index-file", default=None, help="File jsonl con cui indicizzare il DB prima del benchmark")
+    parser.add_argument("--max-context-len", type=int, default=10, help="Lunghezza massima delle finestre indicizzate (solo con --index-file)")
+    parser.add_argument("--backends", nargs="+", default=["chroma", "chroma-vector"], help=f"Backend da confrontare ({', '.join(BACKENDS)})")
+    parser.add_argument("--context-len", type=int, default=5, help="Numero di comandi di ogni finestra di test")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5, 10], help="Valori di k per la recall@k")
+    parser.add_argument("--n", type=int, default=2000, help="Numero di finestre di test (0 = tutte)")
+    parser.add_argument("--latency-n", type=int, default=200, help="Query singole per la misura della latenza")
+    parser.add_argument("--batch-size", type=int, default=256, help="Contesti per ogni retrieve_many")
+    parser.add_argument("--report", default=None, help="File json del report")
+    # Flag interne -> processo figlio del benchmark (un processo per backend)
+    parser.add_argument("--bench-backend", help=argparse.SUPPRESS)
+    parser.add_argument("--bench-windows", help=argparse.SUPPRESS)
+    parser.add_argument("--bench-out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    unknown = [name for name in args.backends if name not in BACKENDS]
+    if unknown:
+        parser.error(f"Backend sconosciuti: {', '.join(unknown)} (disponibili: {', '.join(BACKENDS)})")
+
+    if args.bench_backend:
+        with open(args.bench_windows, "r", encoding="utf-8") as file:
+            windows = json.load(file)
+        with open(args.bench_out, "w", encoding="utf-8") as file:
+            json.dump(bench_backend(args.bench_backend, args, windows), file)
+        return
+    run_benchmark(args)
+
+if __name__ == "__main__":
+    main()
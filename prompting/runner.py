@@ -0,0 +1,102 @@
+# -------------------------
+# INTRODUCTION -> some utils informations about the Python script
+# -------------------------
+
+"""
+Il file contiene il runner concorrente utilizzato da core_topk.py e core_rag.py per la valutazione delle prediction:
+le richieste al LLM sono inviate da un pool di thread con un numero massimo di richieste in volo (concurrency) e
+la frequenza delle richieste è limitata per provider (token bucket) al posto della pausa fissa di 0.5s dopo ogni task.
+I risultati vengono restituiti nello stesso ordine dei task, per cui la scrittura del file di output e il calcolo
+delle metriche (eseguiti dal chiamante, nel thread principale) sono identici a quelli dell'esecuzione seriale.
+All'interno del file sono presenti i seguenti elementi:
+
+- PROVIDER_RPS = richieste al secondo di default per ogni provider (0 = nessun limite, es. Ollama in locale)
+- Classe RateLimiter:
+    token bucket thread-safe condiviso dai worker del pool:
+    - __init__(self, rps: float, burst: int = 1) -> rps = richieste al secondo consentite, burst = richieste consecutive senza attesa
+    - acquire(self) -> blocca il thread chiamante finchè non è disponibile un token
+- Funzioni:
+    - make_rate_limiter(llm_type: str, rps: float = None) -> limiter per il provider (rps = None -> valore di PROVIDER_RPS)
+    - run_ordered(items: Iterable, worker: Callable, concurrency: int, limiter: RateLimiter = None, needs_call: Callable = None) -> esegue
+        worker(item) sul pool, con al massimo concurrency richieste in volo, e restituisce (item, risultato) nell'ordine degli item.
+        needs_call(item) indica se l'item richiede una chiamata al LLM (e quindi un token del limiter): gli item che non la
+        richiedono (es. risposte del predictor kNN) non consumano token
+"""
+
+# -------------------------
+# IMPORT SECTION -> imports necessary for the Python script
+# -------------------------
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Tuple
+
+# -------------------------
+# CLASS SECTION
+# -------------------------
+
+# Gemini (API remota) ha quote per minuto: il default corrisponde circa al ritmo dell'esecuzione seriale con pausa di 0.5s.
+# Ollama gira in locale: il limite è dato solo dal numero di richieste in volo (vedi OLLAMA_NUM_PARALLEL lato server)
+PROVIDER_RPS = {"gemini": 2.0, "ollama": 0.0}
+
+class RateLimiter:
+
+    def __init__(self, rps: float, burst: int = 1):
+        self.rps = rps
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rps <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rps)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rps
+            time.sleep(wait)
+
+# -------------------------
+# FUNCTION SECTION
+# -------------------------
+
+def make_rate_limiter(llm_type: str, rps: float = None) -> RateLimiter:
+    if rps is None:
+        rps = PROVIDER_RPS.get(llm_type, 0.0)
+    return RateLimiter(rps)
+
+def run_ordered(items: Iterable, worker: Callable[[Any], Any], concurrency: int, limiter: RateLimiter = None,
+                needs_call: Callable[[Any], bool] = None) -> Iterator[Tuple[Any, Any]]:
+
+    def call(item):
+        if limiter is not None and (needs_call is None or needs_call(item)):
+            limiter.acquire()
+        return worker(item)
+
+    # Con concurrency <= 1 l'esecuzione resta seriale nel thread principale
+    if concurrency <= 1:
+        for item in items:
+            yield item, call(item)
+        return
+
+    # Coda FIFO dei future: si attende sempre il più vecchio, quindi l'ordine di uscita è quello degli item.
+    # Le richieste in volo sono al massimo concurrency (thread del pool); la coda ne contiene il doppio, così un task lento
+    # in testa non lascia inattivi i worker che hanno già terminato
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for item in items:
+            pending.append((item, pool.submit(call, item)))
+            if len(pending) >= 2 * concurrency:
+                done_item, future = pending.popleft()
+                yield done_item, future.result()
+        while pending:
+            done_item, future = pending.popleft()
+            yield done_item, future.result()
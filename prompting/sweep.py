@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+# -------------------------
+# INTRODUCTION -> some utils informations about the Python script
+# -------------------------
+
+"""
+- MODALITÀ:
+    Il file contiene il motore di sweep delle valutazioni, per produrre le tabelle di confronto tra configurazioni
+    (k, rag_k, context_len, whitelist, modello, approccio topk o RAG) con una sola esecuzione. Rispetto a lanciare
+    più volte gli script evaluate_*, il lavoro comune viene eseguito una sola volta:
+
+        - i task sono generati una sola volta per ogni context_len (stesso seed -> tutte le configurazioni con la stessa
+          context_len sono valutate sugli stessi task) e salvati nella cartella dello sweep
+        - il DB vettoriale viene aperto una sola volta e, per ogni context_len, la retrieve viene eseguita una sola volta
+          con il rag_k massimo della griglia: le configurazioni con rag_k minore usano i primi rag_k vicini
+        - la cache su disco delle risposte del LLM (llm_cache.py) è condivisa tra le configurazioni e con gli script evaluate_*
+
+    Ogni configurazione produce un file di risultati con lo stesso formato degli script evaluate_* (rivalutabile offline)
+    e una riga della tabella riassuntiva (summary.csv / summary.json nella cartella dello sweep).
+
+    Elementi presenti:
+
+        - METHODS = approcci valutabili (topk, rag)
+        - build_grid(args) -> lista delle configurazioni (prodotto cartesiano dei valori delle flag; whitelist vale solo per topk, rag_k solo per rag)
+        - load_query_model(backend: str) -> funzione di query del LLM (llm_backends.make_query_model: gemini, ollama o mock senza rete)
+        - evaluate_config(cfg, tasks, neighbors, query, args, out_path) -> valutazione di una configurazione e riga della tabella
+        - run_sweep(args) -> esecuzione dello sweep e scrittura della tabella
+
+- COMANDO PER ESECUZIONE:
+
+    python3 prompting/sweep.py --backend ollama --sessions output/cowrie_TEST.jsonl --persist-dir ./chroma_storage --methods topk rag --model codellama llama3 --context-len 3 5 --k 5 --rag-k 1 3 5 --whitelist yes no --n 500 --seed 1
+
+    dove le varie flag sono:
+    - backend = provider del LLM (gemini, ollama o mock = risposte fisse senza rete, per provare la pipeline)
+    - sessions = file jsonl contenente le sessioni per eseguire prediction
+    - persist-dir = cartella contenente DB vettoriale (solo per l'approccio rag)
+    - index-file = file jsonl per indicizzare il DB vettoriale prima dello sweep (opzionale)
+    - max-context-len = lunghezza massima delle finestre indicizzate (solo alla creazione del DB)
+    - embedding-backend / onnx-model-dir / retrieval-mode = configurazione del retriever (vedi evaluate_*_rag.py)
+    - methods = approcci da valutare (topk, rag)
+    - model = modelli da valutare
+    - ollama-url = url per inviare il prompt al modello ollama in locale
+    - keep-alive = tempo di permanenza in memoria del modello sul server Ollama (vedi ollama_client.py)
+    - context-len = valori di context_len
+    - k = valori di k (candidati proposti come next command)
+    - rag-k = valori di rag_k (esempi storici nel prompt, solo rag)
+    - whitelist = valori della flag whitelist (solo topk)
+    - n = numero di task per ogni context_len (0 = uno per ogni sessione valida)
+    - seed = seed della generazione dei task
+    - rag-batch = numero di contesti per ogni retrieve batch al DB vettoriale
+    - concurrency / rps = richieste al LLM in volo e richieste al secondo (vedi runner.py)
+    - llm-cache / cache-mode = cache su disco delle risposte del LLM (vedi llm_cache.py)
+    - output-dir = cartella dello sweep (default output/sweep/sweep_<timestamp>)
+"""
+
+# -------------------------
+# IMPORT SECTION -> imports necessary for the Python script
+# -------------------------
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+import core_topk
+import embeddings
+import eval_tasks
+import llm_backends
+import llm_cache
+import runner
+import utils
+
+# -------------------------
+# FUNCTION SECTION
+# -------------------------
+
+METHODS = ("topk", "rag")
+SUMMARY_FIELDS = ["name", "method", "model", "context_len", "k", "rag_k", "whitelist", "tasks", "top1", "topk",
+                  "empty", "db_hit_rate", "cache_hits", "elapsed_s"]
+
+def build_grid(args) -> List[Dict[str, Any]]:
+    grid = []
+    for method, model, context_len, k in itertools.product(args.methods, args.model, args.context_len, args.k):
+        # La whitelist riguarda solo il prompt topk, rag_k solo il prompt RAG
+        variants = [{"whitelist": w, "rag_k": None} for w in args.whitelist] if method == "topk" else [{"whitelist": None, "rag_k": r} for r in args.rag_k]
+        for variant in variants:
+            cfg = {"method": method, "model": model, "context_len": context_len, "k": k, **variant}
+            suffix = f"wl{variant['whitelist']}" if method == "topk" else f"ragk{variant['rag_k']}"
+            cfg["name"] = f"{method}_{model.replace('/', '-').replace(':', '-')}_ctx{context_len}_k{k}_{suffix}"
+            grid.append(cfg)
+    return grid
+
+def load_query_model(backend: str) -> Callable[..., str]:
+    # Backend condiviso (llm_backends.py): client creato al primo utilizzo, timeout e retry
+    return llm_backends.make_query_model(backend)
+
+def evaluate_config(cfg: Dict[str, Any], tasks: List[Dict[str, Any]], neighbors: List[List[Dict[str, Any]]],
+                    query: Callable[..., str], args, out_path: str) -> Dict[str, Any]:
+    from tqdm import tqdm
+    if cfg["method"] == "rag":
+        import core_rag
+
+    def predict(i):
+        context = tasks[i]["context"]
+        if cfg["method"] == "topk":
+            if cfg["whitelist"] == "no":
+                prompt = core_topk.make_prompt_topk_without_whitelist(context, cfg["k"])
+            else:
+                prompt = core_topk.make_prompt_topk_whitelist(context, cfg["k"])
+        else:
+            # Retrieve eseguita una sola volta con il rag_k massimo: la configurazione usa i primi rag_k vicini
+            prompt = core_rag.make_rag_prompt(context, core_rag.format_examples(neighbors[i][:cfg["rag_k"]]), cfg["k"])
+
+        if args.backend == "gemini":
+            return query(prompt, cfg["model"])
+        else:  # ollama
+            return query(prompt, cfg["model"], args.ollama_url)
+
+    top1_hits = 0
+    topk_hits = 0
+    empty = 0
+    db_hits = 0
+    limiter = runner.make_rate_limiter(args.backend, args.rps)
+    started = time.time()
+
+    with open(out_path, "w", encoding="utf-8") as fout:
+        for i, raw_response in tqdm(runner.run_ordered(range(len(tasks)), predict, args.concurrency, limiter), total=len(tasks), desc=cfg["name"]):
+            task = tasks[i]
+            candidates = []
+            if raw_response:
+                candidates = [utils.clean_ollama_candidate(line) for line in raw_response.splitlines() if line.strip()]
+            candidates = candidates[:cfg["k"]]
+            if not candidates:
+                empty += 1
+
+            hit, hit_rank = utils.score_candidates(task["expected"], candidates)
+            if hit:
+                topk_hits += 1
+                if hit_rank == 1: top1_hits += 1
+
+            # Stesso formato dei record degli script evaluate_*
+            rec = {"session": task["session"], "context": task["context"], "expected": task["expected"],
+                   "candidates": candidates, "hit": hit, "rank": hit_rank if hit else None}
+            if cfg["method"] == "rag":
+                rec["db_hit"] = core_rag.hit_db_examples(task["expected"], neighbors[i][:cfg["rag_k"]])
+                rec["predictor"] = "llm"
+                db_hits += rec["db_hit"]
+            fout.write(json.dumps(rec) + "\n")
+
+    total = len(tasks)
+    return {
+        "name": cfg["name"], "method": cfg["method"], "model": cfg["model"], "context_len": cfg["context_len"],
+        "k": cfg["k"], "rag_k": cfg["rag_k"], "whitelist": cfg["whitelist"], "tasks": total,
+        "top1": top1_hits / total, "topk": topk_hits / total, "empty": empty / total,
+        "db_hit_rate": db_hits / total if cfg["method"] == "rag" else None,
+        "elapsed_s": round(time.time() - started, 2),
+    }
+
+def run_sweep(args) -> List[Dict[str, Any]]:
+    # Import locali -> retrieval_bench (numpy) e tqdm non servono per --help né per la validazione della griglia
+    from tqdm import tqdm
+    from retrieval_bench import git_commit
+    grid = build_grid(args)
+    out_dir = args.output_dir or os.path.join("output", "sweep", f"sweep_{datetime.now():%Y%m%d_%H%M%S}")
+    os.makedirs(out_dir, exist_ok=True)
+    seed = args.seed if args.seed is not None else random.randrange(2**32)
+    print(f"--- Sweep: {len(grid)} configurazioni (seed: {seed}) -> {out_dir} ---")
+
+    # Task condivisi: una sola generazione per ogni context_len, salvata nel formato di eval_tasks (parametri + task)
+    tasks_by_ctx = {}
+    for context_len in sorted({cfg["context_len"] for cfg in grid}):
+        params = {"seed": seed, "sessions": args.sessions, "context_len": context_len, "n": args.n}
+        tasks_by_ctx[context_len] = list(eval_tasks.iter_tasks(args.sessions, context_len, args.n, seed))
+        with open(os.path.join(out_dir, f"tasks_ctx{context_len}.jsonl"), "w", encoding="utf-8") as fout:
+            fout.write(json.dumps(params) + "\n")
+            for task in tasks_by_ctx[context_len]:
+                fout.write(json.dumps(task) + "\n")
+        print(f"Task ctx{context_len}: {len(tasks_by_ctx[context_len])}")
+        if not tasks_by_ctx[context_len]:
+            sys.exit("Nessun task trovato. Controlla il formato del file JSONL.")
+
+    # Retrieve condivisa: DB aperto una sola volta, una retrieve per context_len con il rag_k massimo della griglia
+    neighbors_by_ctx = {}
+    rag_grid = [cfg for cfg in grid if cfg["method"] == "rag"]
+    if rag_grid:
+        import core_rag
+        rag = core_rag.VectorContextRetriever(persist_dir=args.persist_dir, max_context_len=args.max_context_len,
+                                              embedding_backend=args.embedding_backend, onnx_model_dir=args.onnx_model_dir,
+                                              retrieval_mode=args.retrieval_mode)
+        if args.index_file:
+            rag.index_file(args.index_file, max_context_len=args.max_context_len,
+                           checkpoint_path=os.path.join(args.persist_dir, "DB_checkpoint.txt"))
+        max_rag_k = max(cfg["rag_k"] for cfg in rag_grid)
+        for context_len in sorted({cfg["context_len"] for cfg in rag_grid}):
+            tasks = tasks_by_ctx[context_len]
+            neighbors = []
+            for start in tqdm(range(0, len(tasks), args.rag_batch), desc=f"Retrieval ctx{context_len}", unit="batch"):
+                chunk = tasks[start:start + args.rag_batch]
+                neighbors.extend(rag.retrieve_many([task["context"] for task in chunk], max_rag_k, batch_size=args.rag_batch))
+            neighbors_by_ctx[context_len] = neighbors
+
+    # Valutazione delle configurazioni con la cache delle risposte condivisa
+    cache = llm_cache.LLMCache(args.llm_cache, args.cache_mode)
+    query_model = load_query_model(args.backend)
+    if args.backend == "ollama":
+        import ollama_client
+        ollama_client.configure(pool_size=args.concurrency, keep_alive=args.keep_alive)
+    rows = []
+    for cfg in grid:
+        # Le risposte del backend mock non vengono salvate nella cache condivisa
+        query = cache.wrap(query_model, args.backend, cfg["model"]) if args.backend != "mock" else query_model
+        hits_before = cache.hits
+        row = evaluate_config(cfg, tasks_by_ctx[cfg["context_len"]], neighbors_by_ctx.get(cfg["context_len"]), query, args,
+                              os.path.join(out_dir, f"{cfg['name']}.jsonl"))
+        row["cache_hits"] = cache.hits - hits_before
+        rows.append(row)
+    print(cache.summary())
+    cache.close()
+    if args.backend == "ollama":
+        print(ollama_client.get_client(args.ollama_url).stats_summary())
+
+    # Tabella riassuntiva
+    with open(os.path.join(out_dir, "summary.csv"), "w", encoding="utf-8", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(os.path.join(out_dir, "summary.json"), "w", encoding="utf-8") as file:
+        json.dump({"timestamp": datetime.now().isoformat(timespec="seconds"), "git_commit": git_commit(), "backend": args.backend,
+                   "sessions": args.sessions, "seed": seed, "n": args.n, "configs": rows}, file, indent=2)
+
+    print("\n=== SWEEP SUMMARY ===")
+    print(f"{'configurazione':<48} {'task':>6} {'top-1':>8} {'top-k':>8} {'empty':>8} {'db_hit':>8} {'cache':>6}")
+    for row in rows:
+        db_hit = f"{row['db_hit_rate']:.2%}" if row["db_hit_rate"] is not None else "-"
+        print(f"{row['name']:<48} {row['tasks']:>6} {row['top1']:>8.2%} {row['topk']:>8.2%} {row['empty']:>8.2%} {db_hit:>8} {row['cache_hits']:>6}")
+    print(f"Tabella salvata in: {os.path.join(out_dir, 'summary.csv')}")
+    return rows
+
+# -------------------------
+# MAIN SECTION
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep di configurazioni di valutazione con task, retrieve e cache condivisi")
+    parser.add_argument("--backend", choices=["gemini", "ollama", "mock"], required=True, help="Provider del LLM")
+    parser.add_argument("--sessions", required=True, help="File jsonl contenente le sessioni per eseguire prediction")
+    parser.add_argument("--persist-dir", default="./chroma_storage", help="Cartella contenente DB vettoriale (solo rag)")
+    parser.add_argument("--index-file", default=None, help="File jsonl per indicizzare il DB vettoriale prima dello sweep")
+    parser.add_argument("--max-context-len", type=int, default=10, help="Lunghezza massima delle finestre indicizzate (solo alla creazione del DB)")
+    parser.add_argument("--embedding-backend", choices=embeddings.BACKENDS, default="sentence-transformers", help="Backend del modello di embedding")
+    parser.add_argument("--onnx-model-dir", default=embeddings.DEFAULT_MODEL_DIR, help="Cartella del modello ONNX esportato")
+    parser.add_argument("--retrieval-mode", choices=["vector", "lexical", "hybrid"], default="vector", help="Modalità di retrieve")
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=["topk", "rag"], help="Approcci da valutare")
+    parser.add_argument("--model", nargs="+", required=True, help="Modelli da valutare")
+    parser.add_argument("--ollama-url", default="http://localhost:11434/api/generate")
+    parser.add_argument("--keep-alive", default="30m", help="Tempo di permanenza in memoria del modello sul server Ollama")
+    parser.add_argument("--context-len", type=int, nargs="+", default=[5], help="Valori di context_len")
+    parser.add_argument("--k", type=int, nargs="+", default=[5], help="Valori di k")
+    parser.add_argument("--rag-k", type=int, nargs="+", default=[3], help="Valori di rag_k (solo rag)")
+    parser.add_argument("--whitelist", nargs="+", choices=["yes", "no"], default=["no"], help="Valori della flag whitelist (solo topk)")
+    parser.add_argument("--n", type=int, default=0, help="Numero di task per ogni context_len (0 = uno per ogni sessione valida)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed della generazione dei task")
+    parser.add_argument("--rag-batch", type=int, default=256, help="Numero di contesti per ogni retrieve batch al DB vettoriale")
+    parser.add_argument("--concurrency", type=int, default=4, help="Richieste al LLM in volo contemporaneamente (1 = seriale)")
+    parser.add_argument("--rps", type=float, default=None, help="Richieste al secondo verso il LLM (default del provider, 0 = nessun limite)")
+    parser.add_argument("--llm-cache", default=llm_cache.DEFAULT_CACHE_PATH, help="File sqlite della cache delle risposte del LLM")
+    parser.add_argument("--cache-mode", choices=llm_cache.CACHE_MODES, default="rw", help="Modalità della cache: rw, readonly, refresh o off")
+    parser.add_argument("--output-dir", default=None, help="Cartella dello sweep")
+    args = parser.parse_args()
+    run_sweep(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+# -------------------------
+# INTRODUCTION -> some utils informations about the Python script
+# -------------------------
+
+"""
+- MODALITÀ:
+    Il file contiene la contabilità dei token (e del costo stimato) delle chiamate al LLM, usata dagli script evaluate_*
+    (tramite core_topk.py / core_rag.py) e dal defender (copiato nella VM dal role Ansible defender). Ogni chiamata viene
+    registrata con il suo tipo (prediction = predizione dei comandi successivi, defense = generazione degli artefatti di
+    difesa del defender), la sessione di attacco (solo defender), il modello e i token del prompt e generati:
+
+        - i token sono quelli riportati dal provider (usage_metadata di Gemini, prompt_eval_count / eval_count di Ollama);
+          se il provider non li riporta (es. Ollama non conta il prompt già presente nella sua cache) vengono stimati in
+          locale con estimate_tokens e il record è marcato come estimated
+        - il costo è stimato con i prezzi per milione di token di PRICES_PER_MTOK (indicativi, modificabili con un file
+          json passato con --prices); i modelli locali (Ollama) e quelli non presenti costano 0
+        - le risposte lette dalla cache su disco del defender sono registrate con cached = true e non hanno costo
+
+    Le chiamate vengono aggregate per esecuzione (ledger di una valutazione) e per sessione, e scritte una per riga nel
+    file di usage (<output>.usage.jsonl per le valutazioni, output_deception/runtime/token_usage.jsonl per il defender).
+    Il report di questo script legge i file di usage e divide token e costo per tipo di chiamata, modello e sessione, per
+    individuare i percorsi più costosi.
+
+    Elementi presenti:
+
+        - PRICES_PER_MTOK = prezzi indicativi (USD per milione di token del prompt e generati) per modello
+        - estimate_tokens(text: str) -> stima locale dei token di un testo (circa 4 caratteri per token)
+        - call_cost(model: str, prompt_tokens: int, completion_tokens: int, prices: Dict = None) -> costo stimato di una chiamata
+        - usage_path(output_path: str) -> percorso del file di usage, accanto al file dei risultati
+        - Classe TokenLedger:
+            - __init__(self, path: str = None, mode: str = "a") -> path = file jsonl delle chiamate (None = solo aggregati in memoria)
+            - record(self, call_type: str, response, session: str = None) -> registra una risposta (llm_backends.LLMResponse)
+            - start(self, call_type: str) / close(self) -> registrazione automatica di tutte le chiamate dei backend (llm_backends.add_observer)
+            - session_totals(self, session: str) -> totali di una sessione
+            - summary(self) -> stringa con i totali per tipo di chiamata
+        - load_usage(paths: List[str]) -> record dei file di usage
+        - aggregate(records: List[Dict], key: str, prices: Dict = None) -> totali (chiamate, token, costo) per valore di key
+
+- COMANDO PER ESECUZIONE (report dei file di usage):
+
+    python3 prompting/token_usage.py output/rag/gemini/*.usage.jsonl Honeypot/output_deception/runtime/token_usage.jsonl --top-sessions 10
+
+    dove le varie flag sono:
+    - files = file di usage da analizzare
+    - prices = file json con i prezzi per modello ({"modello": [prezzo prompt, prezzo generati]} in USD per milione di token)
+    - top-sessions = numero di sessioni più costose da mostrare (solo per i record con sessione, es. defender)
+"""
+
+# -------------------------
+# IMPORT SECTION -> imports necessary for the Python script
+# -------------------------
+
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+# -------------------------
+# FUNCTION SECTION
+# -------------------------
+
+# Prezzi indicativi in USD per milione di token (prompt, generati): da aggiornare con il listino del provider
+PRICES_PER_MTOK: Dict[str, Tuple[float, float]] = {
+    "gemini-flash-latest": (0.30, 2.50),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-2.5-pro": (1.25, 10.00),
+}
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int, prices: Dict[str, Tuple[float, float]] = None) -> float:
+    price_in, price_out = (prices or PRICES_PER_MTOK).get(model, (0.0, 0.0))
+    return (prompt_tokens * price_in + completion_tokens * price_out) / 1e6
+
+def usage_path(output_path: str) -> str:
+    root, _ = os.path.splitext(output_path)
+    return root + ".usage.jsonl"
+
+def load_usage(paths: List[str]) -> List[Dict[str, Any]]:
+    records = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return records
+
+def aggregate(records: List[Dict[str, Any]], key: str, prices: Dict[str, Tuple[float, float]] = None) -> Dict[str, Dict[str, Any]]:
+    totals = defaultdict(lambda: {"calls": 0, "cached": 0, "errors": 0, "estimated": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0})
+    for rec in records:
+        t = totals[rec.get(key) or "-"]
+        t["calls"] += 1
+        t["cached"] += bool(rec.get("cached"))
+        t["errors"] += bool(rec.get("error"))
+        t["estimated"] += bool(rec.get("estimated"))
+        t["prompt_tokens"] += rec.get("prompt_tokens", 0)
+        t["completion_tokens"] += rec.get("completion_tokens", 0)
+        # Con --prices il costo viene ricalcolato, altrimenti si usa quello registrato al momento della chiamata
+        # Le risposte lette dalla cache non hanno costo (come in TokenLedger.record)
+        if rec.get("cached"):
+            continue
+        if prices is not None:
+            t["cost_usd"] += call_cost(rec.get("model", ""), rec.get("prompt_tokens", 0), rec.get("completion_tokens", 0), prices)
+        else:
+            t["cost_usd"] += rec.get("cost_usd", 0.0)
+    return dict(totals)
+
+# -------------------------
+# CLASS SECTION
+# -------------------------
+
+class TokenLedger:
+
+    def __init__(self, path: str = None, mode: str = "a"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.records: List[Dict[str, Any]] = []
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.file = None
+        self._observer = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.file = open(path, mode, encoding="utf-8")
+
+    def record(self, call_type: str, response, session: Optional[str] = None) -> Dict[str, Any]:
+        rec = {
+            "ts": round(time.time(), 3),
+            "call_type": call_type,
+            "session": session,
+            "backend": response.backend,
+            "model": response.model,
+            "prompt_tokens": response.prompt_tokens,
+            "completion_tokens": response.completion_tokens,
+            "estimated": bool(response.meta.get("estimated_tokens")),
+            "cached": response.cached,
+            "error": response.error is not None,
+            "latency_s": round(response.latency_s, 4),
+            "cost_usd": 0.0 if response.cached else call_cost(response.model, response.prompt_tokens, response.completion_tokens),
+        }
+        with self.lock:
+            self.records.append(rec)
+            if session is not None:
+                totals = self.sessions.setdefault(session, {"calls": 0, "knn": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0})
+                # Le risposte del predictor kNN non sono chiamate al LLM
+                totals["knn" if rec["backend"] == "knn" else "calls"] += 1
+                totals["prompt_tokens"] += rec["prompt_tokens"]
+                totals["completion_tokens"] += rec["completion_tokens"]
+                totals["cost_usd"] += rec["cost_usd"]
+            if self.file is not None:
+                self.file.write(json.dumps(rec) + "\n")
+                self.file.flush()
+        return rec
+
+    def start(self, call_type: str):
+        # Import locale -> il report (main) non richiede i backend
+        import llm_backends
+        self._observer = lambda response: self.record(call_type, response)
+        llm_backends.add_observer(self._observer)
+        return self
+
+    def close(self):
+        if self._observer is not None:
+            import llm_backends
+            llm_backends.remove_observer(self._observer)
+            self._observer = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def session_totals(self, session: str) -> Dict[str, Any]:
+        with self.lock:
+            return dict(self.sessions.get(session, {"calls": 0, "knn": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0}))
+
+    def summary(self) -> str:
+        with self.lock:
+            # Un gruppo per tipo di chiamata e backend: le risposte del predictor kNN (backend knn) non sono sommate alle chiamate al LLM
+            totals = aggregate([dict(rec, group=f"{rec['call_type']} ({rec['backend']})") for rec in self.records], "group")
+        if not totals:
+            return "Token: nessuna chiamata al LLM"
+        lines = []
+        for group, t in totals.items():
+            lines.append(f"Token {group}: {t['calls']} chiamate | prompt {t['prompt_tokens']} generati {t['completion_tokens']} "
+                         f"| costo stimato ${t['cost_usd']:.4f}" + (f" ({t['estimated']} stimate in locale)" if t["estimated"] else ""))
+        if self.path:
+            lines.append(f"Usage: {self.path}")
+        return "\n".join(lines)
+
+# -------------------------
+# MAIN SECTION
+# -------------------------
+
+def print_table(title: str, totals: Dict[str, Dict[str, Any]], limit: int = 0):
+    rows = sorted(totals.items(), key=lambda item: item[1]["cost_usd"], reverse=True)
+    if limit:
+        rows = rows[:limit]
+    grand_cost = sum(t["cost_usd"] for t in totals.values())
+    print(f"\n=== {title} ===")
+    print(f"{'':<40} {'chiamate':>9} {'cached':>7} {'prompt':>12} {'generati':>12} {'costo $':>10} {'quota':>7}")
+    for name, t in rows:
+        share = t["cost_usd"] / grand_cost if grand_cost else 0.0
+        print(f"{str(name)[:40]:<40} {t['calls']:>9} {t['cached']:>7} {t['prompt_tokens']:>12} {t['completion_tokens']:>12} {t['cost_usd']:>10.4f} {share:>7.1%}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Report di token e costo stimato dei file di usage")
+    parser.add_argument("files", nargs="+", help="File di usage (*.usage.jsonl, token_usage.jsonl del defender)")
+    parser.add_argument("--prices", default=None, help="File json con i prezzi per modello (USD per milione di token: [prompt, generati])")
+    parser.add_argument("--top-sessions", type=int, default=10, help="Sessioni più costose da mostrare")
+    args = parser.parse_args()
+
+    prices = None
+    if args.prices:
+        with open(args.prices, "r", encoding="utf-8") as file:
+            prices = {model: tuple(pair) for model, pair in json.load(file).items()}
+
+    missing = [f for f in args.files if not os.path.exists(f)]
+    if missing:
+        sys.exit(f"Errore: file non trovati: {', '.join(missing)}")
+    records = load_usage(args.files)
+    if not records:
+        sys.exit("Nessuna chiamata registrata nei file di usage.")
+
+    print_table("TOKEN PER TIPO DI CHIAMATA", aggregate(records, "call_type", prices))
+    print_table("TOKEN PER MODELLO", aggregate(records, "model", prices))
+    with_session = [rec for rec in records if rec.get("session")]
+    if with_session:
+        sessions = aggregate(with_session, "session", prices)
+        print_table(f"SESSIONI PIÙ COSTOSE ({len(sessions)} sessioni)", sessions, args.top_sessions)
+        costs = [t["cost_usd"] for t in sessions.values()]
+        print(f"Costo medio per sessione: ${sum(costs) / len(costs):.4f}")
+
+if __name__ == "__main__":
+    main()
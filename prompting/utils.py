@@ -3,18 +3,28 @@
 # -------------------------
 
 """
-Il file contiene due funzoni di utilità che vengono utilizzate nei diversi script progettati.
+Il file contiene le funzioni di utilità che vengono utilizzate nei diversi script progettati.
 Le funzioni presenti sono:
 
+- normalize_command(cmd: str) -> str = normalizzazione di un comando del dataset (maschera segreti, file temporanei, URL e IP), condivisa da
+    inspectDataset/analyze_and_clean.py (dataset offline) e dal defender (sessioni live), così i vettori live sono confrontabili con quelli offline
 - normalize_for_compare(cmd: str) -> List[Tuple[str, str]] = normalizzazione dei comandi, con supporto del pipelining.
 - clean_ollama_candidate(line: str) = funzione utilizzata per "pulire" la risposta di LLM ollama, fortemente indicizzata e verbosa (caratteristica del modello)
+- score_candidates(expected: str, candidates: List[str]) -> Tuple[bool, int] = confronto dei candidati con il comando expected (hit e rank del primo candidato corretto),
+    condiviso da core_topk.py e core_rag.py
+- percentile(values: List[float], q: float) -> float = percentile con interpolazione lineare (come np.percentile, senza numpy), usato dalle
+    metriche di latenza (live_metrics.py, ollama_client.py) e dai benchmark (embeddings.py, retrieval_bench.py, hnsw_sweep.py)
+- peak_rss_mb() -> float = picco di memoria residente del processo in MB (benchmark di embeddings.py e retrieval_bench.py)
 """
 
 # -------------------------
 # IMPORT SECTION -> imports necessary for the Python script
 # -------------------------
 
+import math
 import re
+import resource
+import sys
 from typing import List, Tuple
 
 # -------------------------
@@ -26,6 +36,20 @@ PATH_RE = re.compile(r"(/[^ ]+|\.{1,2}/[^ ]+)")    # path-like
 PLACEHOLDER_RE = re.compile(r"<[^>]+>")  # qualunque <...>
 CODE_FENCE_RE = re.compile(r'```(?:bash|sh)?\s*(.*?)\s*```', re.S | re.I)
 
+def normalize_command(cmd: str) -> str:
+    cmd = cmd.strip()
+    cmd = re.sub(r'^CMD:\s*', '', cmd)
+    cmd = re.sub(r'echo\s+-e\s+"[^"]+"(\|passwd\|bash)?', 'echo <SECRET>|passwd', cmd)
+    cmd = re.sub(r'echo\s+"[^"]+"\|passwd', 'echo <SECRET>|passwd', cmd)
+    cmd = re.sub(r'/var/tmp/[\.\w-]*\d{3,}', '/var/tmp/<FILE>', cmd)
+    cmd = re.sub(r'/tmp/[\.\w-]*\d{3,}', '/tmp/<FILE>', cmd)
+    cmd = re.sub(r'\b[\w\.-]+\.(log|txt|sh|bin|exe|tgz|gz)\b', '<FILE>', cmd)
+    cmd = re.sub(r'(https?|ftp)://\S+', '<URL>', cmd)
+    cmd = re.sub(r'\b\d{1,3}(?:\.\d{1,3}){3}\b', '<IP>', cmd)
+    cmd = re.sub(r'echo\s+"admin\s+[^"]+"', 'echo "admin <SECRET>"', cmd)
+    cmd = re.sub(r'\s+', ' ', cmd).strip()
+    return cmd
+
 def normalize_for_compare(cmd: str) -> List[Tuple[str, str]]:
     if not cmd:
         return []
@@ -78,4 +102,49 @@ def clean_ollama_candidate(line: str) -> str:
     line = line.strip()
     line = re.sub(r"^\d+\.\s*", "", line)   # rimuove "1. "
     line = line.strip("`")                  # rimuove backticks
-    return line.strip()
\ No newline at end of file
+    return line.strip()
+
+def score_candidates(expected: str, candidates: List[str]) -> Tuple[bool, int]:
+    # Per ogni candidato prodotto, normalizzo il contenuto e verifico sia uguale al contenuto del comando expected
+    hit = False
+    hit_rank = 0
+    norm_expected = normalize_for_compare(expected)
+    if not norm_expected: 
+        sys.exit(f"Errore: Comando expected non trovato")
+
+    for rnk, cand in enumerate(candidates, 1):
+        norm_cand = normalize_for_compare(cand)
+        if len(norm_cand) == len(norm_expected):
+            i = 0
+            while i < len(norm_expected):
+                exp_name, exp_path = norm_expected[0]
+                cand_name, cand_path = norm_cand[0]
+                # Confronto prima il comando e poi l'eventuale path
+                if (exp_name == cand_name): 
+                    if not exp_path or not cand_path or exp_path in cand_path or cand_path in exp_path:
+                        hit = True
+                        hit_rank = rnk
+                        break
+                else: 
+                    break
+                i+=1
+            # Un candidato corrisponde all'expected, esco dal ciclo
+            if hit:
+                break
+    return hit, hit_rank
+
+def peak_rss_mb() -> float:
+    # ru_maxrss è espresso in KB su Linux e in byte su macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 1024
+
+def percentile(values: List[float], q: float) -> float:
+    # Interpolazione lineare come np.percentile, senza numpy: live_metrics.py e ollama_client.py non devono pagarne l'import
+    # all'avvio degli script evaluate_*
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    low = math.floor(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return float(ordered[low] + (ordered[high] - ordered[low]) * (pos - low))